@@ -0,0 +1,70 @@
+from circuit import Circuit
+from scipy import sparse
+from scipy.sparse.linalg import splu
+import numpy as np
+
+
+class AC(object):
+    # 直流動作点まわりで線形化した小信号(AC)解析
+    # MOSは gm / gds、抵抗は 1/R、コンデンサは jωC に置き換え、周波数ごとに複素の連立1次方程式を解く
+    # source = (素子, 端子名) は入力にする固定端子(例: (nmos1, 'Vg'))．振幅1の入力に対する
+    # 各FreeWireの応答(伝達関数)を返す
+    def __init__(self, wires, source, solve=True, sparse=None):
+        self.circuit = Circuit(wires, sparse=sparse)
+        self.compiled = self.circuit.compiled
+        device, terminal = source
+        matches = [k for k, (d, t) in enumerate(self.compiled.fixed) if d is device and t == terminal]
+        if not matches:
+            raise ValueError('AC: source must be a terminal not connected to any FreeWire')
+        self.source = self.compiled.n + matches[0]  # 入力のノード番号
+        if solve:
+            self.circuit.solve()  # 動作点
+        self.linearize()
+
+    def _matrix(self, values):
+        # evaluate の非ゼロ要素から、FreeWireの行 × 全ノードの列の疎行列を作る
+        c = self.compiled
+        rows = c.rows < c.n
+        return sparse.csr_matrix((values[rows], (c.rows[rows], c.cols[rows])),
+                                 shape=(c.n, c.n + c.m))
+
+    def linearize(self):
+        # 現在の各FreeWireの電圧(動作点)で コンダクタンス行列 G と 容量行列 B を作る
+        # Y(ω) = G + jωB．B はコンデンサのコンパニオンモデルで geq = C としたときの増分
+        c = self.compiled
+        c.update()
+        v = np.array([wire.voltage for wire in self.circuit.wires], dtype=float)
+        c.set_companion()
+        G = self._matrix(c.evaluate(v)[1])
+        c.set_companion(geq=c.C)
+        B = self._matrix(c.evaluate(v)[1]) - G
+        c.set_companion()
+
+        gmin = sparse.diags(np.full(c.n, -1e-12), shape=(c.n, c.n + c.m))  # Newton法と同じ
+        G = (G + gmin).tocsc()
+        B = B.tocsc()
+        self.G, self.B = G[:, :c.n], B[:, :c.n]
+        self.G_in, self.B_in = G[:, self.source].toarray()[:, 0], B[:, self.source].toarray()[:, 0]
+        return self.G, self.B
+
+    def run(self, frequencies):
+        # frequencies [Hz] ごとの伝達関数 H (周波数数, FreeWire数) を返す
+        # dv = -(G + jωB)^-1 (g_in + jω b_in) * (入力振幅 = 1)
+        self.frequencies = np.atleast_1d(np.asarray(frequencies, dtype=float))
+        omega = 2 * np.pi * self.frequencies
+        rhs = -(self.G_in[None, :] + 1j * omega[:, None] * self.B_in[None, :])
+        if not self.compiled.sparse:
+            Y = self.G.toarray()[None] + 1j * omega[:, None, None] * self.B.toarray()[None]
+            self.H = np.linalg.solve(Y, rhs[..., None])[..., 0]
+        else:
+            self.H = np.array([splu((self.G + 1j * w * self.B).tocsc()).solve(b)
+                               for w, b in zip(omega, rhs)])
+        return self.H
+
+    def gain(self, wire):
+        # wire の利得(振幅比)
+        return np.abs(self.H[:, self.circuit.wires.index(wire)])
+
+    def phase(self, wire):
+        # wire の位相[deg]
+        return np.angle(self.H[:, self.circuit.wires.index(wire)], deg=True)
@@ -0,0 +1,188 @@
+# 各回路の解析にかかる時間・素子評価回数・ソルバーの反復回数・ピークメモリを測るベンチマーク
+# 描画なし(plotを呼ばない)で、掃引点数を変えて測る
+#
+#   python benchmark.py                 # benchmark_baseline.json と比べて、悪化していたら終了コード1
+#   python benchmark.py --update        # 今の結果を基準値として保存
+#   python benchmark.py --threshold 0.5 # 許容する悪化率(既定 0.25 = 25%)
+#   python benchmark.py --case DiffAmp  # 名前に含む文字列で絞り込み
+#
+# 時間は実行環境に依存するので、基準値は測るマシンで --update して作り直すこと
+
+from contextlib import contextmanager, redirect_stdout
+import argparse
+import io
+import json
+import os
+import sys
+import time
+import tracemalloc
+import numpy as np
+
+import circuit
+import device
+from common_source import CSTimeVout, CSVinVout, CSVinRdgmRd
+from current_mirror import CurrentMirror
+from diff_amp import DiffAmp
+from inverter import Inverter
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+METRICS = ('time', 'current_law', 'device_points', 'iterations', 'peak_kb')
+# 計測のばらつきを吸収する絶対的な余裕．これ以下の増加は悪化とみなさない
+SLACK = {'time': 5e-3, 'peak_kb': 16.0}
+
+# (名前, 解析を1回実行する関数(掃引点数), 掃引点数のリスト)
+CASES = [
+    ('Inverter/batch', lambda n: Inverter('pMOS', 'L', 1, points=n), (100, 1000, 10000)),
+    ('Inverter/scalar', lambda n: Inverter('pMOS', 'L', 1, batch=False, points=n), (100, 1000)),
+    ('Inverter/adaptive', lambda tol: Inverter('pMOS', 'L', 1, adaptive=True, tol=tol), (1e-3, 1e-4)),
+    ('CSVinVout/batch', lambda n: CSVinVout(points=n), (100, 1000, 10000)),
+    ('CSVinVout/scalar', lambda n: CSVinVout(batch=False, points=n), (100, 1000)),
+    # 適応掃引は掃引点数の代わりに許容誤差 tol を変える
+    ('CSVinVout/adaptive', lambda tol: CSVinVout(adaptive=True, tol=tol), (1e-3, 1e-4)),
+    ('CSTimeVout/batch', lambda n: CSTimeVout(points=n), (100, 1000)),
+    ('CSTimeVout/scalar', lambda n: CSTimeVout(batch=False, points=n), (100, 1000)),
+    ('CSTimeVout/transient', lambda n: CSTimeVout(CL=4e-4, points=n), (100, 1000)),
+    ('CSVinRdgmRd', lambda n: CSVinRdgmRd(points=n), (10, 30, 200)),
+    ('CurrentMirror/batch', lambda n: CurrentMirror(points=n), (100, 1000)),
+    ('CurrentMirror/scalar', lambda n: CurrentMirror(batch=False, points=n), (100, 1000)),
+    ('DiffAmp/newton', lambda n: DiffAmp(points=n), (100, 1000)),
+    ('DiffAmp/relaxation', lambda n: DiffAmp(solver='relaxation', points=n), (100, 1000)),
+]
+
+
+def _wrap(owner, name, wrapper):
+    # owner.name を wrapper(元の関数) に差し替え、元に戻す関数を返す
+    original = getattr(owner, name)
+    setattr(owner, name, wrapper(original))
+    return lambda: setattr(owner, name, original)
+
+
+@contextmanager
+def count_evaluations():
+    # current_law の呼び出し回数、MOSの評価点数(スカラー1回 = 1点、配列は要素数)、
+    # バッチ / Newton法の反復回数を数える
+    counts = {'current_law': 0, 'device_points': 0, 'iterations': 0}
+
+    def calls(key):
+        def wrapper(function):
+            def counted(*args, **kwargs):
+                counts[key] += 1
+                return function(*args, **kwargs)
+            return counted
+        return wrapper
+
+    def points(function):
+        def counted(*args, **kwargs):
+            result = function(*args, **kwargs)
+            counts['device_points'] += np.size(result[0])
+            return result
+        return counted
+
+    def iterations(index):
+        def wrapper(function):
+            def counted(*args, **kwargs):
+                result = function(*args, **kwargs)
+                counts['iterations'] += result if index is None else result[index]
+                return result
+            return counted
+        return wrapper
+
+    restore = [_wrap(device.FreeWire, 'current_law', calls('current_law')),
+               _wrap(device.MOS, '_evaluate_Id', calls('device_points')),
+               _wrap(device, 'small_signal', points),
+               _wrap(device, 'square_law', points),
+               _wrap(circuit, 'small_signal', points),
+               _wrap(device.FreeWire, 'optimisation_batch', iterations(None)),
+               _wrap(circuit.CompiledCircuit, 'newton', iterations(1))]
+    try:
+        yield counts
+    finally:
+        for undo in reversed(restore):
+            undo()
+
+
+def measure(run, points, repeat=3):
+    # 時間は repeat 回の最小値．回数とピークメモリは別の1回で測る(tracemallocで遅くなるため)
+    elapsed = []
+    with redirect_stdout(io.StringIO()):
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run(points)
+            elapsed.append(time.perf_counter() - start)
+
+        with count_evaluations() as counts:
+            tracemalloc.start()
+            try:
+                run(points)
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+
+    result = {'time': min(elapsed), 'peak_kb': peak / 1024}
+    result.update(counts)
+    return result
+
+
+def run_all(pattern=None, repeat=3):
+    results = {}
+    for name, run, sizes in CASES:
+        if pattern is not None and pattern not in name:
+            continue
+        for points in sizes:
+            key = '{0}[{1}]'.format(name, points)
+            results[key] = measure(run, points, repeat)
+            print('{0:32s} '.format(key) + '  '.join(
+                '{0}={1:.4g}'.format(metric, results[key][metric]) for metric in METRICS), flush=True)
+    return results
+
+
+def compare(results, baseline, threshold):
+    # 基準値より threshold の割合を超えて増えた指標を列挙する
+    regressions = []
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+        for metric in METRICS:
+            old, new = baseline[key].get(metric), result[metric]
+            if old is not None and new > old * (1 + threshold) + SLACK.get(metric, 0):
+                regressions.append('{0} {1}: {2:.4g} -> {3:.4g} ({4:+.0%})'.format(
+                    key, metric, old, new, new / old - 1 if old else np.inf))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='solver / circuit benchmarks')
+    parser.add_argument('--update', action='store_true', help='store the results as the baseline')
+    parser.add_argument('--threshold', type=float, default=0.25, help='allowed relative regression')
+    parser.add_argument('--case', default=None, help='run only cases whose name contains this')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--baseline', default=BASELINE)
+    args = parser.parse_args(argv)
+
+    results = run_all(args.case, args.repeat)
+
+    if args.update:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print('baseline written to {0}'.format(args.baseline))
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print('no baseline ({0}); run with --update first'.format(args.baseline))
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.threshold)
+    for line in regressions:
+        print('REGRESSION ' + line)
+    print('{0} regression(s) beyond {1:.0%}'.format(len(regressions), args.threshold))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,92 @@
+# 長い格子掃引のチェックポイントと再開
+# 格子をタイルに分けて順に計算し、終わったタイルまでの結果を定期的に .npz に保存する
+# 同じパスで実行し直すと、保存済みのタイルは飛ばして続きから計算する
+#
+#   result = tiled_sweep(task, (200, 200), ('gmRd',), tile=(8, 200), checkpoint='grid.npz')
+#
+# task(slices) は格子の一部 (slice, slice, ...) を受け取り、{列名: そのタイルの配列} を返す関数
+# 列は名前のタプルか {列名: 1点分の形}(格子の各点がベクトルのとき)
+# 中断しなかったときとビット単位で同じ結果にするため、タイルの値はそのタイルの位置だけで
+# 決まるようにすること(前のタイルの解を初期値に使う場合も、その値を位置から決める)
+
+import itertools
+import os
+import time
+import numpy as np
+
+
+def tiles(shape, tile):
+    # 格子 shape を tile の大きさで区切ったスライスの組を、C順に並べて返す
+    ranges = [range(0, size, step) for size, step in zip(shape, tile)]
+    return [tuple(slice(start, min(start + step, size))
+                  for start, step, size in zip(starts, tile, shape))
+            for starts in itertools.product(*ranges)]
+
+
+class Checkpoint(object):
+    # path に {列名: 格子全体の配列}、終わったタイルのマスク done、照合用の shape / tile / key を保存する
+    # key は掃引の設定(軸の値など)を表す文字列．保存時と違えば別の計算とみなして例外にする
+    def __init__(self, path, interval=60.0, key=''):
+        self.path = path
+        self.interval = interval  # 保存の間隔[s]
+        self.key = key
+        self._saved = time.monotonic()
+
+    def load(self, shape, tile, columns, dtype=float):
+        # 保存があれば読み込み、無ければ空の結果を作る．(結果, done) を返す
+        count = len(tiles(shape, tile))
+        if not os.path.exists(self.path):
+            arrays = {name: np.full(shape + point, np.nan, dtype=dtype)
+                      for name, point in columns.items()}
+            return arrays, np.zeros(count, dtype=bool)
+
+        with np.load(self.path) as saved:
+            if (tuple(saved['shape']) != tuple(shape) or tuple(saved['tile']) != tuple(tile)
+                    or str(saved['key']) != self.key
+                    or any(name not in saved for name in columns)):
+                raise ValueError('Checkpoint: {0} belongs to a different sweep'.format(self.path))
+            arrays = {name: saved[name].astype(dtype) for name in columns}
+            return arrays, saved['done'].copy()
+
+    def save(self, arrays, done, shape, tile):
+        # 書き込み途中で止まっても前の保存が壊れないよう、一時ファイルに書いてから置き換える
+        temporary = self.path + '.tmp.npz'
+        np.savez(temporary, done=done, shape=np.asarray(shape), tile=np.asarray(tile),
+                 key=np.asarray(self.key), **arrays)
+        os.replace(temporary, self.path)
+        self._saved = time.monotonic()
+
+    def due(self):
+        return time.monotonic() - self._saved >= self.interval
+
+
+def tiled_sweep(task, shape, columns, tile=None, checkpoint=None, interval=60.0, key=''):
+    # shape の格子をタイルごとに task で計算して {列名: 格子全体の配列} を返す
+    # checkpoint(パス)を渡すと interval 秒ごと・例外で止まったとき・最後に保存し、次回はそこから再開する
+    shape = tuple(shape)
+    tile = shape if tile is None else tuple(tile)
+    if not isinstance(columns, dict):
+        columns = dict.fromkeys(columns, ())
+    columns = {name: tuple(point) for name, point in columns.items()}
+    blocks = tiles(shape, tile)
+    if checkpoint is None:
+        arrays = {name: np.full(shape + point, np.nan) for name, point in columns.items()}
+        done = np.zeros(len(blocks), dtype=bool)
+    else:
+        checkpoint = Checkpoint(checkpoint, interval, key)
+        arrays, done = checkpoint.load(shape, tile, columns)
+
+    try:
+        for k, slices in enumerate(blocks):
+            if done[k]:
+                continue
+            result = task(slices)
+            for name in columns:
+                arrays[name][slices] = result[name]
+            done[k] = True
+            if checkpoint is not None and checkpoint.due():
+                checkpoint.save(arrays, done, shape, tile)
+    finally:
+        if checkpoint is not None:
+            checkpoint.save(arrays, done, shape, tile)
+    return arrays
@@ -0,0 +1,753 @@
+from device import MOS
+from device import nMOS
+from device import Resistor
+from device import Capacitor
+from device import small_signal
+from device import REGION_NAMES, REGION_COLORS
+from scipy import sparse
+from scipy.sparse import csgraph
+from scipy.sparse.linalg import splu
+import heapq
+import numpy as np
+
+
+# FreeWireの接続リスト名と、素子側の端子名の対応
+TERMINALS = {'Gate': 'Vg', 'Drain': 'Vd', 'Source': 'Vs',
+             'ResistHi': 'Vh', 'ResistLo': 'Vl', 'CapA': 'Va', 'CapB': 'Vb'}
+# これより多いFreeWireを持つ回路は、ヤコビアンを疎行列にしてLU分解で解く
+SPARSE_NODES = 64
+
+
+def connections(wires):
+    # 素子ごとに、どの端子がどのFreeWire(のindex)に繋がっているかを集める
+    devices, nodes = [], {}
+    for i, wire in enumerate(wires):
+        for name, terminal in TERMINALS.items():
+            for device in wire.__dict__[name]:
+                if id(device) not in nodes:
+                    devices.append(device)
+                    nodes[id(device)] = {}
+                nodes[id(device)][terminal] = i
+    return devices, nodes
+
+
+def dependencies(wires):
+    # ノードの依存グラフ(疎行列)．[i, j] が非ゼロなら FreeWire i のKCLが FreeWire j の電圧に依存する
+    # 電流が流れ込む端子(MOSのD / S、抵抗の両端)が i にある素子の、各端子が繋がる先が依存先
+    # ゲートだけの接続(ゲートリーク無し)とコンデンサ(直流では開放)は依存にならない
+    devices, nodes = connections(wires)
+    rows, cols = [], []
+    for device in devices:
+        if isinstance(device, MOS):
+            flowing = ('Vd', 'Vs')
+        elif isinstance(device, Resistor):
+            flowing = ('Vh', 'Vl')
+        else:
+            continue
+        terminals = nodes[id(device)]
+        for terminal in flowing:
+            if terminal in terminals:
+                rows.extend([terminals[terminal]] * len(terminals))
+                cols.extend(terminals.values())
+    n = len(wires)
+    return sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(n, n))
+
+
+def schedule(wires):
+    # 依存グラフの強連結成分(互いに依存し合うFreeWireのブロック)を、依存される側が先になる順に並べる
+    # 各ブロックは wires の index のリスト．この順に解けば、前のブロックを解き直す必要はない
+    # 順序に自由がある所は、先頭のFreeWireが wires の前にあるブロックから
+    graph = dependencies(wires)
+    count, labels = csgraph.connected_components(graph, directed=True, connection='strong')
+    members = [[] for _ in range(count)]
+    for i, label in enumerate(labels):
+        members[label].append(i)
+
+    rows, cols = graph.nonzero()
+    waiting = np.zeros(count, dtype=int)  # まだ解いていない依存先のブロック数
+    dependents = [[] for _ in range(count)]
+    for a, b in set(zip(labels[rows].tolist(), labels[cols].tolist())):
+        if a != b:
+            waiting[a] += 1
+            dependents[b].append(a)
+    ready = [(members[k][0], k) for k in range(count) if waiting[k] == 0]
+    heapq.heapify(ready)
+    order = []
+    while ready:
+        _, k = heapq.heappop(ready)
+        order.append(members[k])
+        for a in dependents[k]:
+            waiting[a] -= 1
+            if waiting[a] == 0:
+                heapq.heappush(ready, (members[a][0], a))
+    return order
+
+
+def _unchanged(values, saved):
+    # values が saved(前回の値)と全部同じか．配列は中身で比べる
+    for value, old in zip(values, saved):
+        if value is old:
+            continue
+        if isinstance(value, np.ndarray) or isinstance(old, np.ndarray):
+            if np.shape(value) != np.shape(old) or not np.array_equal(value, old):
+                return False
+        elif value != old:
+            return False
+    return True
+
+
+def _stack(values):
+    # 素子ごとの値(スカラー or 掃引用の配列)を最後の軸に並べる
+    try:
+        stacked = np.array(values, dtype=float)
+        if stacked.ndim == 1:
+            return stacked  # 全部スカラー
+    except ValueError:
+        pass  # スカラーと配列が混ざっている
+    return np.stack(np.broadcast_arrays(*[np.asarray(v, dtype=float) for v in values]), axis=-1)
+
+
+def _scatter(values, index, size):
+    # values[..., k] を index[k] の位置へ足し込む．先頭の軸はバッチとしてそのまま残す
+    lead = values.shape[:-1]
+    batch = int(np.prod(lead))
+    offset = (size * np.arange(batch))[:, None] + index
+    out = np.bincount(offset.ravel(), weights=values.reshape(batch, -1).ravel(),
+                      minlength=batch * size)
+    return out.reshape(lead + (size,))
+
+
+class CompiledCircuit(object):
+    # FreeWire / MOS / Resistor / Capacitor のつながりをフラットな配列に変換したもの
+    # ノード番号 0..n-1 がFreeWire、n..n+m-1 がFreeWireに繋がっていない(固定の)端子
+    # 残差とヤコビアンは素子の属性を参照せず、NumPyの配列演算だけで評価する
+    # 端子電圧やパラメータが配列なら、先頭の軸をバッチとして全点まとめて扱う
+    # sparse=True ならヤコビアンを密行列にせず、CSC形式の疎行列で組み立てて解く(None: ノード数で自動)
+    params = ('W', 'L', 'mu', 'Cox', 'Vth', 'lmd')
+
+    def __init__(self, wires, sparse=None):
+        self.wires = list(wires)
+        self.n = len(self.wires)
+        devices, nodes = connections(self.wires)
+        self.mos = [device for device in devices if isinstance(device, MOS)]
+        self.resistors = [device for device in devices if isinstance(device, Resistor)]
+        self.capacitors = [device for device in devices if isinstance(device, Capacitor)]
+
+        # FreeWireに繋がっていない端子は、固定ノードとして1つずつ番号を振る
+        self.fixed = []
+
+        def index(device, terminal):
+            if terminal in nodes[id(device)]:
+                return nodes[id(device)][terminal]
+            self.fixed.append((device, terminal))
+            return self.n + len(self.fixed) - 1
+
+        self.g = np.array([index(mos, 'Vg') for mos in self.mos], dtype=int)
+        self.d = np.array([index(mos, 'Vd') for mos in self.mos], dtype=int)
+        self.s = np.array([index(mos, 'Vs') for mos in self.mos], dtype=int)
+        self.hi = np.array([index(R, 'Vh') for R in self.resistors], dtype=int)
+        self.lo = np.array([index(R, 'Vl') for R in self.resistors], dtype=int)
+        self.a = np.array([index(C, 'Va') for C in self.capacitors], dtype=int)
+        self.b = np.array([index(C, 'Vb') for C in self.capacitors], dtype=int)
+        self.m = len(self.fixed)
+        self.polarity = np.array([1 if isinstance(mos, nMOS) else -1 for mos in self.mos],
+                                 dtype=float)
+        # D / S のどちらかがFreeWireに繋がっているMOS．それ以外(ゲートだけ繋がっている)は
+        # ソルバーが向きの制約を変えられないので feasible の判定に入れない
+        self._bounded = (self.d < self.n) | (self.s < self.n)
+
+        # ヤコビアンの非ゼロ要素の(行, 列)．MOSは (D, S) × (G, D, S)、
+        # 抵抗は (Hi, Lo) × (Hi, Lo)、コンデンサは (A, B) × (A, B)．並びは evaluate が返す values と同じ
+        self.rows = np.concatenate([self.d] * 3 + [self.s] * 3 + [self.hi] * 2 + [self.lo] * 2
+                                   + [self.a] * 2 + [self.b] * 2)
+        self.cols = np.concatenate([self.g, self.d, self.s] * 2 + [self.hi, self.lo] * 2
+                                   + [self.a, self.b] * 2)
+        self._kcl_index = np.concatenate([self.d, self.s, self.hi, self.lo, self.a, self.b])
+        self._free = (self.rows < self.n) & (self.cols < self.n)
+        self._jac_index = self.rows[self._free] * self.n + self.cols[self._free]
+        self.sparse = self.n > SPARSE_NODES if sparse is None else sparse
+        if self.sparse:
+            self._sparse_structure()
+
+        # ホモトピー用．gshunt は全FreeWireから電圧 anchor へのコンダクタンス(gmin stepping)、
+        # source_factor は固定端子の電圧に掛ける係数(source stepping)．通常は 0 と 1
+        self.gshunt, self.anchor = 0.0, 0.0
+        self.source_factor = 1.0
+        self.update()
+        self.set_companion()
+
+    def _sparse_structure(self):
+        # ヤコビアン(とgmin用の対角)のCSC構造を1回だけ作っておき、反復ごとには値だけ詰める
+        # ノードは逆Cuthill-McKee順に並べ替えて、LU分解のfill-inを抑える
+        n = self.n
+        rows = np.concatenate([self.rows[self._free], np.arange(n)])
+        cols = np.concatenate([self.cols[self._free], np.arange(n)])
+        pattern = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(n, n))
+        self._perm = csgraph.reverse_cuthill_mckee((pattern + pattern.T).tocsr(),
+                                                   symmetric_mode=True)
+        rank = np.empty(n, dtype=int)
+        rank[self._perm] = np.arange(n)
+        key = rank[cols] * n + rank[rows]  # 列優先
+        unique, self._csc_map = np.unique(key, return_inverse=True)
+        self._csc_indices = unique % n
+        self._csc_indptr = np.searchsorted(unique // n, np.arange(n + 1))
+        self._nnz = len(unique)
+
+    def scale_sources(self, factor):
+        # 固定端子の電圧(電源・入力)を factor 倍にする．factor = 0 で全電源オフ
+        self.source_factor = factor
+        self.fixed_voltage = self._fixed_voltage if factor == 1 else self._fixed_voltage * factor
+
+    def set_companion(self, geq=0, ihist=0):
+        # コンデンサの離散化モデル(コンパニオンモデル) Ic = geq * (Va - Vb) + ihist
+        # 直流では geq = ihist = 0 で開放．過渡解析の各時刻で transient.Transient が設定する
+        k = (len(self.capacitors),)
+        self.geq = np.broadcast_to(np.asarray(geq, dtype=float), np.shape(geq)[:-1] + k)
+        self.ihist = np.broadcast_to(np.asarray(ihist, dtype=float), np.shape(ihist)[:-1] + k)
+
+    def update(self):
+        # 素子オブジェクトから固定端子の電圧とパラメータを読み直す
+        # 解く前に1回だけ呼べばよく、残差の評価中は属性を参照しない
+        self._fixed_voltage = _stack([getattr(device, terminal)
+                                      for device, terminal in self.fixed])
+        self.scale_sources(self.source_factor)
+        for name in self.params:
+            setattr(self, name, _stack([getattr(mos, name) for mos in self.mos]))
+        self.beta = self.W / self.L * self.mu * self.Cox
+        self.tables = [mos.lookup_table() for mos in self.mos]
+        if all(table is None for table in self.tables):
+            self.tables = None  # 全素子解析式なら1回の small_signal でまとめて評価
+        self.R = _stack([R.R for R in self.resistors])
+        self.C = _stack([C.C for C in self.capacitors])
+        self.lead = self.batch_shape()
+
+    def batch_shape(self, voltages=None):
+        # 固定端子・パラメータ・初期値の配列から決まるバッチの形
+        shapes = [np.shape(self.fixed_voltage)[:-1], np.shape(self.beta)[:-1],
+                  np.shape(self.R)[:-1]]
+        if voltages is not None:
+            shapes.append(np.shape(voltages)[:-1])
+        return np.broadcast_shapes(*shapes)
+
+    def extend(self, voltages):
+        # FreeWireの電圧と固定端子の電圧を1本のベクトルにつなげる
+        voltages = np.asarray(voltages, dtype=float)
+        lead = voltages.shape[:-1]
+        if self.lead and lead != self.lead:
+            lead = np.broadcast_shapes(lead, self.lead)
+            voltages = np.broadcast_to(voltages, lead + (self.n,))
+        fixed = self.fixed_voltage
+        if fixed.shape[:-1] != lead:
+            fixed = np.broadcast_to(fixed, lead + (self.m,))
+        return np.concatenate([voltages, fixed], axis=-1)
+
+    def evaluate(self, voltages):
+        # KCL残差(各ノードへの流入電流)と、ヤコビアンの非ゼロ要素の値を返す
+        x = self.extend(voltages)
+        Vg, Vd, Vs = x[..., self.g], x[..., self.d], x[..., self.s]
+        Id, gm, gds, self.region = self.model(np.abs(Vg - Vs), np.abs(Vd - Vs))
+
+        # Idの各端子電圧による微分．Vgs/Vdsは絶対値なので向きの符号を掛ける
+        p = self.polarity
+        sg = np.where(Vg > Vs, 1, np.where(Vg < Vs, -1, p))
+        sd = np.where(Vd > Vs, 1, np.where(Vd < Vs, -1, p))
+        dg, dd = sg * gm, sd * gds
+        ds = -(dg + dd)
+
+        # Drainへの流入は -p*Id、Sourceへの流入は +p*Id
+        # 抵抗はHiからの流出が Ir、コンデンサはAからの流出が Ic
+        Ir = (x[..., self.hi] - x[..., self.lo]) / self.R
+        Ic = self.geq * (x[..., self.a] - x[..., self.b]) + self.ihist
+        Ic = np.broadcast_to(Ic, x.shape[:-1] + Ic.shape[-1:])
+        f = _scatter(np.concatenate([-p * Id, p * Id, -Ir, Ir, -Ic, Ic], axis=-1),
+                     self._kcl_index, self.n + self.m)[..., :self.n]
+        if self.gshunt:
+            f = f - self.gshunt * (x[..., :self.n] - self.anchor)
+
+        G = 1 / self.R
+        if G.shape != Ir.shape:
+            G = np.broadcast_to(G, Ir.shape)
+        geq = np.broadcast_to(self.geq, Ic.shape)
+        values = np.concatenate([-p * dg, -p * dd, -p * ds, p * dg, p * dd, p * ds,
+                                 -G, G, G, -G, -geq, geq, geq, -geq], axis=-1)
+        self.Id, self.gm, self.gds, self.Ir, self.Ic = Id, gm, gds, Ir, Ic
+        return f, values
+
+    def model(self, Vgs, Vds):
+        # 全MOSの Id, gm, gds, 領域コード．テーブルモデルの素子があれば素子ごとに評価して並べる
+        if self.tables is None:
+            return small_signal(Vgs, Vds, self.beta, self.Vth, self.lmd)
+        Vgs, Vds = np.broadcast_arrays(Vgs, Vds)
+        columns = []
+        for k, table in enumerate(self.tables):
+            if table is None:
+                columns.append(small_signal(Vgs[..., k], Vds[..., k], self.beta[..., k],
+                                            self.Vth[..., k], self.lmd[..., k]))
+            else:
+                columns.append(table(Vgs[..., k], Vds[..., k]))
+        return tuple(np.stack(arrays, axis=-1) for arrays in zip(*columns))
+
+    def jacobian(self, values):
+        # evaluate が返した非ゼロ要素から、FreeWire同士の密なヤコビアンを組み立てる
+        lead = values.shape[:-1]
+        J = _scatter(values[..., self._free], self._jac_index, self.n * self.n)
+        return J.reshape(lead + (self.n, self.n))
+
+    def solve_linear(self, values, f, active):
+        # Newton法の修正量 J dv = -f を解く．active でない点は 0
+        # 全素子オフのノードで特異にならないよう、対角に gmin = 1e-12 を入れる(gshunt はその上に足す)
+        if not self.sparse:
+            J = self.jacobian(values)
+            J[..., np.arange(self.n), np.arange(self.n)] -= 1e-12 + self.gshunt
+            dv = np.linalg.solve(J, -f[..., None])[..., 0]
+            dv[~active] = 0
+            return dv
+
+        dv = np.zeros_like(f)
+        free = values[..., self._free]
+        gmin = np.full(self.n, -1e-12 - self.gshunt)
+        for k in zip(*np.nonzero(active)):
+            data = np.bincount(self._csc_map, weights=np.concatenate([free[k], gmin]),
+                               minlength=self._nnz)
+            J = sparse.csc_matrix((data, self._csc_indices, self._csc_indptr),
+                                  shape=(self.n, self.n))
+            # 並べ替えは済んでいるので、SuperLUの列順序付けはしない
+            dv[k][self._perm] = splu(J, permc_spec='NATURAL').solve(-f[k][self._perm])
+        return dv
+
+    def current(self, voltages):
+        # 各FreeWireの電流(貫通電流)．FreeWire.current_law と同じく流入で換算
+        self.evaluate(voltages)
+        p = self.polarity
+        return _scatter(np.concatenate([np.where(p < 0, self.Id, 0), np.where(p > 0, self.Id, 0),
+                                        self.Ir], axis=-1),
+                        np.concatenate([self.d, self.s, self.lo]), self.n + self.m)[..., :self.n]
+
+    def margin(self, voltages, steps=None):
+        # MOSの向きの制約 p*(Vd - Vs) >= 0 の余裕．stepsを渡すとその変化量
+        x = self.extend(voltages) if steps is None else np.concatenate(
+            [steps, np.zeros(steps.shape[:-1] + (self.m,))], axis=-1)
+        return self.polarity * (x[..., self.d] - x[..., self.s])
+
+    def feasible(self, voltages):
+        return np.all(self.margin(voltages)[..., self._bounded] >= 0, axis=-1)
+
+    def project(self, voltages, steps, tol=1e-9):
+        # 向きの制約の境界にいる(余裕 <= tol)MOSを、ステップがさらに破る方向に動かすなら、
+        # そのMOSのD / Sに繋がるFreeWireの修正量を 0 にする(境界で止まったまま進めなくなるのを防ぐ)
+        c = self.margin(voltages)
+        for _ in range(self.n):
+            blocked = (c <= tol) & (self.margin(None, steps) < 0)
+            if not np.any(blocked):
+                break
+            steps = steps.copy()
+            *lead, k = np.nonzero(blocked)
+            for nodes in (self.d[k], self.s[k]):
+                free = nodes < self.n
+                steps[tuple(index[free] for index in lead) + (nodes[free],)] = 0
+        return steps
+
+    def step_limit(self, voltages, steps, max_step):
+        # ステップの縮小率．1ステップで動かす電圧をmax_step以下にし、
+        # MOSのVd/Vsの大小関係が入れ替わらないよう残り距離の99.5%までにとどめる
+        size = np.max(np.abs(steps), axis=-1)
+        alpha = np.minimum(1.0, max_step / np.maximum(size, 1e-300))
+        c, dc = self.margin(voltages), self.margin(None, steps)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratio = np.where(dc < 0, 0.995 * c / -dc, np.inf)
+        if ratio.shape[-1]:
+            alpha = np.minimum(alpha, np.min(ratio, axis=-1))
+        return alpha
+
+    def newton(self, voltages, xtol=1e-12, ftol=1e-12, max_step=1.0, max_iter=100, strict=True):
+        # 減衰付きNewton法．バッチの各点を同時に解き、収束した点はマスクする
+        # (解, 反復回数, 残差のノルム) を返す
+        # strict=False なら max_iter で打ち切って例外にせず、未収束の点は残差のノルムで見分ける
+        lead = self.batch_shape(voltages)
+        # バッチでない場合も長さ1のバッチとして扱う
+        v = np.array(np.broadcast_to(voltages, (lead or (1,)) + (self.n,)), dtype=float)
+        f, values = self.evaluate(v)
+        norm = np.max(np.abs(f), axis=-1, initial=0)
+        active = np.ones(norm.shape, dtype=bool)
+        iteration = 0
+
+        while np.any(active):
+            if iteration == max_iter:
+                if not strict:
+                    break
+                raise RuntimeError('Circuit: Newton iteration did not converge '
+                                   '(|f| = {0:.3e})'.format(np.max(norm[active])))
+            iteration += 1
+            dv = self.project(v, self.solve_linear(values, f, active))
+            alpha = self.step_limit(v, dv, max_step)
+
+            # 残差が減るまでステップを半分にする(バックトラック)．点ごとに独立に判定する
+            searching = active.copy()
+            v_new, f_new, values_new, norm_new = v.copy(), f.copy(), values.copy(), norm.copy()
+            for _ in range(20):
+                trial = v + alpha[..., None] * dv
+                f_trial, values_trial = self.evaluate(trial)
+                norm_trial = np.max(np.abs(f_trial), axis=-1, initial=0)
+                v_new[searching], f_new[searching] = trial[searching], f_trial[searching]
+                values_new[searching], norm_new[searching] = values_trial[searching], norm_trial[searching]
+                ok = (norm_trial <= norm) | (alpha * np.max(np.abs(dv), axis=-1, initial=0) <= xtol)
+                searching &= ~ok
+                if not np.any(searching):
+                    break
+                alpha = np.where(searching, 0.5 * alpha, alpha)
+
+            step = alpha * np.max(np.abs(dv), axis=-1, initial=0)
+            v, f, values, norm = v_new, f_new, values_new, norm_new
+            active &= ~((norm <= ftol) | ((step <= xtol) & (norm <= np.sqrt(ftol))))
+
+        return v.reshape(lead + (self.n,)), iteration, norm.reshape(lead)
+
+
+class Circuit(object):
+    # 複数のFreeWireをまとめて、全ノードのKCLを同時にNewton法で解く
+    # FreeWire.optimisationを順番に回す緩和法(非線形Gauss-Seidel)の代わり
+    # 回路はCompiledCircuitの配列表現に変換して解き、結果だけ素子オブジェクトに書き戻す
+    # 直接Newton法が失敗したときのホモトピー．gmin stepping(各ノードを始点へ gshunt で繋ぐ)で
+    # gshunt を小さくしていき、それでも駄目なら電源を 0 から立ち上げる(source stepping)
+    homotopy_iter = 5000  # ホモトピーの各方法でのNewton反復回数の上限
+
+    def __init__(self, wires, xtol=1e-12, ftol=1e-12, max_step=1.0, max_iter=100, sparse=None):
+        self.wires = list(wires)
+        self.xtol = xtol  # 電圧の収束判定
+        self.ftol = ftol  # KCL残差(電流)の収束判定
+        self.max_step = max_step  # 1回のNewtonステップで動かす電圧の上限
+        self.max_iter = max_iter
+        self.iteration = 0  # 直近のsolveで要したNewton反復回数
+        self.residual_norm = np.inf
+        self.devices, self.nodes = connections(self.wires)
+        self.compiled = CompiledCircuit(self.wires, sparse)
+        # 依存グラフの強連結成分(schedule)．2つ以上に分かれていれば、solve はブロックごとに解く
+        self.blocks = schedule(self.wires)
+        self._subcircuits = None  # ブロックごとの Circuit(初めて使うときに作る)
+        # 差分の再計算．ブロックごとに、前回解いたときの入力(watch の値)を覚えておき、
+        # 変わっていないブロックは解き直さずに前回の解を使う．dirty は直近のsolveで解いたブロック
+        self.incremental = True
+        inputs = [self._inputs(block) for block in self.blocks]
+        self.watch = [watch for watch, _ in inputs]
+        self._reads = [reads for _, reads in inputs]
+        self._solved = [None] * len(self.blocks)
+        self.dirty = []
+
+    def _inputs(self, block):
+        # ブロックのKCLが読む値の (オブジェクト, 属性名) のリストと、そのうち解く前から決まっている値
+        # (ブロックのFreeWire自身の電圧・端子を除いたもの)の番号のリストを返す
+        # ブロックに電流を流し込む素子のパラメータと全端子の電圧、ブロックのFreeWireの電圧
+        # ▶ 素子側の __setattr__ で変更を監視すると、端子電圧の代入ごとに遅くなるので、
+        #   MOSのキャッシュと同じく参照時に前回の値と比べる
+        members = set(block)
+        watch = [(self.wires[i], 'voltage') for i in block]
+        reads = []
+        for device in self.devices:
+            if isinstance(device, MOS):
+                flowing = ('Vd', 'Vs')
+                names = CompiledCircuit.params + ('tabulate', 'Vg', 'Vd', 'Vs')
+            elif isinstance(device, Resistor):
+                flowing, names = ('Vh', 'Vl'), ('R', 'Vh', 'Vl')
+            else:
+                continue  # コンデンサは直流では開放
+            terminals = self.nodes[id(device)]
+            if any(terminals.get(terminal) in members for terminal in flowing):
+                for name in names:
+                    if terminals.get(name) not in members:
+                        reads.append(len(watch))
+                    watch.append((device, name))
+        return watch, reads
+
+    def invalidate(self):
+        # 前回の解を捨てて、次のsolveで全ブロックを解き直す
+        self._solved = [None] * len(self.blocks)
+
+    def set_voltages(self, voltages):
+        # 各FreeWireの電圧を接続先の端子に書き込む．バッチなら最後の軸がFreeWire
+        for device in self.devices:
+            for terminal, i in self.nodes[id(device)].items():
+                setattr(device, terminal, voltages[..., i])
+
+    def feasible(self, voltages):
+        # nMOSなら Vd >= Vs, pMOSなら Vs >= Vd を満たすか
+        return bool(np.all(self.compiled.feasible(voltages)))
+
+    def residual(self, voltages):
+        # 各ノードに流入する電流の総和(KCL残差)を返す
+        self.compiled.update()
+        return self.compiled.evaluate(voltages)[0]
+
+    def jacobian(self, voltages):
+        # KCL残差の各ノード電圧に関するヤコビアン．gm/gdsは解析的に求める
+        self.compiled.update()
+        return self.compiled.jacobian(self.compiled.evaluate(voltages)[1])
+
+    def initial_guess(self):
+        # 各FreeWireの現在の電圧を初期値にする
+        # 素子の制約を満たさない場合は、緩和法を1周だけ回して初期値を作る
+        # (バッチ版の掃引で配列が残っている場合も緩和法から)
+        # 緩和法が失敗したら(brentqの区間に符号変化が無いなど) None
+        voltages = [wire.voltage for wire in self.wires]
+        if all(np.ndim(voltage) == 0 for voltage in voltages) and \
+                self.feasible(np.array(voltages, dtype=float)):
+            return np.array(voltages, dtype=float)
+        return self._sweep()
+
+    def _sweep(self, skip=False):
+        # 緩和法を依存グラフのブロックの順に1周だけ回し、各FreeWireの電圧を返す
+        # 失敗したら(brentqの区間に符号変化が無いなど) None
+        # skip=True なら解けなかったFreeWire(抵抗だけに繋がっているなど)は電圧をそのままにして進める
+        for block in self.blocks:
+            for i in block:
+                try:
+                    self.wires[i].optimisation()
+                except ValueError:
+                    if not skip:
+                        return None
+        return np.array([wire.voltage for wire in self.wires], dtype=float)
+
+    def solve(self, voltages=None):
+        # 減衰付きNewton法．反復回数を返し、結果は各FreeWireに書き戻す
+        # voltagesを渡すとそこから始め(ウォームスタート)、失敗したら通常の初期値でやり直す
+        # それでも失敗したらホモトピーで解く
+        # 回路が依存グラフのブロックに分かれるなら、ブロックごとに順に解く(_solve_blocks)
+        if len(self.blocks) > 1:
+            return self._solve_blocks(voltages)
+        self.compiled.update()
+        if voltages is not None and self.feasible(voltages):
+            try:
+                return self._newton(np.array(voltages, dtype=float))
+            except (RuntimeError, np.linalg.LinAlgError):
+                pass
+        guess = self.initial_guess()
+        if guess is not None:
+            try:
+                return self._newton(guess)
+            except (RuntimeError, np.linalg.LinAlgError):
+                pass
+        return self.homotopy(guess)
+
+    def relaxation(self, voltages=None, width=1e-2):
+        # 緩和法(非線形Gauss-Seidel)．FreeWire.optimisation をブロックの順に回す
+        # 周回するのは互いに依存し合うブロックの中だけで、どのFreeWireの電圧も変わらなくなるまで
+        # FreeWire 1本のブロックは依存先が解けていれば1回で決まる．周回数の合計を返す
+        # voltages を渡すと1周目はそれを初期値にし、2周目以降は前の周の解から始める
+        from instrument import mark
+        sweeps = 0
+        for block in self.blocks:
+            flags = [True] * len(block)
+            sweep = 0
+            while any(flags):
+                mark(sweep=sweep)  # 計測用のタグ(instrument.Recorder が無効なら何もしない)
+                for k, i in enumerate(block):
+                    wire = self.wires[i]
+                    guess = None
+                    if voltages is not None:
+                        guess = voltages[i] if sweep == 0 else wire.voltage
+                    flags[k] = wire.optimisation(guess, width)
+                sweep += 1
+                if len(block) == 1:
+                    break
+            sweeps += sweep
+        return sweeps
+
+    def _solve_blocks(self, voltages=None):
+        # 依存される側のブロックから1回ずつ解く．解いたブロックの電圧は素子の端子に書き込まれ、
+        # 後のブロックからは固定端子として見える
+        # FreeWire 1本のブロックは(掃引の配列が無ければ) FreeWire.optimisation で直接解き、1回と数える
+        # 互いに依存し合うブロックはそのブロックだけの Circuit でまとめてNewton法で解く
+        # incremental なら入力が前回と同じブロックは飛ばす．前のブロックの解が変われば
+        # 後のブロックの端子電圧が変わるので、影響が及ぶブロックだけが解き直される
+        if self._subcircuits is None:
+            self._subcircuits = [None] * len(self.blocks)
+        iteration, norm = 0, 0.0
+        self.dirty = []
+        for k, block in enumerate(self.blocks):
+            values = [getattr(owner, name) for owner, name in self.watch[k]]
+            if self.incremental and self._solved[k] is not None and \
+                    _unchanged(values, self._solved[k]):
+                continue
+            self.dirty.append(k)
+            guess = None if voltages is None else np.asarray(voltages, dtype=float)[..., block]
+            # 掃引の配列があるかは、ブロックが読む値だけで決める．ブロック自身の電圧と端子には
+            # 前のバッチ掃引の配列(0次元の配列も)が残っていることがあるが、解けば上書きされる
+            scalar = all(np.ndim(values[i]) == 0 for i in self._reads[k])
+            count, residual_norm = self._solve_block(k, block, guess, scalar)
+            iteration, norm = iteration + count, np.maximum(norm, residual_norm)
+            values = [getattr(owner, name) for owner, name in self.watch[k]]
+            self._solved[k] = [np.array(value) if isinstance(value, np.ndarray) else value
+                               for value in values]
+        self.iteration, self.residual_norm = iteration, norm
+        return iteration
+
+    def _solve_block(self, k, block, guess, scalar):
+        # k番目のブロックを解き、(反復回数, 残差のノルム) を返す
+        if scalar and len(block) == 1:
+            try:
+                self.wires[block[0]].optimisation(None if guess is None else float(guess[0]))
+                return 1, 0.0
+            except ValueError:
+                pass  # [a, b]で符号が変わらないなど．Newton法で解き直す
+        sub = self._subcircuits[k]
+        if sub is None:
+            sub = self._subcircuits[k] = Circuit([self.wires[i] for i in block], self.xtol,
+                                                 self.ftol, self.max_step, self.max_iter)
+        return sub.solve(guess), sub.residual_norm
+
+    def homotopy(self, voltages=None):
+        # gmin stepping → source stepping の順に試す．反復回数を返し、結果は各FreeWireに書き戻す
+        # どちらもNewton反復 homotopy_iter 回までで打ち切り、両方失敗したら RuntimeError
+        self.compiled.update()
+        # 制約を満たす初期値(渡された値か全ノード 0 V)から緩和法を1周回した点を始点にする
+        start = np.zeros(self.compiled.n)
+        if voltages is not None and self.feasible(voltages):
+            start = np.asarray(voltages, dtype=float)
+        start = self._relax(start)
+        methods = [self._source_stepping]
+        if self.feasible(start):
+            methods.insert(0, self._gmin_stepping)
+        iteration = 0
+        for method in methods:
+            self.budget = self.homotopy_iter
+            try:
+                v = method(start)
+            except RuntimeError:
+                continue
+            finally:
+                iteration += self.homotopy_iter - self.budget
+            return self._newton(v) + iteration
+        raise RuntimeError('Circuit: homotopy did not converge ({0} Newton iterations)'.format(
+            iteration))
+
+    def _relax(self, v):
+        # v を各FreeWireに書き込んで緩和法を1周回した電圧．制約を満たさないか、KCL残差が v より
+        # 大きければ(帰還が負で緩和法が振動する回路など) v のまま
+        # 緩和法は依存の向きに沿って1周で端まで伝わるので、長い段数でもNewton法の出発点として近い
+        self.set_voltages(v)
+        for wire, voltage in zip(self.wires, v.tolist()):
+            wire.voltage = voltage
+        relaxed = self._sweep(skip=True)
+        if not self.feasible(relaxed):
+            return v
+        compiled = self.compiled
+        gshunt, compiled.gshunt = compiled.gshunt, 0.0
+        try:
+            norms = [np.max(np.abs(compiled.evaluate(x)[0]), initial=0) for x in (v, relaxed)]
+        finally:
+            compiled.gshunt = gshunt
+        return relaxed if norms[1] < norms[0] else v
+
+    def _step(self, v, max_iter=None):
+        # ホモトピーの1段分のNewton法．反復回数を予算から引く
+        if self.budget <= 0:
+            raise RuntimeError('Circuit: homotopy iteration budget exhausted')
+        max_iter = min(self.max_iter if max_iter is None else max_iter, self.budget)
+        try:
+            v, iteration, _ = self.compiled.newton(v, self.xtol, self.ftol, self.max_step, max_iter)
+        except (RuntimeError, np.linalg.LinAlgError):
+            self.budget -= max_iter
+            raise RuntimeError('Circuit: homotopy step failed')
+        self.budget -= iteration
+        self.last_iteration = iteration
+        return v
+
+    def _gmin_stepping(self, v, gshunt=10.0, gmin=1e-12, gmax=1e6, ratio=10.0, min_ratio=1.05):
+        # 各FreeWireから始点 v へコンダクタンス gshunt を繋いで解き、gshunt を小さくしていく
+        # anchor は始点に固定し、各段は直前の段の解から始める(解の道筋が gshunt について連続になる)
+        # 成功したら gshunt を 1/ratio に(3回以内で収束したら ratio を2乗して速める)、
+        # 失敗したら直前に解けた gshunt と解に戻って ratio を平方根にし、より細かく刻む
+        # gshunt が大きいほどヤコビアンの対角が効いて、飽和・オフで電流の流れないノードでも解ける
+        compiled = self.compiled
+        compiled.anchor = v
+        good = None  # 直前に解けた gshunt
+        try:
+            while True:
+                compiled.gshunt = gshunt
+                try:
+                    trial = self._step(v, max_iter=10)
+                except RuntimeError:
+                    if self.budget <= 0:
+                        raise
+                    if good is None:
+                        if gshunt * ratio > gmax:
+                            raise  # 始点のすぐ近くでも解けない(Idが不連続な点に止まっているなど)
+                        gshunt *= ratio  # 最初の段が解けなければ始点に強く繋ぐ
+                        continue
+                    ratio = np.sqrt(ratio)
+                    if ratio < min_ratio:
+                        # 道筋が折り返していて(正帰還の回路など)進めない．直前の解を新しい始点にし、
+                        # gshunt を大きく戻してやり直す
+                        v = self._relax(v)
+                        compiled.anchor, good, ratio = v, None, 10.0
+                        gshunt *= ratio
+                        continue
+                    gshunt = good / ratio
+                    continue
+                v, good = trial, gshunt
+                if gshunt <= gmin:
+                    break
+                if self.last_iteration <= 3:
+                    ratio = min(ratio * ratio, 1e4)
+                gshunt = max(gshunt / ratio, gmin)
+        finally:
+            compiled.gshunt, compiled.anchor = 0.0, 0.0
+        return self._step(v)
+
+    def _source_stepping(self, v, step=0.1, min_step=1e-4):
+        # 固定端子の電圧を小さい倍率から 1 倍まで上げていく
+        # 始点 v(緩和法の解など)を最初の倍率に縮めたものから始め、各段は直前の段の解を
+        # 倍率の比で伸ばしたもの(線形な回路ならそのまま解)から始める．全電圧を同じ比で
+        # 伸ばすのでMOSの向きの制約は崩れない
+        # 失敗したら刻みを 1/4 に、3回以内で収束したら2倍(最大0.5)、それより遅ければそのまま
+        # (倍率 0 の解は全ノード 0 V なので、始点 v は倍率 1 の近似解として扱う)
+        compiled = self.compiled
+        v, factor = np.asarray(v, dtype=float), 0.0
+        try:
+            while factor < 1:
+                trial = min(1.0, factor + step)
+                compiled.scale_sources(trial)
+                try:
+                    v_new = self._step(v * (trial / (factor or 1.0)), max_iter=20)
+                except RuntimeError:
+                    if self.budget <= 0 or step / 4 < min_step:
+                        raise
+                    step /= 4
+                    continue
+                v, factor = v_new, trial
+                if self.last_iteration <= 3:
+                    step = min(2 * step, 0.5)
+        finally:
+            compiled.scale_sources(1.0)
+        return v
+
+    def _newton(self, v):
+        v, self.iteration, self.residual_norm = self.compiled.newton(
+            v, self.xtol, self.ftol, self.max_step, self.max_iter)
+
+        self.set_voltages(v)
+        compiled = self.compiled
+        if v.ndim > 1:
+            # バッチの解は最後の軸がFreeWire．current_law はスカラー用なので、配列の評価結果を書き戻す
+            # region / pcolor は点ごとの名前の配列にする
+            currents = compiled.current(v)
+            names = np.array([REGION_NAMES[k] for k in sorted(REGION_NAMES)])
+            colors = np.array([REGION_COLORS[k] for k in sorted(REGION_COLORS)])
+            for k, mos in enumerate(compiled.mos):
+                region = compiled.region[..., k]
+                mos._Id, mos._gm, mos._gds = compiled.Id[..., k], compiled.gm[..., k], compiled.gds[..., k]
+                mos.region, mos.pcolor = names[region], colors[region]
+            for i, wire in enumerate(self.wires):
+                wire.voltage = wire.previous_voltage = v[..., i]
+                wire.current = wire.previous_current = currents[..., i]
+            return self.iteration
+
+        # スカラーの解なら、current_law を呼び直さずに配列の評価結果をそのまま書き戻す
+        currents = compiled.current(v).tolist()
+        for mos, Id, gm, gds, region in zip(compiled.mos, compiled.Id.tolist(), compiled.gm.tolist(),
+                                            compiled.gds.tolist(), compiled.region.tolist()):
+            mos._Id, mos._gm, mos._gds = Id, gm, gds
+            mos.region, mos.pcolor = REGION_NAMES[region], REGION_COLORS[region]
+        for wire, voltage, current in zip(self.wires, v.tolist(), currents):
+            wire.voltage = wire.previous_voltage = voltage
+            wire.current = wire.previous_current = current
+        return self.iteration
@@ -1,25 +1,33 @@
 from device import nMOS
 from device import Resistor
 from device import FreeWire
-import matplotlib.pyplot as plt
+from device import Capacitor
+from sweep import Continuation, adaptive_sweep
+from transient import Transient
+from ac import AC
+from sink import ArraySink
+from grid import GridSweep
 import numpy as np
 from abc import ABCMeta, abstractmethod
-from mpl_toolkits.mplot3d import Axes3D
 
 
 class CommonSource(metaclass=ABCMeta):
-    def __init__(self, element='Resistor', unit=1, name='R', param='1'):
+    def __init__(self, element='Resistor', unit=1, name='R', param='1', warm_start=True, batch=True,
+                 points=1000, sink=None):
         self.Vdd, self.GND = 5.0, 0
-        self.time = np.linspace(0, 6 * np.pi, 1000)
+        self.points = points  # 掃引点数
+        self.time = np.linspace(0, 6 * np.pi, points)
         self.Vin_DC = 0.74
-        self.Vin_arr = np.linspace(0, self.Vdd, 1000)
+        self.Vin_arr = np.linspace(0, self.Vdd, points)
         self.Vin_time_arr = 0.01 * np.sin(self.time) + self.Vin_DC
-        self.Vout_arr = []  # 動かすパラメータごとに保持
-        self.Ileak_arr = []  # 動かすパラメータごとに保持
+        # Vout / Ileak の書き込み先(既定はメモリ上)．NpySink などを渡すとファイルに書き出す
+        self.sink = ArraySink() if sink is None else sink
 
         self.nmos1 = nMOS(unit=1, mu=1)
         self.R1 = Resistor(unit=1, R=2500.0)
         self.wire1 = FreeWire()
+        self.warm_start = warm_start  # 前の掃引点の解から外挿した値を初期値にする
+        self.batch = batch  # 全掃引点をまとめて解く
         if element not in ('nMOS', 'pMOS', 'Resistor'):
             raise NameError('mos: Invalid name')
 
@@ -34,111 +42,193 @@ class CommonSource(metaclass=ABCMeta):
         self.wire1.joint('Drain', self.nmos1)
         self.wire1.joint('ResistLo', self.R1)
 
+    def solve(self, predictor, Vin):
+        # predictorから外挿した値を初期値にしてwire1を解く
+        guess = predictor.predict(Vin) if self.warm_start else None
+        self.wire1.optimisation(guess, predictor.width())
+        predictor.update(Vin, self.wire1.voltage)
+
+    def solve_batch(self, Vin_arr):
+        # Vg に掃引点の配列をそのまま入れて一括で解き、sink に書き込む
+        self.sink.write(**self.solve_points(Vin_arr))
+
+    def solve_points(self, Vin_arr):
+        # Vin_arr の全点をまとめて解き、{'Vout': 配列, 'Ileak': 配列} を返す
+        self.nmos1.Vg = Vin_arr
+        self.wire1.optimisation_batch()
+        return {'Vout': self.wire1.voltage, 'Ileak': self.wire1.current}
+
+    def open_sink(self, rows):
+        self.sink.open({'Vout': (), 'Ileak': ()}, rows)
+
+    def close_sink(self):
+        self.sink.close()
+        self.Vout_arr, self.Ileak_arr = self.sink['Vout'], self.sink['Ileak']
+
+    def small_signal_gain(self, frequencies=0.0, Vin=None):
+        # Vin(既定は Vin_DC)の動作点で線形化したAC解析．Vin → Vout の伝達関数(複素数の配列)を返す
+        # 動作点を解くために書き換えた Vg と wire1 の状態(掃引の結果)は元に戻す
+        Vg, voltage, current = self.nmos1.Vg, self.wire1.voltage, self.wire1.current
+        try:
+            self.nmos1.Vg = self.Vin_DC if Vin is None else Vin
+            ac = AC([self.wire1], (self.nmos1, 'Vg'))
+            return ac.run(frequencies)[:, 0]
+        finally:
+            self.nmos1.Vg = Vg
+            self.wire1.voltage, self.wire1.current = voltage, current
+            self.wire1._set_terminals(voltage)
+
     @abstractmethod
     def process(self):
         pass
 
+    @abstractmethod
+    def plot(self):
+        pass
 
-class CSTimeVout(CommonSource):
-    def __init__(self, element='Resistor', unit=1, name='R', param='1'):
-        super().__init__(element, unit, name, param)
 
-    def process(self):
-        for Vin in self.Vin_time_arr:
-            self.nmos1.Vg = Vin
-            self.wire1.optimisation()
-            self.Vout_arr.append(self.wire1.voltage)
-            self.Ileak_arr.append(self.wire1.current)
-            print('Vin(Vgs) = {0:1.3f}, Vout(Vds) = {2:1.3f}, gm = {1:1.3f}, Rd={4:1.3f}, gmRd = {3:1.3f}'.format(
-                Vin, self.nmos1.gm, self.nmos1.Vds, self.nmos1.gm * self.R1.R, self.R1.R))
+class CSTimeVout(CommonSource):
+    # CL を指定すると出力に負荷容量を付けて過渡解析する(省略時は各時刻の直流解を並べる準静的な解析)
+    # ac=True なら、Vin_DC の動作点でのAC解析の利得・位相も求めて表示する
+    def __init__(self, element='Resistor', unit=1, name='R', param='1', warm_start=True, batch=True,
+                 CL=None, method='trapezoidal', points=1000, sink=None, ac=False):
+        self.CL = CL
+        self.method = method
+        self.ac = ac
+        super().__init__(element, unit, name, param, warm_start, batch, points, sink)
 
-        Av = (max(self.Vout_arr) - min(self.Vout_arr))/(max(self.Vin_time_arr) - min(self.Vin_time_arr))
-        Vout = np.array(self.Vout_arr) + self.Vin_DC - self.Vout_arr[0]
-        genuin_Vout = -0.01 * np.sin(self.time) * Av + self.Vin_DC
-        diff = max(Vout) - max(genuin_Vout)
+    def joint_wire(self):
+        super().joint_wire()
+        if self.CL is not None:
+            self.C1 = Capacitor(unit=1, C=self.CL)
+            self.C1.Vb = self.GND
+            self.wire1.joint('CapA', self.C1)
+
+    def stimulus(self, t):
+        self.nmos1.Vg = 0.01 * np.sin(t) + self.Vin_DC
+
+    def solve_transient(self):
+        # 刻み幅は自動で決まるので、結果は self.time 上に線形補間する
+        # 刻み幅の上限は出力の時刻点ではなく入力 sin(t) の周期(2π)から決める(1周期に50点以上)
+        # sink には採用した時刻ごとの 't' / 'V' が書き込まれる
+        transient = Transient([self.wire1], self.stimulus, method=self.method,
+                              h_max=2 * np.pi / 50)
+        times, voltages = transient.run(self.time[-1], sink=self.sink)
+        self.Vout_arr = np.interp(self.time, times, voltages[:, 0])
+        print('transient: {0} steps, {1} rejected, {2} Newton iterations'.format(
+            len(times) - 1, transient.rejected, transient.iteration))
 
-        print('Av = {0:1.3f}'.format(-Av))
-        plt.plot(self.time, self.Vin_time_arr, label='Vin')
-        plt.plot(self.time, Vout, label='Vout')
-        plt.plot(self.time, genuin_Vout + diff, label='genuin amplifier')
+    def process(self):
+        if self.CL is not None:
+            self.solve_transient()
+        elif self.batch:
+            self.open_sink(len(self.Vin_time_arr))
+            self.solve_batch(self.Vin_time_arr)
+            self.close_sink()
+            _, gm_arr, _, _ = self.nmos1.small_signal_batch(self.nmos1.Vg, self.nmos1.Vd, self.nmos1.Vs)
+            for Vin, gm, Vds in zip(self.Vin_time_arr, gm_arr, self.Vout_arr - self.GND):
+                print('Vin(Vgs) = {0:1.3f}, Vout(Vds) = {2:1.3f}, gm = {1:1.3f}, Rd={4:1.3f}, gmRd = {3:1.3f}'.format(
+                    Vin, gm, Vds, gm * self.R1.R, self.R1.R))
+        else:
+            self.open_sink(len(self.Vin_time_arr))
+            predictor = Continuation()
+            for Vin in self.Vin_time_arr:
+                self.nmos1.Vg = Vin
+                self.solve(predictor, Vin)
+                self.sink.append(Vout=self.wire1.voltage, Ileak=self.wire1.current)
+                print('Vin(Vgs) = {0:1.3f}, Vout(Vds) = {2:1.3f}, gm = {1:1.3f}, Rd={4:1.3f}, gmRd = {3:1.3f}'.format(
+                    Vin, self.nmos1.gm, self.nmos1.Vds, self.nmos1.gm * self.R1.R, self.R1.R))
+            self.close_sink()
+
+        self.Av = (max(self.Vout_arr) - min(self.Vout_arr))/(max(self.Vin_time_arr) - min(self.Vin_time_arr))
+        self.Vout_shifted = np.array(self.Vout_arr) + self.Vin_DC - self.Vout_arr[0]
+        self.genuin_Vout = -0.01 * np.sin(self.time) * self.Av + self.Vin_DC
+        self.diff = max(self.Vout_shifted) - max(self.genuin_Vout)
+
+        print('Av = {0:1.3f}'.format(-self.Av))
+        if self.ac:
+            # 入力の sin(t) は角周波数1なので f = 1/2π での小信号利得と比べられる
+            H = self.small_signal_gain(1 / (2 * np.pi))[0]
+            print('Av(AC) = {0:1.3f}, phase = {1:1.1f} deg'.format(-abs(H), np.angle(H, deg=True)))
+
+    def plot(self):
+        import plotting
+        plotting.cs_time_Vout(self)
 
 
 class CSVinVout(CommonSource):
-    def __init__(self, element='Resistor', unit=1, name='R', param='1'):
-        super().__init__(element, unit, name, param)
+    # adaptive=True なら、Vout が曲がっている所(遷移領域)だけ掃引点を細かくする適応掃引
+    # tol は線形補間したときの Vout の許容誤差[V]．Vin_arr は不等間隔になる
+    def __init__(self, element='Resistor', unit=1, name='R', param='1', warm_start=True, batch=True,
+                 points=1000, sink=None, adaptive=False, tol=1e-3):
+        self.adaptive = adaptive
+        self.tol = tol
+        super().__init__(element, unit, name, param, warm_start, batch, points, sink)
 
     def process(self):
-        for Vin in self.Vin_arr:
-            self.nmos1.Vg = Vin
-            self.wire1.optimisation()
-            self.Vout_arr.append(self.wire1.voltage)
-            self.Ileak_arr.append(self.wire1.current)
-
-            # plt.plot(Vin, self.Vout_arr[-1], '.', color=self.nmos1.pcolor)
-
-        Vout_gradient = np.gradient(self.Vout_arr, self.Vin_arr[1] - self.Vin_arr[0])
-
-        plt.figure(figsize=(3, 2))
-        ax1 = plt.subplot(2, 1, 1)
-        ax2 = plt.subplot(2, 1, 2)
-        ax1.plot(self.Vin_arr, self.Vout_arr, label='Vout')
-        ax2.plot(self.Vin_arr, Vout_gradient)  # 勾配の計算
-        ax1.plot([self.Vin_DC, self.Vin_DC], [0, 5], '-')
-        ax2.plot([self.Vin_DC, self.Vin_DC], [min(Vout_gradient), 3], '-')
-        ax2.plot([self.Vin_DC-0.01, self.Vin_DC-0.01], [min(Vout_gradient), 3], 'k-')
-        ax2.plot([self.Vin_DC+0.01, self.Vin_DC+0.01], [min(Vout_gradient), 3], 'k-')
-        ax2.set_xlabel(r'$V_{in}$', fontsize=18)
-        ax1.set_ylabel(r'$V_{out}$', fontsize=18)
-        ax2.set_ylabel(r'$A_v$', fontsize=18)
-        ax1.set_xlim(0.6, 1.0)
-        ax2.set_xlim(0.6, 1.0)
-        ax2.set_ylim(min(Vout_gradient)-2, 5)
+        if self.adaptive:
+            self.Vin_arr, result = adaptive_sweep(self.solve_points, self.Vin_arr[0],
+                                                  self.Vin_arr[-1], self.tol, key='Vout')
+        self.open_sink(len(self.Vin_arr))
+        if self.adaptive:
+            self.sink.write(**result)
+        elif self.batch:
+            self.solve_batch(self.Vin_arr)
+        else:
+            predictor = Continuation()
+            for Vin in self.Vin_arr:
+                self.nmos1.Vg = Vin
+                self.solve(predictor, Vin)
+                self.sink.append(Vout=self.wire1.voltage, Ileak=self.wire1.current)
+        self.close_sink()
+
+        if self.adaptive:
+            self.Vout_gradient = np.gradient(self.Vout_arr, self.Vin_arr)  # 不等間隔の勾配
+        else:
+            self.Vout_gradient = np.gradient(self.Vout_arr, self.Vin_arr[1] - self.Vin_arr[0])  # 勾配の計算
+
+    def plot(self):
+        import plotting
+        plotting.cs_Vin_Vout(self)
 
 
 class CSVinRdgmRd(CommonSource):
-    def __init__(self, element='Resistor', unit=1, name='R', param='1'):
-        super().__init__(element, unit, name, param)
+    # points は Vg / Rd 各軸の点数
+    # (Vg, Rd) の格子を grid.GridSweep で一括して解き、gm*Rd と小信号利得 dVout/dVg の曲面を求める
+    # checkpoint(パス)を渡すと、tile 行ごとの結果を定期的に保存し、中断しても続きから計算する
+    def __init__(self, element='Resistor', unit=1, name='R', param='1', warm_start=True, batch=True,
+                 points=200, checkpoint=None, tile=None, interval=60.0):
+        self.checkpoint = checkpoint
+        self.tile = tile
+        self.interval = interval
+        super().__init__(element, unit, name, param, warm_start, batch, points)
 
     def process(self):
-        xdim, ydim = 200, 200
-        vg = np.linspace(0, self.Vdd-2, xdim)
-        rd = np.linspace(1, 2000, ydim)
-        Vg, Rd = np.meshgrid(vg, rd)
-        gmRd_arr = [[0 for _ in range(ydim)] for __ in range(xdim)]
-        fig = plt.figure()
-        ax = Axes3D(fig)
-
-        for i in range(xdim):
-            for j in range(ydim):
-                self.nmos1.Vg = Vg[i][j]
-                self.wire1.optimisation()
-                self.R1.R = Rd[i][j]
-                gmRd_arr[i][j] = self.nmos1.gm * self.R1.R
-
-        ax.plot_wireframe(Vg, Rd, gmRd_arr)
-        ax.set_xlabel(r'$V_{gs}$', fontsize=18)
-        ax.set_ylabel(r'$R_{d}$', fontsize=18)
-        ax.set_zlabel(r'$g_mRd$', fontsize=18)
+        vg = np.linspace(0, self.Vdd-2, self.points)
+        rd = np.linspace(1, 2000, self.points)
+        self.grid = grid = GridSweep([self.wire1], (self.nmos1, 'Vg', vg), (self.R1, 'R', rd),
+                                     source=(self.nmos1, 'Vg'), checkpoint=self.checkpoint,
+                                     tile=self.tile, interval=self.interval).run()
+        self.Vg, self.Rd = grid.X, grid.Y
+        self.Vout_grid = grid.voltages[..., 0]
+        self.gmRd_arr = grid.gm[..., 0] * self.Rd
+        self.gain_arr = grid.gain[..., 0]
+
+    def plot(self):
+        import plotting
+        plotting.cs_Vin_Rd_gmRd(self)
 
 
 def common_source_time_Vout():
-    CSTimeVout()
-    plt.xlabel(r'$t$', fontsize=18)
-    plt.ylabel(r'$V_{in}\ /\ V_{out}$', fontsize=18)
-    plt.legend()
-    plt.show()
+    CSTimeVout(ac=True).plot()
 
 
 def common_source_Vin_Vout():
-    CSVinVout()
-    plt.legend()
-    plt.show()
+    CSVinVout().plot()
 
 
 def common_source_Vin_Rd_gmRd():
-    CSVinRdgmRd()
-    plt.legend()
-    plt.show()
+    CSVinRdgmRd().plot()
 
 
 if __name__ == '__main__':
@@ -1,14 +1,18 @@
 from device import pMOS
 from device import Resistor
 from device import FreeWire
-import matplotlib.pyplot as plt
+from device import REGION_NAMES
+from circuit import Circuit
+from sweep import Continuation
+from montecarlo import MonteCarlo, normal, statistics
+from sink import ArraySink
 import numpy as np
 from abc import ABCMeta, abstractmethod
-from mpl_toolkits.mplot3d import Axes3D
 
 
 class CurrentMirror(object):
-    def __init__(self, device='Resistor', unit=1, name='R', param='1'):
+    def __init__(self, device='Resistor', unit=1, name='R', param='1', warm_start=True, batch=True,
+                 points=100, sink=None):
         self.Vdd, self.GND = 5.0, 0
         # self.Vin_arr = np.linspace(0, self.Vdd, 1000)
 
@@ -18,6 +22,11 @@ class CurrentMirror(object):
         self.R2 = Resistor(unit=2, R=5.0)
         self.wire1 = FreeWire()
         self.wire2 = FreeWire()
+        self.warm_start = warm_start  # 前の掃引点の解から外挿した値を初期値にする
+        self.batch = batch  # 全掃引点をまとめて解く
+        self.points = points  # R2の掃引点数
+        # V1 / I1 / V2 / I2 の書き込み先(既定はメモリ上)．NpySink などを渡すとファイルに書き出す
+        self.sink = ArraySink() if sink is None else sink
 
         if device not in ('nMOS', 'pMOS', 'Resistor'):
             raise NameError('mos: Invalid name')
@@ -41,34 +50,55 @@ class CurrentMirror(object):
         self.wire2.joint('ResistHi', self.R2)
 
     def process(self):
-        R2_arr = np.linspace(1, self.R1.R * 2, 100)
-        V1_arr = []  # 動かすパラメータごとに保持
-        I1_arr = []  # 動かすパラメータごとに保持
-        V2_arr = []  # 動かすパラメータごとに保持
-        I2_arr = []  # 動かすパラメータごとに保持
-        for R2 in R2_arr:
-            self.R2.R = R2
-            self.wire1.optimisation()
-            self.wire2.optimisation()
-            V1_arr.append(self.wire1.voltage)
-            I1_arr.append(self.wire1.current)
-            V2_arr.append(self.wire2.voltage)
-            I2_arr.append(self.wire2.current)
-            print('R2: {0}\t region: {1}'.format(self.R2.R, self.pmos2.region))
+        self.R2_arr = R2_arr = np.linspace(1, self.R1.R * 2, self.points)
+        self.sink.open({'V1': (), 'I1': (), 'V2': (), 'I2': ()}, len(R2_arr))
+        if self.batch:
+            # R2 に掃引点の配列をそのまま入れて一括で解く
+            # wire1はR2に依存しないので、wire1 → wire2 の順に1回ずつ解けばよい
+            self.R2.R = R2_arr
+            self.wire1.optimisation_batch()
+            self.wire2.optimisation_batch()
+            self.sink.write(V1=self.wire1.voltage, I1=self.wire1.current,
+                            V2=self.wire2.voltage, I2=self.wire2.current)
+            _, region_arr = self.pmos2.Id_batch(self.pmos2.Vg, self.pmos2.Vd, self.pmos2.Vs)
+            for R2, region in zip(R2_arr, region_arr):
+                print('R2: {0}\t region: {1}'.format(R2, REGION_NAMES[region]))
+        else:
+            # 依存グラフのブロック順(wire1 → wire2)に解く．R2 しか変わらないので、
+            # 2点目以降はR2に繋がる wire2 だけが解き直される(circuit.dirty)
+            circuit = Circuit([self.wire1, self.wire2])
+            predictor = Continuation()
+            for R2 in R2_arr:
+                self.R2.R = R2
+                guess = predictor.predict(R2) if self.warm_start else None
+                circuit.solve(guess)
+                predictor.update(R2, np.array([self.wire1.voltage, self.wire2.voltage]))
+                self.sink.append(V1=self.wire1.voltage, I1=self.wire1.current,
+                                 V2=self.wire2.voltage, I2=self.wire2.current)
+                print('R2: {0}\t region: {1}'.format(self.R2.R, self.pmos2.region))
 
-        plt.plot(R2_arr, V1_arr, label=r'$V_1$')
-        plt.plot(R2_arr, V2_arr, label=r'$V_2$')
-        plt.xlabel(r'$R_2\ $(R1 = {0})'.format(self.R1.R), fontsize=18)
-        plt.ylabel(r'$Voltage$', fontsize=18)
-        plt.legend()
-        plt.show()
-        plt.plot(R2_arr, I1_arr, label=r'$I_1$')
-        plt.plot(R2_arr, I2_arr, label=r'$I_2$')
-        plt.xlabel(r'$R_2\ $(R1 = {0})'.format(self.R1.R), fontsize=18)
-        plt.ylabel(r'$Current$', fontsize=18)
-        plt.legend()
-        plt.show()
+        self.sink.close()
+        self.V1_arr, self.I1_arr = self.sink['V1'], self.sink['I1']
+        self.V2_arr, self.I2_arr = self.sink['V2'], self.sink['I2']
+
+    def matching(self, samples=1000, sigma_Vth=0.01, sigma_beta=0.01, seed=0, R2=None):
+        # pmos1 / pmos2 のばらつきによる電流比 I2 / I1 のモンテカルロ(R2 は固定、既定は R1 と同じ)
+        self.R2.R = self.R1.R if R2 is None else R2
+        variations = {mos: {'Vth': normal(sigma_Vth), 'mu': normal(sigma_beta, relative=True)}
+                      for mos in (self.pmos1, self.pmos2)}
+        self.monte_carlo = mc = MonteCarlo([self.wire1, self.wire2], variations, samples, seed).run()
+        self.ratio = mc.current(self.wire2) / mc.current(self.wire1)
+        print('I2 / I1: ', statistics(self.ratio))
+        return self.ratio
+
+    def plot(self):
+        import plotting
+        plotting.current_mirror(self)
+
+    def plot_matching(self):
+        import plotting
+        plotting.monte_carlo(self.ratio, r'$I_2\ /\ I_1$')
 
 
 if __name__ == '__main__':
-    CurrentMirror()
+    CurrentMirror().plot()
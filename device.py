@@ -23,11 +23,223 @@
 
 # ・FreeWire: もっと簡潔に
 
-import matplotlib.pyplot as plt
-from mpl_toolkits.mplot3d import Axes3D
 import numpy as np
 from scipy import optimize
 from abc import ABCMeta, abstractmethod
+from collections import OrderedDict
+import hashlib
+import itertools
+import math
+import os
+
+
+# バッチ評価で返す動作領域コード
+WEAK_INVERSION, NON_LINEAR, LINEAR = 0, 1, 2
+REGION_NAMES = {WEAK_INVERSION: 'weak-inversion',
+                NON_LINEAR: 'non-linear',
+                LINEAR: 'linear'}
+REGION_COLORS = {WEAK_INVERSION: 'r', NON_LINEAR: 'b', LINEAR: 'g'}  # MOS.pcolor と同じ
+
+
+def _square_law(Vgs, Vds, beta, Vth, lmd):
+    # square_law / small_signal の共通部分
+    Vgs, Vds = np.asarray(Vgs, dtype=float), np.asarray(Vds, dtype=float)
+    if Vgs.shape != Vds.shape:
+        Vgs, Vds = np.broadcast_arrays(Vgs, Vds)
+    Vov = Vgs - Vth
+    region = np.where(Vov < 0, WEAK_INVERSION,
+                      np.where(Vds < Vov, NON_LINEAR, LINEAR))
+    non_linear, linear = region == NON_LINEAR, region == LINEAR
+    Id = np.where(non_linear, beta * (Vov - 0.5 * Vds) * Vds,
+                  np.where(linear, 0.5 * beta * Vov**2 * (1 + lmd * Vds), 0.0))
+    return Id, region, Vov, Vds, non_linear, linear
+
+
+def square_law(Vgs, Vds, beta, Vth, lmd):
+    # MOS.Id の領域分岐を配列のまま一括で評価する
+    # 引数はすべてブロードキャスト可能．Id と 領域コードの配列を返す
+    Id, region = _square_law(Vgs, Vds, beta, Vth, lmd)[:2]
+    return Id, region
+
+
+def small_signal(Vgs, Vds, beta, Vth, lmd):
+    # square_law に加えて gm = ∂Id/∂Vgs, gds = ∂Id/∂Vds を解析的に返す
+    # 各領域の式を微分したもの．weak-inversion では両方とも 0
+    Id, region, Vov, Vds, non_linear, linear = _square_law(Vgs, Vds, beta, Vth, lmd)
+    gm = np.where(non_linear, beta * Vds,
+                  np.where(linear, beta * Vov * (1 + lmd * Vds), 0.0))
+    gds = np.where(non_linear, beta * (Vov - Vds),
+                   np.where(linear, 0.5 * beta * Vov**2 * lmd, 0.0))
+    return Id, gm, gds, region
+
+
+def _region(Vgs, Vds, Vth):
+    # 動作領域コード．square_law と同じ境界
+    Vov = Vgs - Vth
+    return np.where(Vov < 0, WEAK_INVERSION, np.where(Vds < Vov, NON_LINEAR, LINEAR))
+
+
+# テーブルモデルのキャッシュ．メモリ上は直近 TABLE_CACHE_SIZE 組のパラメータ分をLRUで保持する
+# ディスクのキャッシュは既定で無効．TABLE_DIR にディレクトリを設定すると、そこに .npz で保存し、
+# 古いものから消して TABLE_DISK_SIZE 個までに抑える(1個 十数MB)
+TABLE_DIR = None
+TABLE_CACHE_SIZE = 8
+TABLE_DISK_SIZE = 32
+_tables = OrderedDict()
+
+
+class MOSTable(object):
+    # Id, gm, gds を格子上で事前に計算しておき、双3次Hermite補間で評価するMOSモデル
+    # 格子は (x, y) = (Vgs, Vds - Vov) で張り、x = Vth と y = 0 を格子線に乗せる
+    # ▶ 領域の境界(Vov = 0, Vds = Vov)をまたぐセルが無いので、lmd != 0 で Id が不連続でも補間が崩れない
+    # ▶ 各セルは領域の中の多項式(x に3次, y に1次以下)なので、square_law なら丸め誤差の範囲で一致する
+    # 補間した Id の微分をそのまま gm / gds として返すので、Newton法の残差とヤコビアンが整合する
+    # 格子の外側(Vgs, Vds > V_max)の点は解析モデルで評価する
+    # 構築時にセルの中点と乱数点で解析モデルと比べ、最大絶対誤差を error に保持する
+    # ▶ 高速化のためのものではない．square_law の解析式より、スカラーの Id で約70倍、
+    #   バッチで約10倍遅い．解析式の無いモデル(model に渡す実測・SPICE由来の関数など)を
+    #   同じ Id / gm / gds の形で使うためと、境界をまたがない補間での整合性のためのもの
+    def __init__(self, beta, Vth, lmd, V_max=6.0, points=241, model=small_signal):
+        self.beta, self.Vth, self.lmd = beta, Vth, lmd
+        self.V_max = V_max
+        self.model = model
+        self.h = h = V_max / (points - 1)
+        self.x = Vth + h * np.arange(-np.ceil(Vth / h), np.ceil((V_max - Vth) / h) + 1)
+        self.y = h * np.arange(np.floor((Vth - V_max) / h), np.ceil((V_max + Vth) / h) + 1)
+        self.coefficients = self._coefficients()
+        self.error = self._accuracy()
+
+    def _corner(self, cx, cy, eps=1e-12, delta=1e-6):
+        # 各セルの角 (cx, cy) での F = Id, ∂F/∂x = gm + gds, ∂F/∂y = gds, ∂²F/∂x∂y
+        # 領域の境界上の角でもセルの内側の値になるよう、角からセルの内側へ eps だけずらして評価する
+        sx, sy = 1 - 2 * cx, 1 - 2 * cy
+        x = self.x[cx:len(self.x) - 1 + cx] + sx * eps
+        y = self.y[cy:len(self.y) - 1 + cy] + sy * eps
+        Vgs, y = np.meshgrid(x, y, indexing='ij')
+        Vds = y + Vgs - self.Vth
+        Id, gm, gds, _ = self.model(Vgs, Vds, self.beta, self.Vth, self.lmd)
+        _, gm2, gds2, _ = self.model(Vgs, Vds + sy * delta, self.beta, self.Vth, self.lmd)
+        Fxy = (gm2 + gds2 - gm - gds) / (sy * delta)  # セルの内側への差分
+        return Id, gm + gds, gds, Fxy
+
+    def _coefficients(self):
+        # セルごとの 4x4 係数行列 M．行は x方向の (F(x0), F(x1), h∂x(x0), h∂x(x1))、列は y方向の同じ並び
+        h = self.h
+        M = np.empty((len(self.x) - 1, len(self.y) - 1, 4, 4))
+        for cx in (0, 1):
+            for cy in (0, 1):
+                F, Fx, Fy, Fxy = self._corner(cx, cy)
+                M[..., cx, cy] = F
+                M[..., cx, 2 + cy] = h * Fy
+                M[..., 2 + cx, cy] = h * Fx
+                M[..., 2 + cx, 2 + cy] = h * h * Fxy
+        return M
+
+    @staticmethod
+    def _basis(u):
+        # Hermite基底 (h00, h01, h10, h11) とその微分
+        u2, u3 = u * u, u * u * u
+        basis = np.stack([2 * u3 - 3 * u2 + 1, -2 * u3 + 3 * u2, u3 - 2 * u2 + u, u3 - u2], axis=-1)
+        derivative = np.stack([6 * u2 - 6 * u, -6 * u2 + 6 * u, 3 * u2 - 4 * u + 1, 3 * u2 - 2 * u],
+                              axis=-1)
+        return basis, derivative
+
+    def _interpolate(self, Vgs, Vds):
+        x, y = (Vgs - self.x[0]) / self.h, (Vds - Vgs + self.Vth - self.y[0]) / self.h
+        i = np.clip(np.floor(x).astype(int), 0, len(self.x) - 2)
+        j = np.clip(np.floor(y).astype(int), 0, len(self.y) - 2)
+        # 境界ぎりぎりの点は丸め誤差で隣のセルに入りうるので、解析モデルと同じ比較で領域側のセルに寄せる
+        i0, j0 = int(round((self.Vth - self.x[0]) / self.h)), int(round(-self.y[0] / self.h))
+        Vov = Vgs - self.Vth
+        i = np.where(Vov < 0, np.minimum(i, i0 - 1), np.maximum(i, i0))
+        j = np.where(Vds < Vov, np.minimum(j, j0 - 1), np.maximum(j, j0))
+        P, dP = self._basis(x - i)
+        Q, dQ = self._basis(y - j)
+        M = self.coefficients[i, j]
+        MQ = (M @ Q[..., None])[..., 0]
+        MdQ = (M @ dQ[..., None])[..., 0]
+        Id = np.sum(P * MQ, axis=-1)
+        Fx = np.sum(dP * MQ, axis=-1) / self.h
+        gds = np.sum(P * MdQ, axis=-1) / self.h
+        return Id, Fx - gds, gds
+
+    def __call__(self, Vgs, Vds):
+        # small_signal と同じく Id, gm, gds, 領域コードを返す
+        Vgs, Vds = np.asarray(Vgs, dtype=float), np.asarray(Vds, dtype=float)
+        if Vgs.shape != Vds.shape:
+            Vgs, Vds = np.broadcast_arrays(Vgs, Vds)
+        inside = (Vgs <= self.V_max) & (Vds <= self.V_max)
+        if np.all(inside):
+            Id, gm, gds = self._interpolate(Vgs, Vds)
+        else:
+            Id, gm, gds, _ = self.model(Vgs, Vds, self.beta, self.Vth, self.lmd)
+            Id, gm, gds = np.array(Id), np.array(gm), np.array(gds)
+            result = self._interpolate(Vgs[inside], Vds[inside])
+            for array, value in zip((Id, gm, gds), result):
+                array[inside] = value
+        return Id, gm, gds, _region(Vgs, Vds, self.Vth)
+
+    def _accuracy(self):
+        # 格子の中点と一様乱数点での、Id / gm / gds の解析モデルとの最大絶対誤差
+        mid = np.arange(0.5, (self.V_max / self.h)) * self.h
+        rng = np.random.default_rng(0)
+        Vgs = np.concatenate([np.repeat(mid, len(mid)), rng.uniform(0, self.V_max, 10000)])
+        Vds = np.concatenate([np.tile(mid, len(mid)), rng.uniform(0, self.V_max, 10000)])
+        exact = self.model(Vgs, Vds, self.beta, self.Vth, self.lmd)[:3]
+        return {name: float(np.max(np.abs(a - b)))
+                for name, a, b in zip(('Id', 'gm', 'gds'), self._interpolate(Vgs, Vds), exact)}
+
+    def save(self, path):
+        np.savez(path, x=self.x, y=self.y, h=self.h, V_max=self.V_max,
+                 coefficients=self.coefficients,
+                 error=[self.error['Id'], self.error['gm'], self.error['gds']])
+
+    @classmethod
+    def load(cls, path, beta, Vth, lmd, model=small_signal):
+        table = cls.__new__(cls)
+        with np.load(path) as data:
+            table.x, table.y, table.coefficients = data['x'], data['y'], data['coefficients']
+            table.h, table.V_max = float(data['h']), float(data['V_max'])
+            table.error = dict(zip(('Id', 'gm', 'gds'), data['error'].tolist()))
+        table.beta, table.Vth, table.lmd, table.model = beta, Vth, lmd, model
+        return table
+
+
+def mos_table(beta, Vth, lmd, V_max=6.0, points=241, model=small_signal, cache_dir=None):
+    # パラメータの組に対応する MOSTable を返す．メモリ → ディスク → 新規作成 の順に探す
+    # cache_dir を省略すると呼び出し時点の TABLE_DIR を使う(None ならディスクには保存しない)
+    cache_dir = TABLE_DIR if cache_dir is None else cache_dir
+    key = (model.__module__, model.__name__, float(beta), float(Vth), float(lmd),
+           float(V_max), int(points))
+    table = _tables.get(key)
+    if table is not None:
+        _tables.move_to_end(key)
+        return table
+    path = None
+    if cache_dir is not None:
+        path = os.path.join(cache_dir, hashlib.sha1(repr(key).encode()).hexdigest() + '.npz')
+    if path is not None and os.path.exists(path):
+        table = MOSTable.load(path, beta, Vth, lmd, model)
+        os.utime(path)  # 最近使ったものとして残す
+    else:
+        table = MOSTable(beta, Vth, lmd, V_max, points, model)
+        if path is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            table.save(path)
+            _prune_tables(cache_dir, TABLE_DISK_SIZE)
+    _tables[key] = table
+    if len(_tables) > TABLE_CACHE_SIZE:
+        _tables.popitem(last=False)
+    return table
+
+
+def _prune_tables(cache_dir, size):
+    # ディスクのキャッシュを、最後に使った時刻の新しいものから size 個だけ残す
+    paths = [os.path.join(cache_dir, name) for name in os.listdir(cache_dir)
+             if name.endswith('.npz')]
+    paths.sort(key=os.path.getmtime, reverse=True)
+    for path in paths[size:]:
+        os.remove(path)
 
 
 class MOS(metaclass=ABCMeta):
@@ -42,11 +254,43 @@ class MOS(metaclass=ABCMeta):
         self.lmd = lmd  # チャネル長変調．線形-非線形領域の接続を考慮して、とりあえず無視
         self.Vth = Vth  # しきい値
         self._beta = self.W / self.L * self.mu * self.Cox
-        self._gm = 0
+        self._gm, self._gds = 0, 0
         self._Id = 0  # 正ならD→S方向, 負ならS→D方向
         self.pcolor = 'navy'  # plotの色を保持
         self.unit = unit  # インスタンス名
         self.region = None
+        self.tabulate = False  # Trueなら解析式の代わりにテーブルモデル(MOSTable)で評価する(遅くなる)
+        # Idの評価結果のLRUキャッシュ．(Vg, Vd, Vs) → (Id, gm, gds, pcolor, region)
+        # cache_size = 0 なら無効(既定)．enable_cache で有効にする
+        self.cache_size = 0
+        self._cache = OrderedDict()
+        self._cache_params = None  # キャッシュを作ったときのパラメータ
+        self.hits, self.misses = 0, 0
+
+    def enable_cache(self, size=256):
+        # 直近 size 個のバイアス点の評価結果を保持する．size = 0 で無効
+        self.cache_size = size
+        self.invalidate()
+
+    def invalidate(self):
+        # キャッシュを捨てる．W / L / Vth などを書き換えた場合は参照時に自動で捨てる
+        # ▶ __setattr__ で監視すると、キャッシュ無効時も端子電圧の代入ごとに遅くなるため
+        self._cache.clear()
+        self._cache_params = None
+
+    def cache_info(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'maxsize': self.cache_size, 'currsize': len(self._cache)}
+
+    def lookup_table(self):
+        # tabulate が有効で、パラメータがスカラーなら対応する MOSTable を返す
+        # W / L / Vth などを配列で掃引している場合は解析式で評価する(Noneを返す)
+        if not self.tabulate:
+            return None
+        beta, Vth, lmd = self.beta, self.Vth, self.lmd
+        if np.ndim(beta) or np.ndim(Vth) or np.ndim(lmd):
+            return None
+        return mos_table(beta, Vth, lmd)
 
     @property
     def Vgs(self):
@@ -66,41 +310,99 @@ class MOS(metaclass=ABCMeta):
         self._beta = self.W / self.L * self.mu * self.Cox
         return self._beta
 
+    @property
+    def small_signal(self):
+        # Id と同時に gm = ∂Id/∂Vgs, gds = ∂Id/∂Vds を解析的に返す
+        self._gm, self._gds = 0, 0
+        Id = self.Id
+        return Id, self._gm, self._gds
+
     @property
     def gm(self):
-        tmp_Id = self.Id
-        self.Vg += 0.01
-        self._gm = (self.Id - tmp_Id) / 0.01
-        self.Vg -= 0.01
-        return self._gm
+        # 以前は Vg を 0.01 ずらした前進差分だった
+        return self.small_signal[1]
+
+    @property
+    def gds(self):
+        return self.small_signal[2]
 
     @abstractmethod
     def _exception(self):
         # Vdsの条件
         pass
 
+    @abstractmethod
+    def _batch_exception(self, Vd, Vs):
+        # Vdsの条件(配列版)
+        pass
+
     def _non_linear(self):
         # グラフの色を同時に出力(Blue)
-        self._Id = self.beta * ((self.Vgs - self.Vth) - 0.5 * self.Vds) * self.Vds
+        beta, Vov, Vds = self.beta, self.Vgs - self.Vth, self.Vds
+        self._Id = beta * (Vov - 0.5 * Vds) * Vds
+        self._gm, self._gds = beta * Vds, beta * (Vov - Vds)
         self.pcolor, self.region = 'b', 'non-linear'
         return self._Id
 
     def _linear(self):
         # グラフの色を同時に出力(Green)
-        self._Id = 0.5 * self.beta * (self.Vgs - self.Vth)**2 * (1 + self.lmd * self.Vds)
+        beta, Vov, Vds = self.beta, self.Vgs - self.Vth, self.Vds
+        self._Id = 0.5 * beta * Vov**2 * (1 + self.lmd * Vds)
+        self._gm = beta * Vov * (1 + self.lmd * Vds)
+        self._gds = 0.5 * beta * Vov**2 * self.lmd
         self.pcolor, self.region = 'g', 'linear'
         return self._Id
 
     def _weak_inversion(self):
         # グラフの色を同時に出力(Red)
         self._Id = 0
+        self._gm, self._gds = 0, 0
         self.pcolor, self.region = 'r', 'weak-inversion'
         return self._Id
 
+    def _table(self, table):
+        # テーブルモデルでの評価．色と領域名は解析式の場合と同じ
+        Id, gm, gds, region = table(self.Vgs, self.Vds)
+        self._Id, self._gm, self._gds = float(Id), float(gm), float(gds)
+        self.pcolor = REGION_COLORS[int(region)]
+        self.region = REGION_NAMES[int(region)]
+        return self._Id
+
     @property
     def Id(self):
+        if self.cache_size:
+            return self._cached_Id()
+        return self._evaluate_Id()
+
+    def _cached_Id(self):
+        # 同じ (Vg, Vd, Vs) の評価結果があれば、素子の状態ごと復元する
+        try:
+            key = (self.Vg, self.Vd, self.Vs)
+            params = (self.L, self.W, self.mu, self.Cox, self.lmd, self.Vth, self.tabulate)
+            if params != self._cache_params:
+                self.invalidate()
+                self._cache_params = params
+            entry = self._cache.get(key)
+        except (TypeError, ValueError):
+            return self._evaluate_Id()  # 端子電圧やパラメータが配列のときはキャッシュしない
+        if entry is not None:
+            self._cache.move_to_end(key)
+            self.hits += 1
+            self._Id, self._gm, self._gds, self.pcolor, self.region = entry
+            return self._Id
+        self.misses += 1
+        Id = self._evaluate_Id()
+        self._cache[key] = (Id, self._gm, self._gds, self.pcolor, self.region)
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return Id
+
+    def _evaluate_Id(self):
         self._exception()  # 負のVdsに対応していないため、例外を噛ませる
 
+        table = self.lookup_table()
+        if table is not None:
+            return self._table(table)
         if self.Vgs < 0:
             return 0
         elif self.Vgs < self.Vth:
@@ -110,6 +412,28 @@ class MOS(metaclass=ABCMeta):
         else:
             return self._linear()
 
+    def Id_batch(self, Vg, Vd, Vs):
+        # Vg / Vd / Vs の配列(ブロードキャスト可)から Id と領域コードを一括で算出
+        # インスタンスの Vg / Vd / Vs や region は書き換えない
+        Vg, Vd, Vs = np.asarray(Vg), np.asarray(Vd), np.asarray(Vs)
+        self._batch_exception(Vd, Vs)
+        table = self.lookup_table()
+        if table is not None:
+            Id, _, _, region = table(np.abs(Vg - Vs), np.abs(Vd - Vs))
+            return Id, region
+        return square_law(np.abs(Vg - Vs), np.abs(Vd - Vs),
+                          self.beta, self.Vth, self.lmd)
+
+    def small_signal_batch(self, Vg, Vd, Vs):
+        # Id_batch の gm / gds 付き版．Id, gm, gds, 領域コードを返す
+        Vg, Vd, Vs = np.asarray(Vg), np.asarray(Vd), np.asarray(Vs)
+        self._batch_exception(Vd, Vs)
+        table = self.lookup_table()
+        if table is not None:
+            return table(np.abs(Vg - Vs), np.abs(Vd - Vs))
+        return small_signal(np.abs(Vg - Vs), np.abs(Vd - Vs),
+                            self.beta, self.Vth, self.lmd)
+
 
 class nMOS(MOS):
     def __init__(self, unit='unknown', L=1, W=1, mu=2, Cox=1, lmd=0, Vth=0.7):
@@ -121,6 +445,10 @@ class nMOS(MOS):
         if self.Vd < self.Vs:
             raise ValueError('{0}: Vds is negative!'.format(self.ID))
 
+    def _batch_exception(self, Vd, Vs):
+        if np.any(Vd < Vs):
+            raise ValueError('{0}: Vds is negative!'.format(self.ID))
+
 
 class pMOS(MOS):
     def __init__(self, unit='unknown', L=1, W=1, mu=0.5, Cox=1, lmd=0, Vth=0.7):
@@ -134,6 +462,10 @@ class pMOS(MOS):
         if self.Vs < self.Vd:
             raise ValueError('{0}: Vds is positive!'.format(self.ID))
 
+    def _batch_exception(self, Vd, Vs):
+        if np.any(Vs < Vd):
+            raise ValueError('{0}: Vds is positive!'.format(self.ID))
+
 
 class FreeWire(object):
     # 素子と接続して、キルヒホッフの電流則を守るように電圧を決定する
@@ -145,11 +477,15 @@ class FreeWire(object):
         self.Gate = []  # MOSのGate ゲートリーク無し
         self.ResistHi = []  # 抵抗のHi端子
         self.ResistLo = []  # 抵抗のLo端子
+        self.CapA = []  # コンデンサのA端子 直流では開放
+        self.CapB = []  # コンデンサのB端子 直流では開放
 
         self.voltage = 0  # FreeWireの電圧
         self.current = 0  # FreeWireの電流
         self.previous_voltage = -np.inf
         self.previous_current = -np.inf
+        # 閉形式で解ける接続(closed_form)なら、二分法 / Newton法の代わりにそれを使う
+        self.analytic = True
 
     def __call__(self, name, instance):
         # Gate/Source/Drain端子と接続
@@ -176,7 +512,7 @@ class FreeWire(object):
         # MOSとのDrain接続
         for drain in self.Drain:
             drain.Vd = voltage  # Vdをvoltage(二分法のパラメータ)に設定
-            if drain.__class__.__name__ is 'nMOS':
+            if isinstance(drain, nMOS):
                 result -= drain.Id  # nMOSのDrainと接続されてたら流出
             else:
                 result += drain.Id  # pMOSのDrainと接続されてたら流入
@@ -185,9 +521,9 @@ class FreeWire(object):
         # MOSとのSource接続
         for source in self.Source:
             source.Vs = voltage  # Vsをvoltage(二分法のパラメータ)に設定
-            if source.__class__.__name__ is 'nMOS':
+            if isinstance(source, nMOS):
                 result += source.Id  # nMOSのSoueceと接続されてたら流入
-                self.current += drain.Id  # FreeWireの電流(貫通電流)を流入で換算
+                self.current += source.Id  # FreeWireの電流(貫通電流)を流入で換算
             else:
                 result -= source.Id  # pMOSのSoueceと接続されてたら流出
 
@@ -202,20 +538,31 @@ class FreeWire(object):
             result += Rl.Ir  # Hi側との接続なら流出
             self.current += Rl.Ir  # FreeWireの電流(貫通電流)を流入で換算
 
+        # コンデンサとの接続．直流では電流は流れないので、電圧設定だけ
+        for Ca in self.CapA:
+            Ca.Va = voltage
+        for Cb in self.CapB:
+            Cb.Vb = voltage
+
         return result
 
     def generate_constraints(self):
         # nMOSだとVd > Vs, pMOSだとVs > Vd, 抵抗だと Vh > Vlを守れるような範囲を返す
+        min_arr, max_arr = self._constraint_lists()
+        return max(min_arr), min(max_arr)
+
+    def _constraint_lists(self):
+        # generate_constraints の下限 / 上限の候補を集める
         min_arr, max_arr = [], []
 
         for drain in self.Drain:
-            if drain.__class__.__name__ is 'nMOS':
+            if isinstance(drain, nMOS):
                 min_arr.append(drain.Vs)
             else:
                 max_arr.append(drain.Vs)
 
         for source in self.Source:
-            if source.__class__.__name__ is 'nMOS':
+            if isinstance(source, nMOS):
                 max_arr.append(source.Vd)
             else:
                 min_arr.append(source.Vd)
@@ -228,18 +575,34 @@ class FreeWire(object):
 
         # print(min_arr, max_arr)  # debug
 
-        return max(min_arr), min(max_arr)
+        return min_arr, max_arr
 
-    def optimisation(self):
+    def optimisation(self, guess=None, width=1e-2):
         # brent法で最適化
         # 二分法の上位互換なので、端点[a, b]が解になった場合は検出できない
         # ▶ 端点のみ条件分岐で対応
+        # guessを渡すと、そこからNewton法(解析的なgm/gds)で修正する(ウォームスタート)
+        # ▶ 初期値が無いか、Newton法が[a, b]をはみ出したら閉形式(closed_form)で解く
+        # ▶ 閉形式で解けない接続なら、guessの周り±widthの狭い区間で符号変化を探す
+        # ▶ それでも見つからなかったときだけ[a, b]全体で探し直す
         # previous_voltage との差分が1e-6以下ならFalse, それ以外ならTrueを返す
         a, b = self.generate_constraints()
 
         # print(a, b)  # debug
 
-        if abs(self.current_law(a)) < 1e-6:
+        voltage = None
+        if guess is not None:
+            voltage = self._newton(a, b, guess)
+        if voltage is None and self.analytic:
+            voltage = self._closed_form_scalar(a, b)
+            if voltage is not None:
+                self.current_law(voltage)  # 電流と各MOSの状態を解に合わせる
+        if voltage is None and guess is not None:
+            voltage = self._local_search(a, b, guess, width)
+
+        if voltage is not None:
+            self.voltage = voltage
+        elif abs(self.current_law(a)) < 1e-6:
             self.voltage = a
         elif abs(self.current_law(b)) < 1e-6:
             self.voltage = b
@@ -252,19 +615,364 @@ class FreeWire(object):
 
         return flag
 
+    def _slope(self):
+        # 直前の current_law(voltage) に対する result の voltage 微分
+        # 各MOSの gm / gds は current_law 内の Id 評価で更新済み
+        slope = 0
+        for mos_list, terminal in ((self.Drain, 'Vd'), (self.Source, 'Vs')):
+            for mos in mos_list:
+                s = 1 if isinstance(mos, nMOS) else -1
+                sg = 1 if mos.Vg > mos.Vs else -1 if mos.Vg < mos.Vs else s
+                dId = {'Vg': sg * mos._gm, 'Vd': s * mos._gds}
+                dId['Vs'] = -(dId['Vg'] + dId['Vd'])
+                flow = -s if terminal == 'Vd' else s  # Drainへは -s*Id, Sourceへは +s*Id
+                on_wire = [terminal]
+                if mos in self.Gate:
+                    on_wire.append('Vg')
+                if terminal == 'Vd' and mos in self.Source:
+                    on_wire.append('Vs')
+                elif terminal == 'Vs' and mos in self.Drain:
+                    on_wire.append('Vd')
+                slope += flow * sum(dId[name] for name in on_wire)
+
+        for R in self.ResistHi + self.ResistLo:
+            slope -= 1 / R.R
+
+        return slope
+
+    def _newton(self, a, b, guess, max_iter=8):
+        # guessから始めるNewton法．[a, b]をはみ出すか収束しなければNoneを返す
+        voltage = min(max(guess, a), b)
+        for _ in range(max_iter):
+            result = self.current_law(voltage)
+            if result == 0:
+                return voltage
+            slope = self._slope()
+            if slope == 0:
+                return None
+            step = -result / slope
+            voltage += step
+            if not a <= voltage <= b:
+                return None
+            if abs(step) <= 2e-12 + 4 * np.finfo(float).eps * abs(voltage):
+                return voltage
+
+        return None
+
+    def _local_search(self, a, b, guess, width, expand=3):
+        # guessを中心とした区間で符号変化を探し、見つかればbrent法で解く
+        # 見つからなければ区間を4倍ずつ広げ、expand回で諦めてNoneを返す
+        guess = min(max(guess, a), b)
+        for _ in range(expand + 1):
+            lo, hi = max(a, guess - width), min(b, guess + width)
+            f_lo, f_hi = self.current_law(lo), self.current_law(hi)
+
+            # 端点[a, b]そのものが解の場合は optimisation と同じ扱い
+            if lo == a and abs(f_lo) < 1e-6:
+                return a
+            if hi == b and abs(f_hi) < 1e-6:
+                return b
+            if f_lo * f_hi <= 0:
+                return optimize.brentq(self.current_law, lo, hi)
+            if lo == a and hi == b:
+                break
+            width *= 4
+
+        return None
+
+    # --*-- 掃引点をまとめて解くバッチ版 --*--
+    # 掃引したい端子電圧やパラメータ(Vg, R, W, ...)にNumPy配列を入れておくと、
+    # 全掃引点を1本のベクトル化した反復で同時に解く
+
+    def _mos_terminals(self, mos, voltage):
+        # FreeWireに繋がっている端子はvoltageで置き換えた Vg / Vd / Vs
+        Vg = voltage if mos in self.Gate else mos.Vg
+        Vd = voltage if mos in self.Drain else mos.Vd
+        Vs = voltage if mos in self.Source else mos.Vs
+        return Vg, Vd, Vs
+
+    def current_law_batch(self, voltage):
+        # current_law の配列版．流入電流の総和、その voltage 微分、貫通電流を返す
+        # 素子の端子電圧は書き換えない
+        result, slope, current = 0, 0, 0
+
+        for mos in self.Drain + [source for source in self.Source if source not in self.Drain]:
+            Vg, Vd, Vs = self._mos_terminals(mos, voltage)
+            Id, gm, gds, _ = mos.small_signal_batch(Vg, Vd, Vs)
+            s = 1 if isinstance(mos, nMOS) else -1
+            sg = np.where(Vg > Vs, 1, np.where(Vg < Vs, -1, s))
+            dId = {'Vg': sg * gm, 'Vd': s * gds}
+            dId['Vs'] = -(dId['Vg'] + dId['Vd'])
+            dId_dV = sum(dId[name] for name, on_wire in
+                         (('Vg', mos in self.Gate), ('Vd', mos in self.Drain),
+                          ('Vs', mos in self.Source)) if on_wire)
+
+            if mos in self.Drain:
+                result, slope = result - s * Id, slope - s * dId_dV  # nMOSなら流出, pMOSなら流入
+                if s < 0:
+                    current = current + Id
+            if mos in self.Source:
+                result, slope = result + s * Id, slope + s * dId_dV  # nMOSなら流入, pMOSなら流出
+                if s > 0:
+                    current = current + Id
+
+        for Rh in self.ResistHi:
+            Ir = (voltage - Rh.Vl) / Rh.R
+            result, slope = result - Ir, slope - 1 / Rh.R  # Hi側との接続なら流出
+
+        for Rl in self.ResistLo:
+            Ir = (Rl.Vh - voltage) / Rl.R
+            result, slope = result + Ir, slope - 1 / Rl.R  # Lo側との接続なら流入
+            current = current + Ir
+
+        return result, slope, current
+
+    def generate_constraints_batch(self):
+        # generate_constraints の配列版
+        min_arr, max_arr = self._constraint_lists()
+        return (np.max(np.broadcast_arrays(*min_arr), axis=0),
+                np.min(np.broadcast_arrays(*max_arr), axis=0))
+
+    def optimisation_batch(self, xtol=2e-12, max_iter=100):
+        # 全掃引点を同時に解く．閉形式(closed_form)で解けなかった点だけ反復で解く
+        # 反復回数を返す(全点が閉形式で解けたら 0)
+        a, b = self.generate_constraints_batch()
+        solved = self.closed_form(a, b) if self.analytic else None
+        if solved is not None and not np.any(np.isnan(solved)):
+            voltage, iteration = solved, 0
+        else:
+            voltage, iteration = self._safeguarded_newton(a, b, solved, xtol, max_iter)
+
+        _, _, self.current = self.current_law_batch(voltage)
+        self.voltage = voltage
+        self._set_terminals(voltage)
+        return iteration
+
+    def _safeguarded_newton(self, a, b, solved, xtol, max_iter):
+        # Newton法と二分法の組み合わせ(safeguarded Newton)
+        # 点ごとに区間[lo, hi]で符号変化を保ち、Newtonの更新が区間の内側(端点は含まない)に入り、
+        # かつ1つ前の更新幅の半分以下のときだけ採用する．それ以外は二分法
+        # ▶ lmd != 0 で Id が不連続だと、Newtonの更新が区間の端に戻って区間が縮まずに周回するため
+        # 収束した点はマスクして以降は動かさない．solved が NaN でない点は解けているものとして動かさない
+        f_a, _, _ = self.current_law_batch(a)
+        f_b, _, _ = self.current_law_batch(b)
+        a, b, f_a, f_b = np.broadcast_arrays(a, b, f_a, f_b)
+        solved = np.full(a.shape, np.nan) if solved is None else np.broadcast_to(solved, a.shape)
+        pending = np.isnan(solved)
+
+        # 端点[a, b]そのものが解の場合は optimisation と同じ扱い
+        at_a = np.abs(f_a) < 1e-6
+        at_b = ~at_a & (np.abs(f_b) < 1e-6)
+        active = pending & ~(at_a | at_b)
+        if np.any(active & (f_a * f_b > 0)):
+            raise ValueError('f(a) and f(b) must have different signs')
+
+        lo, hi, f_lo = a.astype(float), b.astype(float), f_a.astype(float)
+        voltage = np.where(~pending, solved, np.where(at_a, a, np.where(at_b, b, 0.5 * (a + b))))
+        step = np.abs(hi - lo)  # 1つ前の更新幅
+
+        iteration = 0
+        while np.any(active) and iteration < max_iter:
+            iteration += 1
+            f, slope, _ = self.current_law_batch(voltage)
+            f, slope = np.broadcast_to(f, a.shape), np.broadcast_to(slope, a.shape)
+
+            # 区間の更新．f(lo)と同符号ならloを、そうでなければhiを置き換える
+            same = np.sign(f) == np.sign(f_lo)
+            lo = np.where(active & same, voltage, lo)
+            f_lo = np.where(active & same, f, f_lo)
+            hi = np.where(active & ~same, voltage, hi)
+
+            with np.errstate(divide='ignore', invalid='ignore'):
+                newton = voltage - f / slope
+            use_newton = (np.isfinite(newton) & (newton > lo) & (newton < hi)
+                          & (np.abs(newton - voltage) <= 0.5 * step))
+            new_voltage = np.where(use_newton, newton, 0.5 * (lo + hi))
+            step = np.where(active, np.abs(new_voltage - voltage), step)
+
+            converged = (f == 0) | (np.abs(new_voltage - voltage) <= xtol) | (hi - lo <= xtol)
+            voltage = np.where(active & (f != 0), new_voltage, voltage)
+            active = active & ~converged
+
+        if np.any(active):
+            raise RuntimeError('FreeWire: batch iteration did not converge')
+        return voltage, iteration
+
+    # --*-- 閉形式の解 --*--
+    # MOSのドレイン(ゲート・ソースは固定)、ダイオード接続(ゲートとドレイン、lmd = 0)と抵抗だけが
+    # 繋がったFreeWireでは、各MOSの動作領域を決めればKCLは電圧の高々2次式になる
+    # 領域の組み合わせごとに2次方程式を解き、根が[a, b]に入っていて領域が仮定と一致するものを解とする
+    # (インバータ、ソース接地、カレントミラー、差動対の負荷側など)
+
+    def _closed_form_terms(self):
+        # MOSごとに (s, Vs, Vgs(ダイオード接続なら None), beta, Vth, lmd) を返す
+        # 閉形式で解けない接続(Sourceへの接続、lmd ≠ 0 のダイオード接続、テーブルモデル)なら None
+        if self.Source:
+            return None
+        terms = []
+        for mos in self.Drain:
+            diode = mos in self.Gate
+            if mos.lookup_table() is not None or (diode and np.any(mos.lmd != 0)):
+                return None
+            s = 1 if isinstance(mos, nMOS) else -1
+            Vgs = None if diode else abs(mos.Vg - mos.Vs)
+            terms.append((s, mos.Vs, Vgs, mos.beta, mos.Vth, mos.lmd))
+        return terms
+
+    @staticmethod
+    def _term_coefficients(term, region):
+        # 領域 region でのKCLへの寄与 -s*Id を voltage の2次式の係数 (c0, c1, c2) で返す
+        # Id は w = voltage - Vs の2次式 q0 + q1*w + q2*w**2 として作り、voltage の式に直す
+        s, Vs, Vgs, beta, Vth, lmd = term
+        if region == WEAK_INVERSION:
+            return 0, 0, 0
+        if Vgs is None:  # ダイオード接続(Vgs = Vds = s*w)．常にlinear
+            q0, q1, q2 = 0.5 * beta * Vth**2, -s * beta * Vth, 0.5 * beta
+        elif region == NON_LINEAR:
+            Vov = Vgs - Vth
+            q0, q1, q2 = 0, s * beta * Vov, -0.5 * beta
+        else:
+            Vov = Vgs - Vth
+            q0, q1, q2 = 0.5 * beta * Vov**2, 0.5 * beta * Vov**2 * lmd * s, 0
+        return (-s * (q0 - q1 * Vs + q2 * Vs**2), -s * (q1 - 2 * q2 * Vs), -s * q2)
+
+    @staticmethod
+    def _in_region(term, voltage, region, slack):
+        # voltage での動作領域が region か．境界から slack 以内はどちらの領域ともみなす
+        s, Vs, Vgs, beta, Vth, lmd = term
+        Vds = s * (voltage - Vs)
+        Vov = (Vds if Vgs is None else Vgs) - Vth
+        if region == WEAK_INVERSION:
+            return Vov < slack
+        if region == NON_LINEAR:
+            return (Vov >= -slack) & (Vds < Vov + slack)
+        return (Vov >= -slack) & (Vds >= Vov - slack)
+
+    @staticmethod
+    def _quadratic_roots(c0, c1, c2):
+        # c0 + c1*x + c2*x**2 = 0 の実根2つ(無いものは NaN)．桁落ちしない形の解の公式
+        c0, c1, c2 = (np.asarray(c, dtype=float) for c in (c0, c1, c2))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            q = -0.5 * (c1 + np.copysign(np.sqrt(c1**2 - 4 * c2 * c0), c1))
+            first = np.where(c2 == 0, -c0 / c1, q / c2)
+            second = np.where(c2 == 0, np.nan, c0 / q)
+        return first, second
+
+    def _closed_form_polynomials(self):
+        # 領域の組み合わせごとのKCLの係数．(terms, [(領域の組み合わせ, (c0, c1, c2)), ...]) を返す
+        # 閉形式で解けない接続なら None
+        terms = self._closed_form_terms()
+        if terms is None:
+            return None
+        c0, c1 = 0, 0
+        for Rh in self.ResistHi:  # Hi側との接続なら流出 -(voltage - Vl)/R
+            c0, c1 = c0 + Rh.Vl / Rh.R, c1 - 1 / Rh.R
+        for Rl in self.ResistLo:  # Lo側との接続なら流入 (Vh - voltage)/R
+            c0, c1 = c0 + Rl.Vh / Rl.R, c1 - 1 / Rl.R
+
+        choices = []
+        for term in terms:
+            regions = (WEAK_INVERSION, LINEAR) if term[2] is None else \
+                (WEAK_INVERSION, NON_LINEAR, LINEAR)
+            choices.append([(region, self._term_coefficients(term, region)) for region in regions])
+        polynomials = []
+        for combination in itertools.product(*choices):
+            k0, k1, k2 = c0, c1, 0
+            for _, (d0, d1, d2) in combination:
+                k0, k1, k2 = k0 + d0, k1 + d1, k2 + d2
+            polynomials.append((tuple(region for region, _ in combination), (k0, k1, k2)))
+        return terms, polynomials
+
+    def closed_form(self, a, b, slack=1e-12):
+        # [a, b]での解を返す(配列でもよい)．解けなかった点は NaN、閉形式で解けない接続なら None
+        found = self._closed_form_polynomials()
+        if found is None:
+            return None
+        terms, polynomials = found
+        a, b = np.asarray(a, dtype=float), np.asarray(b, dtype=float)
+        voltage = np.nan
+        for regions, coefficients in polynomials:
+            for root in self._quadratic_roots(*coefficients):
+                ok = np.isnan(voltage) & (root >= a - slack) & (root <= b + slack)
+                root = np.clip(root, a, b)
+                for term, region in zip(terms, regions):
+                    ok = ok & self._in_region(term, root, region, slack)
+                voltage = np.where(ok, root, voltage)
+
+        # lmd ≠ 0 だと non-linear / linear の境界で Id が不連続なので、根が無く境界をまたいで
+        # 符号が変わるだけの点がある．その境界を解とする(二分法が収束する先と同じ)
+        for s, Vs, Vgs, beta, Vth, lmd in terms:
+            if not np.any(np.isnan(voltage)) or Vgs is None:
+                continue
+            edge = Vs + s * (Vgs - Vth)
+            inside = (Vgs > Vth) & (edge > a) & (edge < b)
+            f_lo, _, _ = self.current_law_batch(np.clip(edge - 1e-9, a, b))
+            f_hi, _, _ = self.current_law_batch(np.clip(edge + 1e-9, a, b))
+            ok = np.isnan(voltage) & inside & (f_lo * f_hi <= 0)
+            voltage = np.where(ok, edge, voltage)
+        return voltage
+
+    def _closed_form_scalar(self, a, b, slack=1e-12):
+        # closed_form の1点版(optimisation 用)．0次元配列の演算は遅いので、Pythonのfloatのまま解く
+        # 解が無ければ(Idが不連続な境界など) None を返し、brent法に任せる
+        found = self._closed_form_polynomials()
+        if found is None:
+            return None
+        terms, polynomials = found
+        for regions, (c0, c1, c2) in polynomials:
+            if c2 == 0:
+                roots = (-c0 / c1,) if c1 != 0 else ()
+            else:
+                discriminant = c1 * c1 - 4 * c2 * c0
+                if discriminant < 0:
+                    continue
+                q = -0.5 * (c1 + math.copysign(math.sqrt(discriminant), c1))
+                roots = (q / c2, c0 / q) if q != 0 else ()
+            for root in roots:
+                if not a - slack <= root <= b + slack:
+                    continue
+                root = min(max(root, a), b)
+                if all(self._in_region(term, root, region, slack)
+                       for term, region in zip(terms, regions)):
+                    return root
+        return None
+
+    def _set_terminals(self, voltage):
+        # current_law と同様に、接続先の端子電圧をvoltageにしておく
+        for gate in self.Gate:
+            gate.Vg = voltage
+        for drain in self.Drain:
+            drain.Vd = voltage
+        for source in self.Source:
+            source.Vs = voltage
+        for Rh in self.ResistHi:
+            Rh.Vh = voltage
+        for Rl in self.ResistLo:
+            Rl.Vl = voltage
+        for Ca in self.CapA:
+            Ca.Va = voltage
+        for Cb in self.CapB:
+            Cb.Vb = voltage
+
 
 class Capacitor(object):
     # 端子に電圧がかかった時間に応じて電荷を蓄積する
-    # 内部電荷で電圧が確定
-    # 片方の電位をFixしてもう片方の電位を電荷で決めるイメージ
-    # 両端子にFreeWireが接続されていたら、、、
-    # 「時間」の概念が導入されるので、FreeWireの最適化問題と組み合わせると
-    # 計算時間が爆発しそう．厄介なのでとりあえず保留
+    # 内部電荷で電圧が確定 Q = C * (Va - Vb)
+    # 電流はVa→Vbの向き(A端子から流れ込む向き)を正とする
+    # 直流(FreeWire.optimisation / Circuit.solve)では開放として扱う
+    # 「時間」の概念が要る解析は transient.Transient で陰的積分する
+    # ▶ 前の時刻の解を初期値にするので、FreeWireの最適化は数回のNewton法で済む
     # コンパレートとAZは切り分けて考えたほうがよさそう
-    def __init__(self, unit='unknown'):
-        self.C = 1
+    def __init__(self, unit='unknown', C=1):
+        self.C = C
         self.Q = 0
         self.Va, self.Vb = 0, 0
+        self.unit = unit
+
+    @property
+    def Vc(self):
+        # 端子間電圧
+        return self.Va - self.Vb
 
 
 class Resistor(object):
@@ -280,81 +988,3 @@ class Resistor(object):
     def Ir(self):
         self._Ir = (self.Vh - self.Vl) / self.R
         return self._Ir
-
-
-# --*-- 関数エリア --*--
-
-def plot_mos_gm():
-    nmos1 = nMOS(unit=1)
-    Vdd = 5
-
-    for Vd in [0.5, 1.0, 1.5, 2.0, 2.5, 3.0, 3.5, 4.0, 4.5, 5.0]:
-        nmos1.Vs, nmos1.Vd = 0, Vd
-        Vg_arr = np.linspace(0, Vdd, 100)
-        Id_arr = []
-
-        for Vg in Vg_arr:
-            nmos1.Vg = Vg
-            Id_arr.append(nmos1.Id)
-
-        plt.plot(Vg_arr, np.gradient(Id_arr, Vdd/100), label='Vds={0}'.format(Vd))
-
-    plt.xlabel(r'$V_{gs}$', fontsize=18)
-    plt.ylabel(r'$g_m$', fontsize=18)
-    plt.legend()
-    plt.show()
-
-
-def plot_mos_3d():
-    # 3Dplot
-    nmos1 = nMOS(unit=1)
-    vg = np.linspace(0, 3.0, 100)
-    vd = np.linspace(0, 3.0, 100)
-    Vg, Vd = np.meshgrid(vg, vd)
-    Id_2darr = [[0 for _ in range(100)] for __ in range(100)]
-    fig = plt.figure()
-    ax = Axes3D(fig)
-
-    for i in range(100):
-        for j in range(100):
-            nmos1.Vg = Vg[i][j]
-            nmos1.Vd = Vd[i][j]
-            Id_2darr[i][j]= nmos1.Id
-            # ax.scatter3D(nmos1.Vg, nmos1.Vd, Id_2darr[i][j], c=nmos1.pcolor)
-
-    ax.plot_wireframe(Vg, Vd, Id_2darr)
-    ax.set_xlabel(r'$V_{gs}$', fontsize=18)
-    ax.set_ylabel(r'$V_{ds}$', fontsize=18)
-    ax.set_zlabel(r'$I_d$', fontsize=18)
-    plt.legend()
-    plt.show()
-
-
-def plot_mos_operate_point():
-    nmos1 = nMOS(unit=1)
-    Vdd = 5
-
-    for Vg in [0.5, 1.0, 1.5, 2.0, 2.5, 3.0, 3.5, 4.0, 4.5, 5.0]:
-        nmos1.Vs, nmos1.Vg = 0, Vg
-        Vd_arr = np.linspace(0, Vdd, 100)
-        Id_arr = []
-
-        for Vd in Vd_arr:
-            nmos1.Vd = Vd
-            Id_arr.append(nmos1.Id)
-
-        plt.plot(Vd_arr, Id_arr, label='Vgs={0}'.format(Vg))
-
-    for R in [1, 3, 6, 9, 12, 15]:
-        operate_arr = [(Vdd - Vds) / R for Vds in Vd_arr]
-        plt.plot(Vd_arr, operate_arr, label='operate R={0}'.format(R))
-
-    plt.xlabel(r'$V_{ds}$', fontsize=18)
-    plt.ylabel(r'$I_d$', fontsize=18)
-    plt.legend()
-    plt.show()
-
-
-if __name__ == '__main__':
-    # plot_mos_gm()
-    pass
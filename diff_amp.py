@@ -1,14 +1,21 @@
 from device import Resistor
 from device import nMOS
 from device import FreeWire
-import matplotlib.pyplot as plt
+from circuit import Circuit
+from sweep import Continuation
+from instrument import mark
+from montecarlo import MonteCarlo, normal, statistics
+from ac import AC
+from sink import ArraySink
 import numpy as np
 from enum import IntEnum
 
 
 class DiffAmp(object):
-    def __init__(self, device='Resistor', unit=1, name='R', param='1'):
+    def __init__(self, device='Resistor', unit=1, name='R', param='1', solver='newton',
+                 warm_start=True, points=1000, sink=None):
         self.Vdd, self.GND = 5.0, 0
+        self.points = points  # 時刻の点数
 
         self.R1 = Resistor(unit=1, R=10)
         self.R2 = Resistor(unit=1, R=10)
@@ -24,12 +31,17 @@ class DiffAmp(object):
 
         if device not in ('nMOS', 'pMOS', 'Resistor'):
             raise NameError('mos: Invalid name')
-
+        if solver not in ('newton', 'relaxation'):
+            raise NameError('solver: Invalid name')
+        self.solver = solver
+        self.warm_start = warm_start  # 前の時刻の解から外挿した値を初期値にする
+        self.iterations = []  # 時刻ごとのNewton反復回数 / 緩和法の周回数
+
+        # 時刻ごとの V1, I1, ... の書き込み先(既定はメモリ上)．NpySink などを渡すとファイルに書き出す
+        self.sink = ArraySink() if sink is None else sink
         self.result = {}
-        for wire in self.wires:
-            self.result['V'+wire.unit] = []
-            self.result['I'+wire.unit] = []
 
+        self.joint_wire()
         self.process()
 
     def joint_wire(self):
@@ -50,48 +62,80 @@ class DiffAmp(object):
     def process(self):
 
         Vin_DC = 2.0
-        time_arr = np.linspace(0, 6 * np.pi, 1000)
-        Vin1_time_arr = 0.01 * np.sin(time_arr) + Vin_DC
-        Vin2_time_arr = -0.01 * np.sin(time_arr) + Vin_DC
+        self.time_arr = time_arr = np.linspace(0, 6 * np.pi, self.points)
+        self.Vin1_time_arr = Vin1_time_arr = 0.01 * np.sin(time_arr) + Vin_DC
+        self.Vin2_time_arr = Vin2_time_arr = -0.01 * np.sin(time_arr) + Vin_DC
+
+        circuit = Circuit(self.wires)
+        predictor = Continuation()
+        self.sink.open({prefix + wire.unit: () for wire in self.wires for prefix in 'VI'},
+                       len(time_arr))
 
-        for time, Vin1, Vin2 in zip(time_arr, Vin1_time_arr, Vin2_time_arr):
+        for point, (time, Vin1, Vin2) in enumerate(zip(time_arr, Vin1_time_arr, Vin2_time_arr)):
+            mark(point=point, sweep=0)  # 計測用のタグ(instrument.Recorder が無効なら何もしない)
             # print('\r', '{0:.2f}%'.format(time / max(time_arr) * 100),
             #       end='', flush=True)
-            self.joint_wire()
             self.nmos1.Vg = Vin1
             self.nmos2.Vg = Vin2
-
-            flags = [True] * 3
-            while(any(flags)):
-                for i, wire in enumerate(self.wires):
-                    flags[i] = wire.optimisation()
-
-            for wire in self.wires:
-                self.result['V'+wire.unit].append(wire.voltage)
-                self.result['I'+wire.unit].append(wire.current)
-
-            for wire in self.wires:
-                wire.__init__(unit=wire.unit)
+            guess = predictor.predict(time) if self.warm_start else None
+
+            if self.solver == 'newton':
+                # 全ノードのKCLをまとめてNewton法で解く
+                self.iterations.append(circuit.solve(guess))
+            else:
+                # 依存グラフのブロック順に緩和法を回す(互いに依存し合うFreeWireの間だけ周回する)
+                # 1周目は前の時刻からの予測、2周目以降は前の周の解から始める
+                self.iterations.append(circuit.relaxation(guess, predictor.width()))
+
+            predictor.update(time, np.array([wire.voltage for wire in self.wires]))
+
+            self.sink.append(**{prefix + wire.unit: getattr(wire, name) for wire in self.wires
+                                for prefix, name in (('V', 'voltage'), ('I', 'current'))})
+
+            if not self.warm_start:
+                # 前の時刻の解を捨てて、毎回ゼロから解き直す
+                for wire in self.wires:
+                    wire.voltage = 0
+                    wire.previous_voltage = -np.inf
         else:
+            mark(point=-1, sweep=-1)
+            self.sink.close()
+            self.result = {name: self.sink[name] for name in self.sink.keys()}
             for mos in self.mosz:
                 print(mos.unit, mos.region)  # for debug
-
-        plt.plot(time_arr, np.array(self.result['V1']) - np.array(self.result['V2']),label=r'$V_1-V_2$')
-        A = np.sqrt(2 * self.result['I3'][0]) * self.R1.R
-        plt.plot(time_arr, (np.array(Vin1_time_arr) - np.array(Vin2_time_arr)) * A, label=r'$V_{in1}$')
-        plt.xlabel(r'$time$', fontsize=18)
-        plt.ylabel(r'$Voltage$', fontsize=18)
-        plt.legend()
-        plt.show()
+            print('{0}: {1} iterations in total'.format(self.solver, sum(self.iterations)))
 
         print(np.ptp(self.result['I3']))
-        # plt.plot(time_arr, self.result['V3'], label=r'$V_3$')
-        plt.plot(time_arr, self.result['I3'], label=r'$I_3$')
-        plt.xlabel(r'$time$', fontsize=18)
-        plt.ylabel(r'$Voltage\ /\ Current$', fontsize=18)
-        plt.legend()
-        plt.show()
+
+    def offset(self, samples=1000, sigma_Vth=0.01, sigma_beta=0.01, seed=0, Vin_DC=2.0):
+        # 入力対(nmos1, nmos2)と負荷抵抗のばらつきによるオフセットのモンテカルロ
+        # 両入力を Vin_DC にしたときの出力差 V1 - V2 と、それを公称の差動利得で割った入力換算値
+        # sigma_beta は mu と R の相対ばらつき
+        self.nmos1.Vg = self.nmos2.Vg = Vin_DC
+        variations = {mos: {'Vth': normal(sigma_Vth), 'mu': normal(sigma_beta, relative=True)}
+                      for mos in (self.nmos1, self.nmos2)}
+        variations.update({R: {'R': normal(sigma_beta, relative=True)} for R in (self.R1, self.R2)})
+        self.monte_carlo = mc = MonteCarlo(self.wires, variations, samples, seed).run()
+
+        # 差動利得 (V1 - V2) / (Vin1 - Vin2) は公称の動作点での小信号解析から
+        H1 = AC(self.wires, (self.nmos1, 'Vg'), solve=False).run(0.0)[0]
+        H2 = AC(self.wires, (self.nmos2, 'Vg'), solve=False).run(0.0)[0]
+        self.Ad = ((H1[0] - H1[1]) - (H2[0] - H2[1])).real / 2
+
+        self.Vout_offset = mc.voltage(self.wire1) - mc.voltage(self.wire2)
+        self.Vin_offset = self.Vout_offset / self.Ad
+        print('Ad: {0:.4g}'.format(self.Ad))
+        print('input offset: ', statistics(self.Vin_offset))
+        return self.Vin_offset
+
+    def plot(self):
+        import plotting
+        plotting.diff_amp(self)
+
+    def plot_offset(self):
+        import plotting
+        plotting.monte_carlo(self.Vin_offset, r'$V_{in,offset}$')
 
 
 if __name__ == '__main__':
-    DiffAmp()
+    DiffAmp().plot()
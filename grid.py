@@ -0,0 +1,119 @@
+# 2つのパラメータを軸にした格子掃引
+# 軸は (素子, 属性名, 値の配列)．固定端子の電圧(nmos1.Vg など)でも、素子のパラメータ
+# (R, W, L, Vth, ...)でもよい．格子の全点を CompiledCircuit のバッチとして一括で解き、
+# 動作点(各ノードの電圧・電流)、MOSごとの Id / gm / gds / 領域、source からの小信号利得を配列で返す
+#
+#   grid = GridSweep([wire1], (nmos1, 'Vg', vg), (R1, 'R', rd), source=(nmos1, 'Vg')).run()
+#   grid.gm[..., 0] * grid.Y      # gm*Rd の曲面
+#   grid.gain[..., 0]             # dVout/dVg
+#
+# 格子の形は np.meshgrid と同じ (y の点数, x の点数)
+# checkpoint を渡すと tile 行ずつ解いて保存し、中断しても続きから計算する(checkpoint.tiled_sweep)
+
+from circuit import Circuit, TERMINALS, _scatter
+from checkpoint import tiled_sweep
+import hashlib
+import numpy as np
+
+
+class GridSweep(object):
+    def __init__(self, wires, x, y, source=None, max_iter=100, checkpoint=None, tile=None,
+                 interval=60.0):
+        self.wires = list(wires)
+        self.x, self.y = x, y
+        self.max_iter = max_iter
+        self.checkpoint = checkpoint
+        self.tile = tile  # 1回のバッチで解く行数(None なら格子全体)
+        self.interval = interval
+        self.circuit = Circuit(self.wires)
+        compiled = self.circuit.compiled
+
+        fixed = [(id(device), terminal) for device, terminal in compiled.fixed]
+        for device, name, _ in (x, y):
+            if name in TERMINALS.values() and (id(device), name) not in fixed:
+                raise ValueError('GridSweep: {0} is connected to a FreeWire'.format(name))
+        self.source = None  # 利得を求める入力のノード番号
+        if source is not None:
+            device, terminal = source
+            if (id(device), terminal) not in fixed:
+                raise ValueError('GridSweep: source must be a terminal not connected to any FreeWire')
+            self.source = compiled.n + fixed.index((id(device), terminal))
+
+    def columns(self):
+        n, k = self.circuit.compiled.n, len(self.circuit.compiled.mos)
+        columns = {'voltages': (n,), 'currents': (n,), 'Id': (k,), 'gm': (k,), 'gds': (k,),
+                   'region': (k,), 'converged': ()}
+        if self.source is not None:
+            columns['gain'] = (n,)
+        return columns
+
+    def key(self):
+        # チェックポイントの照合用．軸の名前と値、入力に加えて、回路のつながり・固定端子の電圧・
+        # 素子のパラメータから決まる(軸以外を変えて再開したときに、前の計算のタイルを使わないように)
+        compiled = self.circuit.compiled
+        compiled.update()
+        digest = hashlib.sha1()
+        for device, name, values in (self.x, self.y):
+            digest.update('{0}.{1}:'.format(type(device).__name__, name).encode())
+            digest.update(np.asarray(values, dtype=float).tobytes())
+        digest.update(str(self.source).encode())
+        arrays = [compiled.rows, compiled.cols, compiled.polarity, compiled.fixed_voltage,
+                  compiled.R, compiled.C] + [getattr(compiled, name) for name in compiled.params]
+        for array in arrays:
+            array = np.asarray(array, dtype=float)
+            digest.update(str(array.shape).encode())
+            digest.update(array.tobytes())
+        digest.update(repr(([mos.tabulate for mos in compiled.mos], self.max_iter)).encode())
+        return digest.hexdigest()
+
+    def run(self):
+        # 公称値の動作点を解き、それを初期値に格子の全点をまとめて解く
+        self.circuit.solve()
+        self.nominal = np.array([wire.voltage for wire in self.wires], dtype=float)
+        self.X, self.Y = np.meshgrid(np.asarray(self.x[2], dtype=float),
+                                     np.asarray(self.y[2], dtype=float))
+        tile = None if self.tile is None else (self.tile, self.X.shape[1])
+        result = tiled_sweep(self._solve, self.X.shape, self.columns(), tile,
+                             self.checkpoint, self.interval, self.key())
+        for name, values in result.items():
+            setattr(self, name, values)
+        self.converged = self.converged.astype(bool)
+        self.region = self.region.astype(int)
+        return self
+
+    def _solve(self, slices):
+        # 格子の一部 slices を1つのバッチとして解く．収束しなかった点の電圧・電流・利得は NaN
+        circuit, compiled = self.circuit, self.circuit.compiled
+        X, Y = self.X[slices], self.Y[slices]
+        saved = [(device, name, getattr(device, name)) for device, name, _ in (self.x, self.y)]
+        try:
+            setattr(self.x[0], self.x[1], X)
+            setattr(self.y[0], self.y[1], Y)
+            compiled.update()
+            v, _, norm = compiled.newton(
+                np.broadcast_to(self.nominal, X.shape + (compiled.n,)), circuit.xtol, circuit.ftol,
+                circuit.max_step, self.max_iter, strict=False)
+            converged = norm <= np.sqrt(circuit.ftol)
+            result = {'currents': compiled.current(v), 'Id': compiled.Id, 'gm': compiled.gm,
+                      'gds': compiled.gds, 'region': compiled.region, 'voltages': v,
+                      'converged': converged}
+            if self.source is not None:
+                result['gain'] = self._gain(v)
+        finally:
+            for device, name, value in saved:
+                setattr(device, name, value)
+            compiled.update()
+
+        for name in ('voltages', 'currents', 'gain'):
+            if name in result:
+                result[name] = np.where(converged[..., None], result[name], np.nan)
+        return result
+
+    def _gain(self, v):
+        # 動作点で線形化した dv/dVsource = -J^-1 (∂f/∂Vsource)．ac.AC の直流(f=0)と同じ
+        compiled = self.circuit.compiled
+        _, values = compiled.evaluate(v)
+        column = (compiled.rows < compiled.n) & (compiled.cols == self.source)
+        g_in = _scatter(values[..., column], compiled.rows[column], compiled.n)
+        active = np.ones(v.shape[:-1], dtype=bool)
+        return compiled.solve_linear(values, g_in, active)
@@ -0,0 +1,243 @@
+# ソルバーの計測．FreeWire.optimisation / Circuit.solve の1回ごとに
+# current_law の呼び出し回数、brentq の反復回数、探索区間の幅、かかった時間、MOSの領域を記録する
+# バッチの掃引(FreeWire.optimisation_batch)と、モンテカルロ・格子掃引・過渡解析が直接呼ぶ
+# CompiledCircuit.newton も1回ずつ記録する．points はまとめて解いた点数(スカラーなら1)
+#
+#   with Recorder() as recorder:
+#       DiffAmp(solver='relaxation')
+#   recorder.summary()        # FreeWireごとの合計
+#   recorder.to_arrays()      # 列ごとのNumPy配列
+#   recorder.to_json('x.json')
+#
+# 計測中だけ FreeWire / Circuit のメソッドを差し替えるので、無効なときのコストは無い
+# 回路側から mark(point=i, sweep=k) で掃引点や緩和法の周回を記録に付けられる(無効なら何もしない)
+
+from contextlib import contextmanager
+import json
+import time
+import numpy as np
+
+import circuit
+import device
+
+_recorder = None  # 計測中の Recorder
+
+
+def mark(**tags):
+    # 以降の記録に付けるタグ(掃引点の番号、緩和法の周回など)を設定する
+    if _recorder is not None:
+        _recorder.tags.update(tags)
+
+
+class _Optimize(object):
+    # device.optimize の代わり．brentq の反復回数を記録し、それ以外は scipy.optimize に委ねる
+    def __init__(self, recorder, optimize):
+        self._recorder, self._optimize = recorder, optimize
+
+    def __getattr__(self, name):
+        return getattr(self._optimize, name)
+
+    def brentq(self, f, a, b, **kwargs):
+        kwargs['full_output'] = True
+        root, result = self._optimize.brentq(f, a, b, **kwargs)
+        record = self._recorder.current
+        if record is not None:
+            record['brentq_iterations'] += result.iterations
+        return root
+
+
+class Recorder(object):
+    columns = ('wire', 'kind', 'index', 'point', 'sweep', 'points', 'calls', 'brentq_iterations',
+               'newton_iterations', 'width', 'time')
+
+    def __init__(self):
+        self.records = []  # optimisation / solve 1回ごとの dict
+        self.tags = {}
+        self.current = None  # 記録中の dict
+        self._index = {}  # FreeWireごとの optimisation の通し番号
+        self._restore = []
+
+    # --*-- 差し替え --*--
+
+    def _patch(self, owner, name, wrapper):
+        original = getattr(owner, name)
+        setattr(owner, name, wrapper(original))
+        self._restore.append(lambda: setattr(owner, name, original))
+
+    def _start(self, wire, kind):
+        record = {'wire': wire.unit, 'kind': kind,
+                  'index': self._index.get(wire.unit, 0),
+                  'point': self.tags.get('point', -1), 'sweep': self.tags.get('sweep', -1),
+                  'points': 1, 'calls': 0, 'brentq_iterations': 0, 'newton_iterations': 0,
+                  'width': np.nan, 'time': 0.0, 'regions': {}}
+        self._index[wire.unit] = record['index'] + 1
+        return record
+
+    @staticmethod
+    def _regions(wires):
+        regions = {}
+        for wire in wires:
+            for mos in wire.Drain + wire.Source + wire.Gate:
+                regions[mos.ID] = np.asarray(mos.region).tolist()  # バッチなら点ごとのリスト
+        return regions
+
+    def __enter__(self):
+        global _recorder
+        if _recorder is not None:
+            raise RuntimeError('Recorder: another recorder is active')
+        recorder = self
+
+        def current_law(function):
+            def wrapper(wire, voltage):
+                if recorder.current is not None:
+                    recorder.current['calls'] += 1
+                return function(wire, voltage)
+            return wrapper
+
+        def generate_constraints(function):
+            def wrapper(wire):
+                a, b = function(wire)
+                if recorder.current is not None:
+                    recorder.current['width'] = b - a
+                return a, b
+            return wrapper
+
+        def optimisation(function):
+            def wrapper(wire, *args, **kwargs):
+                outer, recorder.current = recorder.current, recorder._start(wire, 'relaxation')
+                start = time.perf_counter()
+                try:
+                    return function(wire, *args, **kwargs)
+                finally:
+                    record, recorder.current = recorder.current, outer
+                    record['time'] = time.perf_counter() - start
+                    record['regions'] = recorder._regions([wire])
+                    recorder.records.append(record)
+            return wrapper
+
+        def generate_constraints_batch(function):
+            def wrapper(wire):
+                a, b = function(wire)
+                if recorder.current is not None:
+                    recorder.current['width'] = float(np.max(np.subtract(b, a)))  # 最も広い点
+                return a, b
+            return wrapper
+
+        def current_law_batch(function):
+            def wrapper(wire, voltage):
+                if recorder.current is not None:
+                    recorder.current['calls'] += 1
+                return function(wire, voltage)
+            return wrapper
+
+        def optimisation_batch(function):
+            # 全掃引点をまとめて1件．newton_iterations は閉形式で解けなかった点の反復回数
+            def wrapper(wire, *args, **kwargs):
+                outer, recorder.current = recorder.current, recorder._start(wire, 'batch')
+                record = recorder.current
+                start = time.perf_counter()
+                try:
+                    iteration = function(wire, *args, **kwargs)
+                    record['newton_iterations'] = iteration
+                    record['points'] = int(np.size(wire.voltage))
+                    return iteration
+                finally:
+                    recorder.current = outer
+                    record['time'] = time.perf_counter() - start
+                    recorder.records.append(record)
+            return wrapper
+
+        def newton(function):
+            # Circuit.solve などの記録の中から呼ばれたときは、その記録に含まれるので数えない
+            def wrapper(compiled, voltages, *args, **kwargs):
+                if recorder.current is not None:
+                    return function(compiled, voltages, *args, **kwargs)
+                record = recorder._start(compiled.wires[0], 'compiled')
+                record['wire'] = ','.join(wire.unit for wire in compiled.wires)
+                start = time.perf_counter()
+                try:
+                    result = function(compiled, voltages, *args, **kwargs)
+                    record['newton_iterations'] = result[1]
+                    record['points'] = int(np.prod(np.shape(result[0])[:-1]))
+                    return result
+                finally:
+                    record['time'] = time.perf_counter() - start
+                    recorder.records.append(record)
+            return wrapper
+
+        def solve(function):
+            # Circuit.solve は全FreeWireまとめて1件として記録する(wire は先頭のFreeWire)
+            def wrapper(solver, *args, **kwargs):
+                outer, recorder.current = recorder.current, recorder._start(solver.wires[0], 'newton')
+                record = recorder.current
+                record['wire'] = ','.join(wire.unit for wire in solver.wires)
+                start = time.perf_counter()
+                try:
+                    iteration = function(solver, *args, **kwargs)
+                    record['newton_iterations'] = iteration
+                    record['points'] = int(np.size(solver.wires[0].voltage))
+                    return iteration
+                finally:
+                    recorder.current = outer
+                    record['calls'] = 0  # 書き戻しの current_law は数えない
+                    record['time'] = time.perf_counter() - start
+                    record['regions'] = recorder._regions(solver.wires)
+                    recorder.records.append(record)
+            return wrapper
+
+        self._patch(device.FreeWire, 'current_law', current_law)
+        self._patch(device.FreeWire, 'generate_constraints', generate_constraints)
+        self._patch(device.FreeWire, 'optimisation', optimisation)
+        self._patch(device.FreeWire, 'generate_constraints_batch', generate_constraints_batch)
+        self._patch(device.FreeWire, 'current_law_batch', current_law_batch)
+        self._patch(device.FreeWire, 'optimisation_batch', optimisation_batch)
+        self._patch(circuit.Circuit, 'solve', solve)
+        self._patch(circuit.CompiledCircuit, 'newton', newton)
+        self._patch(device, 'optimize', lambda optimize: _Optimize(self, optimize))
+        _recorder = self
+        return self
+
+    def __exit__(self, *exc):
+        global _recorder
+        for undo in reversed(self._restore):
+            undo()
+        self._restore = []
+        self.tags = {}
+        _recorder = None
+        return False
+
+    # --*-- 出力 --*--
+
+    def to_arrays(self):
+        # 列名 → 配列．regions は {MOSのID: 領域名} の object配列
+        arrays = {name: np.array([record[name] for record in self.records])
+                  for name in self.columns}
+        arrays['regions'] = np.array([record['regions'] for record in self.records], dtype=object)
+        return arrays
+
+    def to_json(self, path=None):
+        text = json.dumps(self.records, indent=1, default=float)
+        if path is not None:
+            with open(path, 'w') as f:
+                f.write(text)
+        return text
+
+    def summary(self):
+        # FreeWireごとの合計．時間のかかっている順
+        totals = {}
+        for record in self.records:
+            total = totals.setdefault(record['wire'], {
+                'solves': 0, 'calls': 0, 'brentq_iterations': 0, 'newton_iterations': 0,
+                'time': 0.0, 'max_calls': 0})
+            total['solves'] += 1
+            for name in ('calls', 'brentq_iterations', 'newton_iterations', 'time'):
+                total[name] += record[name]
+            total['max_calls'] = max(total['max_calls'], record['calls'])
+        return dict(sorted(totals.items(), key=lambda item: -item[1]['time']))
+
+
+@contextmanager
+def recording():
+    # with recording() as recorder: ... の短縮形
+    with Recorder() as recorder:
+        yield recorder
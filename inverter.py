@@ -1,24 +1,34 @@
 from device import nMOS
 from device import pMOS
 from device import FreeWire
-import matplotlib.pyplot as plt
+from sweep import Continuation, adaptive_sweep
+from parallel import parallel_sweep
+from sink import ArraySink
+from sensitivity import Sensitivity
 import numpy as np
 
 
 class Inverter(object):
-    def __init__(self, mos, name, param):
+    def __init__(self, mos, name, param, warm_start=True, batch=True, points=1000, sink=None,
+                 adaptive=False, tol=1e-3):
         # 引数は動かすパラメータとそのMOS
         # --*-- unitで分けなければならない --*--
         # --*-- 抵抗でもいいでしょ？ --*--
         # --*-- たぶん親クラス作ったほうがいい --*--
         self.Vdd, self.GND = 3, 0
-        self.Vin_arr = np.linspace(0, 3, 1000)
-        self.Vout_arr = []  # 動かすパラメータごとに保持
-        self.Ileak_arr = []  # 動かすパラメータごとに保持
+        self.Vin_arr = np.linspace(0, 3, points)  # 掃引点数
+        # Vout / Ileak の書き込み先(既定はメモリ上)．NpySink などを渡すとファイルに書き出す
+        self.sink = ArraySink() if sink is None else sink
 
         self.nmos1 = nMOS(unit=1)
         self.pmos1 = pMOS(unit=1)
         self.wire1 = FreeWire()
+        self.warm_start = warm_start  # 前の掃引点の解から外挿した値を初期値にする
+        self.batch = batch  # 全掃引点をまとめて解く
+        # 適応掃引．Vout が曲がっている所だけ掃引点を細かくする(Vin_arr は不等間隔になる)
+        # tol は線形補間したときの Vout の許容誤差[V]
+        self.adaptive = adaptive
+        self.tol = tol
         if mos not in ('nMOS', 'pMOS'):
             raise NameError('mos: Invalid name')
 
@@ -33,32 +43,93 @@ class Inverter(object):
         self.wire1.joint('Drain', self.pmos1)
 
     def process(self, mos='nMOS', name='L', param=1):
+        # name / param はタプルで複数まとめて指定してもよい (('W', 'L'), (2, 1))
         mos_obj = self.nmos1 if mos == 'nMOS' else self.pmos1
-        setattr(mos_obj, name, param)  # mos_obj.__dict__[name] = param
-        change_mos = mos_obj.__class__.__name__
+        names, params = (name, param) if isinstance(name, tuple) else ((name,), (param,))
+        for n, p in zip(names, params):
+            setattr(mos_obj, n, p)  # mos_obj.__dict__[name] = param
+        setting = ', '.join('{0}={1}'.format(n, p) for n, p in zip(names, params))
+        self.label = '{0} {1}'.format(mos_obj.__class__.__name__, setting)
 
-        for Vin in self.Vin_arr:
-            self.nmos1.Vg = Vin
-            self.pmos1.Vg = Vin
-            self.wire1.optimisation()
-            self.Vout_arr.append(self.wire1.voltage)
-            self.Ileak_arr.append(self.wire1.current)
+        if self.adaptive:
+            self.Vin_arr, result = adaptive_sweep(self.solve_batch, self.Vin_arr[0], self.Vin_arr[-1],
+                                                  self.tol, key='Vout')
+        self.sink.open({'Vout': (), 'Ileak': ()}, len(self.Vin_arr))
+        if self.adaptive:
+            self.sink.write(**result)
+        elif self.batch:
+            # Vg に掃引点の配列をそのまま入れて一括で解く
+            self.sink.write(**self.solve_batch(self.Vin_arr))
+        else:
+            predictor = Continuation()
+            for Vin in self.Vin_arr:
+                self.nmos1.Vg = Vin
+                self.pmos1.Vg = Vin
+                guess = predictor.predict(Vin) if self.warm_start else None
+                self.wire1.optimisation(guess, predictor.width())
+                predictor.update(Vin, self.wire1.voltage)
+                self.sink.append(Vout=self.wire1.voltage, Ileak=self.wire1.current)
+        self.sink.close()
+        self.Vout_arr, self.Ileak_arr = self.sink['Vout'], self.sink['Ileak']
 
-        plt.plot(self.Vin_arr, self.Vout_arr,
-                 label='Vout: {0} {1}={2}'.format(change_mos, name, param))
-        plt.plot(self.Vin_arr, self.Ileak_arr,
-                 label='Ileak: {0} {1}={2}'.format(change_mos, name, param))
+    def solve_batch(self, Vin_arr):
+        # Vin_arr の全点をまとめて解き、{'Vout': 配列, 'Ileak': 配列} を返す
+        self.nmos1.Vg = Vin_arr
+        self.pmos1.Vg = Vin_arr
+        self.wire1.optimisation_batch()
+        return {'Vout': self.wire1.voltage, 'Ileak': self.wire1.current}
 
+    def sensitivity(self):
+        # 掃引の全点の動作点で、Vout の全パラメータによる微分 dVout/dp を随伴法でまとめて求める
+        # パラメータごとに掃引を解き直さなくてよい．{'nMOS': {名前: 配列}, 'pMOS': 同} で返す
+        self.nmos1.Vg = self.Vin_arr
+        self.pmos1.Vg = self.Vin_arr
+        self.wire1.voltage = self.Vout_arr
+        sens = Sensitivity([self.wire1], solve=False).run()
+        self.dVout = {mos.__class__.__name__: {name: sens.derivative(self.wire1, mos, name)
+                                               for name in Sensitivity.params if name != 'R'}
+                      for mos in (self.nmos1, self.pmos1)}
+        return self.dVout
 
-def inverter():
+    def plot(self):
+        # 現在の図に Vout / Ileak を描き足す(表示は plotting.inverter_show)
+        import plotting
+        plotting.inverter_curves(self.Vin_arr, self.Vout_arr, self.Ileak_arr, self.label)
+
+
+def inverter_task(param, mos='pMOS', name='L'):
+    # parallel_sweep 用．Inverterを解いて Vout / Ileak を返す
+    # 複数パラメータの格子なら name=('W', 'L') とし、param に値のタプルを渡す
+    inv = Inverter(mos, name, param)
+    return {'Vout': inv.Vout_arr, 'Ileak': inv.Ileak_arr}
+
+
+def inverter(processes=None, plot=True):
     # Inverter
-    for L in (0.5, 1, 1.5, 2.0, 10):
-        Inverter('pMOS', 'L', L)
+    # Lごとの回路は独立なので、プロセスプールで並列に解いてから描画する
+    # 結果は {'Vout': (L数, 掃引点数), 'Ileak': 同} で返す
+    L_arr = (0.5, 1, 1.5, 2.0, 10)
+    Vin_arr = np.linspace(0, 3, 1000)
+    result = parallel_sweep(inverter_task, L_arr,
+                            {'Vout': Vin_arr.shape, 'Ileak': Vin_arr.shape}, processes)
+
+    if plot:
+        import plotting
+        for L, Vout, Ileak in zip(L_arr, result['Vout'], result['Ileak']):
+            plotting.inverter_curves(Vin_arr, Vout, Ileak, 'pMOS L={0}'.format(L))
+        plotting.inverter_show()
+    return result
+
 
-    plt.xlabel(r'$V_{in}$', fontsize=18)
-    plt.ylabel(r'$V_{out}\ /\ I_{leak}$', fontsize=18)
-    plt.legend()
-    plt.show()
+def inverter_sensitivity(mos='pMOS', name='L', plot=True):
+    # L = 1 の掃引1回と随伴法の感度解析で、各 Vin での dVout/dL を求める
+    # inverter() のように L の値ごとに掃引を解き直さずに、L への依存性を見る
+    inv = Inverter('pMOS', 'L', 1)
+    dVout = inv.sensitivity()[mos][name]
+    if plot:
+        import plotting
+        plotting.inverter_sensitivity(inv.Vin_arr, dVout, '{0} {1}'.format(mos, name))
+    return dVout
 
 
 if __name__ == '__main__':
@@ -0,0 +1,112 @@
+# 素子パラメータのばらつき(Vth / mu / W / L / R ...)によるモンテカルロ解析
+# 標本ごとに素子を作り直して解くのではなく、パラメータを標本数の長さの配列にして
+# CompiledCircuit のバッチとして全標本を1回のNewton法で解く
+#
+#   mc = MonteCarlo(wires, {nmos1: {'Vth': normal(0.01)}, nmos2: {'Vth': normal(0.01)}},
+#                   samples=10000, seed=0).run()
+#   statistics(mc.voltages[:, 0] - mc.voltages[:, 1])
+#
+# 分布は draw(rng, nominal, size) の形の関数．normal / uniform で作るか、自分で書いて渡す
+
+from circuit import Circuit
+import numpy as np
+
+
+def normal(sigma, relative=False):
+    # 公称値を平均とする正規分布．relative=True なら sigma は公称値に対する比
+    def draw(rng, nominal, size):
+        scale = sigma * np.abs(nominal) if relative else sigma
+        return nominal + scale * rng.standard_normal(size)
+    return draw
+
+
+def uniform(width, relative=False):
+    # 公称値 ± width の一様分布．relative=True なら width は公称値に対する比
+    def draw(rng, nominal, size):
+        scale = width * np.abs(nominal) if relative else width
+        return nominal + scale * rng.uniform(-1, 1, size)
+    return draw
+
+
+def statistics(values, percentiles=(0.135, 2.275, 50, 97.725, 99.865)):
+    # 平均、標準偏差、最小、最大と、±3σ / ±2σ 相当の百分位点(NaN は未収束の標本として除く)
+    values = np.asarray(values, dtype=float)
+    values = values[np.isfinite(values)]
+    result = {'samples': values.size, 'mean': float(np.mean(values)),
+              'std': float(np.std(values, ddof=1)), 'min': float(np.min(values)),
+              'max': float(np.max(values))}
+    for q, value in zip(percentiles, np.percentile(values, percentiles)):
+        result['p{0:g}'.format(q)] = float(value)
+    return result
+
+
+def yield_ratio(values, low=-np.inf, high=np.inf):
+    # low <= values <= high を満たす標本の割合(歩留まり)．未収束の標本は不良に数える
+    values = np.asarray(values, dtype=float)
+    return np.count_nonzero((values >= low) & (values <= high)) / values.size
+
+
+class MonteCarlo(object):
+    # variations = {素子: {パラメータ名: 分布}}．パラメータは CompiledCircuit.update が読む
+    # 属性(MOSの W, L, mu, Cox, Vth, lmd、抵抗の R、コンデンサの C)
+    # 標本は seed から決まる順(素子、パラメータの順)に引くので、同じ seed なら同じ標本になる
+    def __init__(self, wires, variations, samples=1000, seed=0, max_iter=100):
+        self.wires = list(wires)
+        self.variations = variations
+        self.samples = samples
+        self.seed = seed
+        self.max_iter = max_iter
+        self.circuit = Circuit(self.wires)
+
+    def draw(self):
+        # {(素子, パラメータ名): 標本の配列} を返す
+        rng = np.random.default_rng(self.seed)
+        self.parameters = {}
+        for device, distributions in self.variations.items():
+            for name, distribution in distributions.items():
+                nominal = getattr(device, name)
+                self.parameters[(device, name)] = np.asarray(
+                    distribution(rng, nominal, self.samples), dtype=float)
+        return self.parameters
+
+    def run(self):
+        # 公称値の動作点を解き、それを初期値に全標本をまとめて解く
+        # 結果は voltages / currents (標本数, FreeWire数)、Id / region (標本数, MOS数)
+        # 収束しなかった標本は converged が False で、電圧・電流は NaN
+        circuit, compiled = self.circuit, self.circuit.compiled
+        circuit.solve()
+        nominal = np.array([wire.voltage for wire in self.wires], dtype=float)
+        parameters = self.draw()
+
+        saved = [(device, name, getattr(device, name)) for device, name in parameters]
+        try:
+            for (device, name), values in parameters.items():
+                setattr(device, name, values)
+            compiled.update()
+            v, self.iterations, norm = compiled.newton(
+                np.broadcast_to(nominal, (self.samples, compiled.n)), circuit.xtol, circuit.ftol,
+                circuit.max_step, self.max_iter, strict=False)
+            self.currents = compiled.current(v)
+            self.Id, self.region = compiled.Id, compiled.region
+        finally:
+            for device, name, value in saved:
+                setattr(device, name, value)
+            compiled.update()
+
+        self.residual_norm = norm
+        self.converged = norm <= np.sqrt(circuit.ftol)
+        self.voltages = np.where(self.converged[:, None], v, np.nan)
+        self.currents = np.where(self.converged[:, None], self.currents, np.nan)
+        self.nominal = nominal
+        return self
+
+    def voltage(self, wire):
+        return self.voltages[:, self.wires.index(wire)]
+
+    def current(self, wire):
+        return self.currents[:, self.wires.index(wire)]
+
+    def histogram(self, values, bins=50):
+        # np.histogram と同じ (度数, 区間の端)．NaN は除く
+        values = np.asarray(values, dtype=float)
+        return np.histogram(values[np.isfinite(values)], bins=bins)
@@ -0,0 +1,69 @@
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import itertools
+import os
+import numpy as np
+
+
+def parameter_grid(**axes):
+    # parameter_grid(W=[1, 2], L=[0.5, 1]) → (('W', 'L'), [(1, 0.5), (1, 1), (2, 0.5), (2, 1)])
+    # 全組み合わせを1次元に並べる．結果を reshape するときの形は shape で返す
+    names = tuple(axes)
+    params = list(itertools.product(*axes.values()))
+    shape = tuple(len(values) for values in axes.values())
+    return names, params, shape
+
+
+def _run(task, index, param, specs):
+    # ワーカー側の処理．共有メモリにattachして、自分の担当行だけ書き込む
+    result = task(param)
+    for name, shm_name, shape, dtype in specs:
+        shm = shared_memory.SharedMemory(name=shm_name)
+        try:
+            np.ndarray(shape, dtype=dtype, buffer=shm.buf)[index] = result[name]
+        finally:
+            shm.close()
+
+
+def _run_chunk(task, indices, params, specs):
+    for index, param in zip(indices, params):
+        _run(task, index, param, specs)
+
+
+def parallel_sweep(task, params, shapes, processes=None, dtype=float):
+    # 独立な回路インスタンスをプロセスプールに振り分けて解く
+    # task(param) は {名前: 配列} を返す関数(pickle可能なモジュール直下の関数 / partial)
+    # shapes = {名前: 1点分の形}．結果は共有メモリ上の (len(params),) + 形 の配列に書き込まれる
+    # 各点の計算はシリアル実行と全く同じなので、結果もビット単位で一致する
+    params = list(params)
+    n = len(params)
+    processes = os.cpu_count() if processes is None else processes
+
+    shms, specs, arrays = [], [], {}
+    try:
+        for name, shape in shapes.items():
+            shape = (n,) + tuple(shape)
+            nbytes = max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1)
+            shm = shared_memory.SharedMemory(create=True, size=nbytes)
+            shms.append(shm)
+            specs.append((name, shm.name, shape, dtype))
+            arrays[name] = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+        if processes <= 1 or n <= 1:
+            _run_chunk(task, range(n), params, specs)
+        else:
+            # 1タスクあたりのプロセス間通信を減らすため、数点ずつまとめて渡す
+            chunk = max(1, n // (processes * 4))
+            with ProcessPoolExecutor(max_workers=processes) as executor:
+                futures = [executor.submit(_run_chunk, task, range(i, min(i + chunk, n)),
+                                           params[i:i + chunk], specs)
+                           for i in range(0, n, chunk)]
+                for future in futures:
+                    future.result()  # ワーカーの例外はここで再送出される
+
+        return {name: array.copy() for name, array in arrays.items()}
+    finally:
+        arrays.clear()
+        for shm in shms:
+            shm.close()
+            shm.unlink()
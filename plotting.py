@@ -0,0 +1,177 @@
+# 描画まわり．計算側(device / circuit / 各回路クラス)はこのモジュールとmatplotlibに依存しない
+# 各回路クラスの plot() から必要になったときだけ import される
+
+import matplotlib.pyplot as plt
+import numpy as np
+from device import nMOS
+
+
+# --*-- MOS単体 --*--
+
+def plot_mos_gm():
+    nmos1 = nMOS(unit=1)
+    Vdd = 5
+
+    for Vd in [0.5, 1.0, 1.5, 2.0, 2.5, 3.0, 3.5, 4.0, 4.5, 5.0]:
+        Vg_arr = np.linspace(0, Vdd, 100)
+        Id_arr, _ = nmos1.Id_batch(Vg_arr, Vd, 0)
+
+        plt.plot(Vg_arr, np.gradient(Id_arr, Vdd/100), label='Vds={0}'.format(Vd))
+
+    plt.xlabel(r'$V_{gs}$', fontsize=18)
+    plt.ylabel(r'$g_m$', fontsize=18)
+    plt.legend()
+    plt.show()
+
+
+def plot_mos_3d():
+    # 3Dplot
+    nmos1 = nMOS(unit=1)
+    vg = np.linspace(0, 3.0, 100)
+    vd = np.linspace(0, 3.0, 100)
+    Vg, Vd = np.meshgrid(vg, vd)
+    Id_2darr, _ = nmos1.Id_batch(Vg, Vd, 0)
+    fig = plt.figure()
+    ax = fig.add_subplot(projection='3d')
+
+    ax.plot_wireframe(Vg, Vd, Id_2darr)
+    ax.set_xlabel(r'$V_{gs}$', fontsize=18)
+    ax.set_ylabel(r'$V_{ds}$', fontsize=18)
+    ax.set_zlabel(r'$I_d$', fontsize=18)
+    plt.show()
+
+
+def plot_mos_operate_point():
+    nmos1 = nMOS(unit=1)
+    Vdd = 5
+
+    for Vg in [0.5, 1.0, 1.5, 2.0, 2.5, 3.0, 3.5, 4.0, 4.5, 5.0]:
+        Vd_arr = np.linspace(0, Vdd, 100)
+        Id_arr, _ = nmos1.Id_batch(Vg, Vd_arr, 0)
+
+        plt.plot(Vd_arr, Id_arr, label='Vgs={0}'.format(Vg))
+
+    for R in [1, 3, 6, 9, 12, 15]:
+        operate_arr = [(Vdd - Vds) / R for Vds in Vd_arr]
+        plt.plot(Vd_arr, operate_arr, label='operate R={0}'.format(R))
+
+    plt.xlabel(r'$V_{ds}$', fontsize=18)
+    plt.ylabel(r'$I_d$', fontsize=18)
+    plt.legend()
+    plt.show()
+
+
+# --*-- 回路 --*--
+
+def inverter_curves(Vin_arr, Vout_arr, Ileak_arr, label):
+    plt.plot(Vin_arr, Vout_arr, label='Vout: {0}'.format(label))
+    plt.plot(Vin_arr, Ileak_arr, label='Ileak: {0}'.format(label))
+
+
+def inverter_show():
+    plt.xlabel(r'$V_{in}$', fontsize=18)
+    plt.ylabel(r'$V_{out}\ /\ I_{leak}$', fontsize=18)
+    plt.legend()
+    plt.show()
+
+
+def inverter_sensitivity(Vin_arr, dVout_arr, label):
+    plt.plot(Vin_arr, dVout_arr, label=label)
+    plt.xlabel(r'$V_{in}$', fontsize=18)
+    plt.ylabel(r'$\partial V_{out} / \partial p$', fontsize=18)
+    plt.legend()
+    plt.show()
+
+
+def cs_time_Vout(cs):
+    plt.plot(cs.time, cs.Vin_time_arr, label='Vin')
+    plt.plot(cs.time, cs.Vout_shifted, label='Vout')
+    plt.plot(cs.time, cs.genuin_Vout + cs.diff, label='genuin amplifier')
+    plt.xlabel(r'$t$', fontsize=18)
+    plt.ylabel(r'$V_{in}\ /\ V_{out}$', fontsize=18)
+    plt.legend()
+    plt.show()
+
+
+def cs_Vin_Vout(cs):
+    Vout_gradient = cs.Vout_gradient
+    plt.figure(figsize=(3, 2))
+    ax1 = plt.subplot(2, 1, 1)
+    ax2 = plt.subplot(2, 1, 2)
+    ax1.plot(cs.Vin_arr, cs.Vout_arr, label='Vout')
+    ax2.plot(cs.Vin_arr, Vout_gradient)  # 勾配
+    ax1.plot([cs.Vin_DC, cs.Vin_DC], [0, 5], '-')
+    ax2.plot([cs.Vin_DC, cs.Vin_DC], [min(Vout_gradient), 3], '-')
+    ax2.plot([cs.Vin_DC-0.01, cs.Vin_DC-0.01], [min(Vout_gradient), 3], 'k-')
+    ax2.plot([cs.Vin_DC+0.01, cs.Vin_DC+0.01], [min(Vout_gradient), 3], 'k-')
+    ax2.set_xlabel(r'$V_{in}$', fontsize=18)
+    ax1.set_ylabel(r'$V_{out}$', fontsize=18)
+    ax2.set_ylabel(r'$A_v$', fontsize=18)
+    ax1.set_xlim(0.6, 1.0)
+    ax2.set_xlim(0.6, 1.0)
+    ax2.set_ylim(min(Vout_gradient)-2, 5)
+    ax1.legend()
+    plt.show()
+
+
+def cs_Vin_Rd_gmRd(cs):
+    fig = plt.figure()
+    ax = fig.add_subplot(projection='3d')
+    ax.plot_wireframe(cs.Vg, cs.Rd, cs.gmRd_arr)
+    ax.set_xlabel(r'$V_{gs}$', fontsize=18)
+    ax.set_ylabel(r'$R_{d}$', fontsize=18)
+    ax.set_zlabel(r'$g_mRd$', fontsize=18)
+    plt.show()
+
+
+def current_mirror(cm):
+    plt.plot(cm.R2_arr, cm.V1_arr, label=r'$V_1$')
+    plt.plot(cm.R2_arr, cm.V2_arr, label=r'$V_2$')
+    plt.xlabel(r'$R_2\ $(R1 = {0})'.format(cm.R1.R), fontsize=18)
+    plt.ylabel(r'$Voltage$', fontsize=18)
+    plt.legend()
+    plt.show()
+    plt.plot(cm.R2_arr, cm.I1_arr, label=r'$I_1$')
+    plt.plot(cm.R2_arr, cm.I2_arr, label=r'$I_2$')
+    plt.xlabel(r'$R_2\ $(R1 = {0})'.format(cm.R1.R), fontsize=18)
+    plt.ylabel(r'$Current$', fontsize=18)
+    plt.legend()
+    plt.show()
+
+
+def diff_amp(da):
+    result = da.result
+    plt.plot(da.time_arr, np.array(result['V1']) - np.array(result['V2']), label=r'$V_1-V_2$')
+    A = np.sqrt(2 * result['I3'][0]) * da.R1.R
+    plt.plot(da.time_arr, (np.array(da.Vin1_time_arr) - np.array(da.Vin2_time_arr)) * A,
+             label=r'$V_{in1}$')
+    plt.xlabel(r'$time$', fontsize=18)
+    plt.ylabel(r'$Voltage$', fontsize=18)
+    plt.legend()
+    plt.show()
+
+    # plt.plot(da.time_arr, result['V3'], label=r'$V_3$')
+    plt.plot(da.time_arr, result['I3'], label=r'$I_3$')
+    plt.xlabel(r'$time$', fontsize=18)
+    plt.ylabel(r'$Voltage\ /\ Current$', fontsize=18)
+    plt.legend()
+    plt.show()
+
+
+def monte_carlo(values, label, bins=50):
+    # モンテカルロの標本のヒストグラム．平均と ±3σ を縦線で示す
+    values = np.asarray(values, dtype=float)
+    values = values[np.isfinite(values)]
+    mean, std = np.mean(values), np.std(values, ddof=1)
+    plt.hist(values, bins=bins)
+    for x, style in ((mean, 'k-'), (mean - 3 * std, 'k--'), (mean + 3 * std, 'k--')):
+        plt.axvline(x, color=style[0], linestyle=style[1:])
+    plt.xlabel(label, fontsize=18)
+    plt.ylabel(r'$count$', fontsize=18)
+    plt.title(r'$\mu$ = {0:.4g}, $\sigma$ = {1:.4g} (N = {2})'.format(mean, std, values.size))
+    plt.show()
+
+
+if __name__ == '__main__':
+    # plot_mos_gm()
+    pass
@@ -0,0 +1,88 @@
+from circuit import Circuit, CompiledCircuit, _stack
+from device import LINEAR
+from scipy import sparse
+from scipy.sparse.linalg import splu
+import numpy as np
+
+
+class Sensitivity(object):
+    # 直流動作点での感度解析．出力にするFreeWireの電圧の、全素子パラメータ
+    # (MOSの W, L, mu, Cox, Vth, lmd と 抵抗の R)による微分 dV/dp を求める
+    # KCL f(v, p) = 0 の解では dv/dp = -J^-1 ∂f/∂p なので、出力 v_o ごとに随伴方程式 J^T λ = e_o を
+    # 1回解けば dv_o/dp = -λ^T ∂f/∂p が全パラメータについてまとめて出る(パラメータごとに解き直さない)
+    # 端子電圧やパラメータが配列(掃引)なら、動作点ごとに同じ計算をバッチで行う
+    # outputs は出力にするFreeWireのリスト(省略時は全FreeWire)
+    params = CompiledCircuit.params + ('R',)
+
+    def __init__(self, wires, outputs=None, solve=True, sparse=None):
+        self.circuit = Circuit(wires, sparse=sparse)
+        self.compiled = self.circuit.compiled
+        self.outputs = list(self.circuit.wires if outputs is None else outputs)
+        if any(wire not in self.circuit.wires for wire in self.outputs):
+            raise ValueError('Sensitivity: outputs must be FreeWires of the circuit')
+        if solve:
+            self.circuit.solve()  # 動作点
+
+    def adjoint(self, values):
+        # 随伴方程式 J^T λ = e_o を解き、λ (..., 出力数, FreeWire数 + 固定端子数) を返す
+        # 固定端子の列は 0 (固定端子の電圧はパラメータで動かない)
+        # ヤコビアンには Newton法と同じ gmin を入れる
+        c = self.compiled
+        index = [self.circuit.wires.index(wire) for wire in self.outputs]
+        lead = values.shape[:-1]
+        adjoint = np.zeros(lead + (len(index), c.n + c.m))
+        E = np.eye(c.n)[:, index]
+        if not c.sparse:
+            J = c.jacobian(values)
+            J[..., np.arange(c.n), np.arange(c.n)] -= 1e-12
+            adjoint[..., :c.n] = np.swapaxes(np.linalg.solve(np.swapaxes(J, -1, -2), E), -1, -2)
+            return adjoint
+
+        free = values[..., c._free]
+        gmin = np.full(c.n, -1e-12)
+        for k in np.ndindex(*lead):
+            data = np.bincount(c._csc_map, weights=np.concatenate([free[k], gmin]),
+                               minlength=c._nnz)
+            J = sparse.csc_matrix((data, c._csc_indices, c._csc_indptr), shape=(c.n, c.n))
+            # 並べ替え済みの行列なので、右辺と解も同じ順に並べ替える
+            lu = splu(J, permc_spec='NATURAL')
+            adjoint[k + (slice(None), c._perm)] = lu.solve(E[c._perm], trans='T').T
+        return adjoint
+
+    def run(self):
+        # 現在の各FreeWireの電圧(動作点)での感度を求める
+        # 結果は self.dV = {パラメータ名: (..., 出力数, 素子数)}．素子の並びは
+        # MOSのパラメータが compiled.mos、R が compiled.resistors の順
+        c = self.compiled
+        c.update()
+        v = _stack([wire.voltage for wire in self.circuit.wires])
+        _, values = c.evaluate(v)
+        adjoint = self.adjoint(values)
+
+        # ∂Id/∂p．Id は beta = W/L*mu*Cox に比例し、Vov = Vgs - Vth を通して Vth に依存する
+        # lmd は linear 領域の 1/2*beta*Vov^2*Vds の項だけ
+        x = c.extend(v)
+        Vgs = np.abs(x[..., c.g] - x[..., c.s])
+        Vds = np.abs(x[..., c.d] - x[..., c.s])
+        Id = c.Id
+        dId = {'W': Id / c.W, 'L': -Id / c.L, 'mu': Id / c.mu, 'Cox': Id / c.Cox,
+               'Vth': -c.gm,
+               'lmd': np.where(c.region == LINEAR, 0.5 * c.beta * (Vgs - c.Vth)**2 * Vds, 0.0)}
+
+        # Drainへの流入は -p*Id、Sourceへの流入は +p*Id なので
+        # dv_o/dp = -(λ_D * (-p) + λ_S * p) ∂Id/∂p = p (λ_D - λ_S) ∂Id/∂p
+        mos = c.polarity * (adjoint[..., c.d] - adjoint[..., c.s])
+        self.dV = {name: mos * dId[name][..., None, :] for name in c.params}
+
+        # 抵抗は Hi からの流出が Ir = (Vh - Vl)/R、∂Ir/∂R = -Ir/R
+        # dv_o/dR = -(λ_Hi * (Ir/R) + λ_Lo * (-Ir/R)) = -(λ_Hi - λ_Lo) Ir/R
+        self.dV['R'] = -(adjoint[..., c.hi] - adjoint[..., c.lo]) * (c.Ir / c.R)[..., None, :]
+        return self
+
+    def derivative(self, wire, device, name):
+        # wire の電圧の、device のパラメータ name による微分
+        devices = self.compiled.resistors if name == 'R' else self.compiled.mos
+        matches = [k for k, d in enumerate(devices) if d is device]
+        if name not in self.params or not matches:
+            raise ValueError('Sensitivity: unknown parameter {0} of {1}'.format(name, device))
+        return self.dV[name][..., self.outputs.index(wire), matches[0]]
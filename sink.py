@@ -0,0 +1,194 @@
+# 解析結果の書き込み先(シンク)．掃引点 / 時刻ごとの値をPythonのリストに溜めず、
+# chunk 行の固定長バッファにまとめてから書き出す
+#
+#   sink = NpySink('out', chunk=4096).open({'t': (), 'V': (3,)})
+#   sink.append(t=0.0, V=v)             # 1行
+#   sink.write(t=times, V=voltages)     # 複数行まとめて
+#   sink.close()
+#   sink['V']                           # 全行
+#   NpySink('out')['V']                 # 後から読む(memmapなので全部は読み込まない)
+#
+# ArraySink はメモリ上(解析の既定)、NpySink は列ごとの .npy(memmapで読める)、
+# NpzSink は chunk 行ごとの圧縮 .npz(シャード)
+
+import glob
+import os
+import struct
+import numpy as np
+from abc import ABCMeta, abstractmethod
+
+
+class Sink(metaclass=ABCMeta):
+    def __init__(self, chunk=1024, dtype=float):
+        self.chunk = chunk  # バッファの行数．たまったら書き出す
+        self.dtype = np.dtype(dtype)
+        self.rows = 0  # 書き出し済みの行数
+
+    def open(self, columns, rows=None):
+        # columns = {列名: 1行分の形}．rows は行数が分かっていれば(事前確保に使う)
+        self.columns = {name: tuple(shape) for name, shape in columns.items()}
+        self.rows = 0
+        self._filled = 0
+        # 行数より大きいバッファは要らない
+        self._size = self.chunk if rows is None else max(min(self.chunk, rows), 1)
+        self._buffer = {name: np.empty((self._size,) + shape, dtype=self.dtype)
+                        for name, shape in self.columns.items()}
+        self._open(rows)
+        return self
+
+    def append(self, **row):
+        i = self._filled
+        for name, value in row.items():
+            self._buffer[name][i] = value
+        self._filled = i + 1
+        if self._filled == self._size:
+            self.flush()
+
+    def write(self, **block):
+        # 複数行まとめて．スカラーなど行数の足りない列はブロードキャストする
+        arrays = {name: np.asarray(value, dtype=self.dtype) for name, value in block.items()}
+        count = max([array.shape[0] for name, array in arrays.items()
+                     if array.ndim > len(self.columns[name])] or [1])
+        arrays = {name: np.broadcast_to(array, (count,) + self.columns[name])
+                  for name, array in arrays.items()}
+        start = 0
+        while start < count:
+            take = min(self._size - self._filled, count - start)
+            for name, array in arrays.items():
+                self._buffer[name][self._filled:self._filled + take] = array[start:start + take]
+            self._filled += take
+            start += take
+            if self._filled == self._size:
+                self.flush()
+
+    def flush(self):
+        if self._filled:
+            self._write({name: buffer[:self._filled] for name, buffer in self._buffer.items()})
+            self.rows += self._filled
+            self._filled = 0
+
+    def close(self):
+        self.flush()
+        self._close()
+        self._buffer = {}
+        return self
+
+    def _open(self, rows):
+        pass
+
+    @abstractmethod
+    def _write(self, block):
+        # バッファにたまった block = {列名: (行数,) + 形} を書き出す
+        pass
+
+    def _close(self):
+        pass
+
+
+class ArraySink(Sink):
+    # メモリ上の配列．rows を渡せばその長さで確保し、足りなくなったら倍に伸ばす
+    def _open(self, rows):
+        capacity = self.chunk if rows is None else max(rows, 1)
+        self._arrays = {name: np.empty((capacity,) + shape, dtype=self.dtype)
+                        for name, shape in self.columns.items()}
+
+    def _write(self, block):
+        count = len(next(iter(block.values())))
+        for name, values in block.items():
+            array = self._arrays[name]
+            if self.rows + count > len(array):
+                grown = np.empty((max(2 * len(array), self.rows + count),) + array.shape[1:],
+                                 dtype=self.dtype)
+                grown[:self.rows] = array[:self.rows]
+                self._arrays[name] = array = grown
+            array[self.rows:self.rows + count] = values
+
+    def __getitem__(self, name):
+        return self._arrays[name][:self.rows]
+
+    def keys(self):
+        return self._arrays.keys()
+
+
+class NpySink(Sink):
+    # directory/列名.npy に追記していき、close でヘッダの行数を書き直す
+    # 読むときは NpySink(directory)[列名] で読み取り専用のmemmapを返す
+    header_size = 128  # ヘッダの長さは固定(行数が増えても書き直せるように)
+
+    def __init__(self, directory, chunk=1024, dtype=float):
+        super().__init__(chunk, dtype)
+        self.directory = directory
+
+    def path(self, name):
+        return os.path.join(self.directory, name + '.npy')
+
+    def _header(self, shape):
+        # .npy(version 1.0)のヘッダ．空白で header_size にそろえる
+        header = "{{'descr': {0!r}, 'fortran_order': False, 'shape': {1!r}, }}".format(
+            np.lib.format.dtype_to_descr(self.dtype), shape)
+        header = header.ljust(self.header_size - 11) + '\n'
+        return b'\x93NUMPY\x01\x00' + struct.pack('<H', len(header)) + header.encode('latin1')
+
+    def _open(self, rows):
+        os.makedirs(self.directory, exist_ok=True)
+        self._files = {}
+        for name, shape in self.columns.items():
+            f = open(self.path(name), 'wb')
+            f.write(self._header((0,) + shape))
+            self._files[name] = f
+
+    def _write(self, block):
+        for name, values in block.items():
+            self._files[name].write(np.ascontiguousarray(values).tobytes())
+
+    def _close(self):
+        for name, f in self._files.items():
+            f.seek(0)
+            f.write(self._header((self.rows,) + self.columns[name]))
+            f.close()
+        self._files = {}
+
+    def __getitem__(self, name):
+        return np.load(self.path(name), mmap_mode='r')
+
+    def keys(self):
+        return [os.path.basename(path)[:-4]
+                for path in sorted(glob.glob(os.path.join(self.directory, '*.npy')))]
+
+
+class NpzSink(Sink):
+    # chunk 行ごとに directory/shard-000000.npz(圧縮)を1つ書く
+    # 読むときは NpzSink(directory)[列名] で全シャードをつなげる．
+    # 大きいときは chunks(列名) でシャードごとに読む
+    def __init__(self, directory, chunk=65536, dtype=float):
+        super().__init__(chunk, dtype)
+        self.directory = directory
+
+    def shards(self):
+        return sorted(glob.glob(os.path.join(self.directory, 'shard-*.npz')))
+
+    def _open(self, rows):
+        os.makedirs(self.directory, exist_ok=True)
+        for path in self.shards():
+            os.remove(path)  # 前回の書き込みの残り
+        self._count = 0
+
+    def _write(self, block):
+        np.savez_compressed(os.path.join(self.directory, 'shard-{0:06d}.npz'.format(self._count)),
+                            **block)
+        self._count += 1
+
+    def chunks(self, name):
+        for path in self.shards():
+            with np.load(path) as shard:
+                yield shard[name]
+
+    def __getitem__(self, name):
+        return np.concatenate(list(self.chunks(name)))
+
+    def keys(self):
+        shards = self.shards()
+        if not shards:
+            return []
+        with np.load(shards[0]) as shard:
+            return list(shard.keys())
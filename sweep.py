@@ -0,0 +1,76 @@
+import numpy as np
+
+
+class Continuation(object):
+    # 掃引の直前2点の解から、次の掃引点の解を線形外挿で予測する(predictor)
+    # 予測値を FreeWire.optimisation(guess=...) や Circuit.solve に渡して使う(corrector)
+    # 値はスカラーでもノード電圧の配列でもよい
+    def __init__(self, min_width=1e-6):
+        self.params = []  # 直前2点の掃引パラメータ
+        self.values = []  # 直前2点の解
+        self.min_width = min_width  # 探索区間の半幅の下限
+
+    def predict(self, param):
+        # 解が1点も無ければNone，1点だけならその値を返す
+        if not self.values:
+            return None
+        if len(self.values) == 1 or self.params[0] == self.params[1]:
+            return self.values[-1]
+        (p0, p1), (v0, v1) = self.params, self.values
+        return v1 + (v1 - v0) * (param - p1) / (p1 - p0)
+
+    def width(self):
+        # 予測の探索区間の半幅．直前の1ステップ分の変化量を目安にする
+        if len(self.values) < 2:
+            return np.inf
+        return max(np.max(np.abs(np.subtract(self.values[1], self.values[0]))),
+                   self.min_width)
+
+    def update(self, param, value):
+        self.params = self.params[-1:] + [param]
+        self.values = self.values[-1:] + [value]
+
+    def reset(self):
+        self.params, self.values = [], []
+
+
+def adaptive_sweep(solve, start, stop, tol=1e-3, points=33, max_points=10000, key=None,
+                   max_step=np.inf, min_width=None):
+    # 曲がっている所に掃引点を集める適応掃引
+    # solve(x) は掃引点の配列 x に対する結果 {名前: 配列}(か配列1つ)を返す関数．バッチでまとめて解く
+    # 初めに points 点の等間隔で解き、区間の中点での値が両端の線形補間から tol/2 以上ずれる(曲がっている)か、
+    # 両端の値の差が max_step を超える(利得が大きい)区間だけを2分割していく
+    # 判定が tol/2 なのは、区間の中に折れ曲がり(MOSの閾値など)があると、中点を入れた後の半区間の
+    # 補間誤差が中点のずれの最大2倍になるため．これで線形補間の誤差が tol 以内に収まる
+    # 判定に使う列は key(省略時は最初の列)．(x, 結果) を x の昇順で返す
+    def evaluate(x):
+        result = solve(x)
+        if not isinstance(result, dict):
+            result = {'y': result}
+        return {name: np.broadcast_to(value, x.shape + np.shape(value)[x.ndim:]).copy()
+                for name, value in result.items()}
+
+    min_width = (stop - start) * 2.0 ** -20 if min_width is None else min_width
+    x = np.linspace(start, stop, points)
+    results = evaluate(x)
+    key = next(iter(results)) if key is None else key
+    active = np.ones(points - 1, dtype=bool)  # まだ分割を調べる区間
+
+    while np.any(active) and len(x) + np.count_nonzero(active) <= max_points:
+        y = results[key]
+        lo = np.nonzero(active)[0]
+        middle = 0.5 * (x[lo] + x[lo + 1])
+        new = evaluate(middle)
+        bend = np.abs(new[key] - 0.5 * (y[lo] + y[lo + 1])) > 0.5 * tol
+
+        # 中点を挿入する．曲がっていた区間の両半分は続けて調べ、それ以外は確定
+        x = np.insert(x, lo + 1, middle)
+        for name in results:
+            results[name] = np.insert(results[name], lo + 1, new[name], axis=0)
+        parent = np.zeros(len(active), dtype=bool)
+        parent[lo] = bend
+        active = np.repeat(parent, np.where(active, 2, 1))
+        active |= np.abs(np.diff(results[key])) > max_step
+        active &= np.diff(x) > min_width
+
+    return x, results
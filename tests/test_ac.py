@@ -0,0 +1,36 @@
+from common_source import CSTimeVout, CSVinVout
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def quiet(capsys):
+    yield
+    capsys.readouterr()
+
+
+def test_dc_gain_matches_slope_of_transfer_curve(quiet):
+    cs = CSVinVout(points=50)
+    Vin, h = 0.74, 1e-6
+    cs.nmos1.Vg = np.array([Vin - h, Vin + h])
+    cs.wire1.optimisation_batch()
+    slope = np.diff(cs.wire1.voltage)[0] / (2 * h)
+    H = cs.small_signal_gain(0.0, Vin)
+    assert H.shape == (1,)
+    assert H[0].real == pytest.approx(slope, rel=1e-6)
+
+
+def test_small_signal_gain_keeps_the_sweep_state(quiet):
+    cs = CSTimeVout(points=50)
+    Vg, voltage = cs.nmos1.Vg, cs.wire1.voltage
+    cs.small_signal_gain(1 / (2 * np.pi))
+    assert cs.nmos1.Vg is Vg
+    assert cs.wire1.voltage is voltage
+    assert cs.nmos1.Vd is voltage
+
+
+def test_ac_gain_is_opt_in(capsys):
+    CSTimeVout(points=50)
+    assert 'Av(AC)' not in capsys.readouterr().out
+    CSTimeVout(points=50, ac=True)
+    assert 'Av(AC)' in capsys.readouterr().out
@@ -0,0 +1,49 @@
+from common_source import CSVinVout
+from inverter import Inverter
+from sweep import adaptive_sweep
+import numpy as np
+import pytest
+
+
+def interpolation_error(x, y, solve, points=100001):
+    # 適応掃引の点を線形補間した値と、細かい等間隔の掃引で解き直した値との差の最大
+    dense = np.linspace(x[0], x[-1], points)
+    return np.max(np.abs(np.interp(dense, x, y) - solve(dense)))
+
+
+@pytest.mark.parametrize('tol', [1e-2, 1e-3, 1e-4])
+def test_inverter_error_within_tol(capsys, tol):
+    inv = Inverter('pMOS', 'L', 1, adaptive=True, tol=tol)
+    capsys.readouterr()
+    assert np.all(np.diff(inv.Vin_arr) > 0)
+    assert interpolation_error(inv.Vin_arr, inv.Vout_arr,
+                               lambda x: inv.solve_batch(x)['Vout']) <= tol
+
+
+@pytest.mark.parametrize('tol', [1e-2, 1e-3, 1e-4])
+def test_common_source_error_within_tol(capsys, tol):
+    # Vin = Vth で Vout が折れ曲がる(閾値の下は電流 0)
+    cs = CSVinVout(adaptive=True, tol=tol)
+    assert interpolation_error(cs.Vin_arr, cs.Vout_arr,
+                               lambda x: cs.solve_points(x)['Vout']) <= tol
+    capsys.readouterr()
+
+
+def test_kink_near_the_end_of_an_interval():
+    # 初めの区間 [0, 1/32] の端の近くに折れ曲がりがあると、中点のずれは最大誤差の半分ほどしかない
+    # 中点のずれが 0.9 * tol、中点を入れた後の半区間の誤差が 1.8 * tol 近くになる傾き
+    tol = 1e-3
+
+    def solve(x):
+        return 1.8 * tol / 0.00025 * np.maximum(x - 0.031, 0.0)
+    x, result = adaptive_sweep(solve, 0.0, 1.0, tol)
+    assert interpolation_error(x, result['y'], solve) <= tol
+
+
+def test_points_are_concentrated_where_the_curve_bends():
+    # 直線の部分は最初の等間隔の区間に中点を1回入れるだけで、それ以上は分割しない
+    def solve(x):
+        return np.where(x < 0.5, 0.0, np.sin(20 * (x - 0.5)))
+    x, _ = adaptive_sweep(solve, 0.0, 1.0, 1e-4, points=33)
+    assert np.count_nonzero(x < 0.5) == 32
+    assert np.count_nonzero(x > 0.5) > 100
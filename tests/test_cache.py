@@ -0,0 +1,37 @@
+from device import nMOS
+import pytest
+
+
+def bias(mos, Vd=1.0):
+    mos.Vg, mos.Vd, mos.Vs = 2.0, Vd, 0.0
+    return mos.Id
+
+
+def test_cache_hits_repeat_bias_points():
+    mos = nMOS()
+    mos.enable_cache(4)
+    first = bias(mos)
+    assert bias(mos) == first
+    assert mos.cache_info() == {'hits': 1, 'misses': 1, 'maxsize': 4, 'currsize': 1}
+
+
+@pytest.mark.parametrize('name, value', [('W', 2.0), ('Vth', 0.5), ('tabulate', True)])
+def test_cache_is_invalidated_when_parameters_change(name, value):
+    mos, reference = nMOS(), nMOS()
+    mos.enable_cache(4)
+    bias(mos)
+    setattr(mos, name, value)
+    setattr(reference, name, value)
+    assert bias(mos) == bias(reference)
+    assert mos.hits == 0  # 前のパラメータでの結果は使わない
+    assert mos.gm == reference.gm and mos.region == reference.region
+
+
+def test_cache_is_bounded():
+    mos = nMOS()
+    mos.enable_cache(2)
+    for Vd in (0.5, 1.0, 1.5):
+        bias(mos, Vd)
+    assert mos.cache_info()['currsize'] == 2
+    bias(mos, 0.5)  # 一番古い点は追い出されている
+    assert mos.hits == 0
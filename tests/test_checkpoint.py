@@ -0,0 +1,80 @@
+from checkpoint import tiled_sweep, tiles
+from common_source import CSVinRdgmRd
+from grid import GridSweep
+import numpy as np
+import pytest
+
+
+class Interrupt(Exception):
+    pass
+
+
+def test_tiles_cover_the_grid():
+    covered = np.zeros((5, 7), dtype=int)
+    for slices in tiles((5, 7), (2, 3)):
+        covered[slices] += 1
+    assert np.all(covered == 1)
+
+
+def test_tiled_sweep_resumes_where_it_stopped(tmp_path):
+    path = str(tmp_path / 'sweep.npz')
+    calls = []
+
+    def task(slices, stop=None):
+        calls.append(slices)
+        if stop is not None and len(calls) > stop:
+            raise Interrupt
+        i, j = np.mgrid[slices]
+        return {'a': np.sin(i * 0.3 + j), 'b': np.stack([i, j], axis=-1)}
+
+    columns = {'a': (), 'b': (2,)}
+    expected = tiled_sweep(task, (6, 5), columns, tile=(2, 5))
+    calls.clear()
+    with pytest.raises(Interrupt):
+        tiled_sweep(lambda s: task(s, stop=1), (6, 5), columns, tile=(2, 5), checkpoint=path)
+    calls.clear()
+    resumed = tiled_sweep(task, (6, 5), columns, tile=(2, 5), checkpoint=path)
+    assert len(calls) == 2  # 保存済みの1タイルは解き直さない
+    for name in columns:
+        assert np.array_equal(resumed[name], expected[name])
+
+
+def test_grid_resume_is_bit_identical(tmp_path, monkeypatch, capsys):
+    path = str(tmp_path / 'grid.npz')
+    expected = CSVinRdgmRd(points=12, tile=3)
+    solve, count = GridSweep._solve, []
+
+    def interrupted(self, slices):
+        count.append(slices)
+        if len(count) > 2:
+            raise Interrupt
+        return solve(self, slices)
+
+    monkeypatch.setattr(GridSweep, '_solve', interrupted)
+    with pytest.raises(Interrupt):
+        CSVinRdgmRd(points=12, checkpoint=path, tile=3)
+    count.clear()
+    monkeypatch.setattr(GridSweep, '_solve', lambda self, slices: count.append(slices) or
+                        solve(self, slices))
+    resumed = CSVinRdgmRd(points=12, checkpoint=path, tile=3)
+    capsys.readouterr()
+    assert len(count) == 2  # 12行を3行ずつ、保存済みの2タイルは飛ばす
+
+    for name in ('Vout_grid', 'gmRd_arr', 'gain_arr'):
+        assert np.array_equal(getattr(resumed, name), getattr(expected, name), equal_nan=True)
+
+
+@pytest.mark.parametrize('change', [lambda cs: setattr(cs.nmos1, 'W', 2.0),
+                                    lambda cs: setattr(cs.nmos1, 'Vth', 0.6),
+                                    lambda cs: setattr(cs.R1, 'Vh', 4.0)])
+def test_grid_checkpoint_rejects_other_circuit_settings(tmp_path, capsys, change):
+    path = str(tmp_path / 'grid.npz')
+    cs = CSVinRdgmRd(points=6, checkpoint=path, tile=3)
+    grid = GridSweep([cs.wire1], cs.grid.x, cs.grid.y, source=(cs.nmos1, 'Vg'),
+                     checkpoint=path, tile=3)
+    grid.run()  # 同じ設定なら保存済みの結果を使う
+    change(cs)
+    with pytest.raises(ValueError):
+        GridSweep([cs.wire1], cs.grid.x, cs.grid.y, source=(cs.nmos1, 'Vg'),
+                  checkpoint=path, tile=3).run()
+    capsys.readouterr()
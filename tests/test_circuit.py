@@ -0,0 +1,84 @@
+from circuit import Circuit, dependencies, schedule
+from current_mirror import CurrentMirror
+from diff_amp import DiffAmp
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def diff_amp(capsys):
+    da = DiffAmp(points=3)
+    capsys.readouterr()
+    return da
+
+
+def solve_points(da, Vg_arr):
+    # 1点ずつスカラーで解いた各FreeWireの電圧 (点数, FreeWire数)
+    circuit = Circuit(da.wires)
+    voltages = []
+    for Vg in Vg_arr:
+        da.nmos1.Vg = Vg
+        circuit.solve()
+        voltages.append([wire.voltage for wire in da.wires])
+    return np.array(voltages)
+
+
+@pytest.mark.parametrize('points', [3, 5])  # 3 点はFreeWire数と同じ(行と列を取り違えると分からない)
+def test_batch_solve_matches_scalar_solves(diff_amp, points):
+    Vg_arr = np.linspace(1.9, 2.1, points)
+    expected = solve_points(diff_amp, Vg_arr)
+
+    diff_amp.nmos1.Vg = Vg_arr
+    circuit = Circuit(diff_amp.wires)
+    circuit.solve()
+    voltages = np.stack([wire.voltage for wire in diff_amp.wires], axis=-1)
+    np.testing.assert_allclose(voltages, expected, atol=1e-10)
+
+    # 端子にもFreeWireごとの列が書き込まれ、電流と領域も点ごとの配列になる
+    np.testing.assert_allclose(diff_amp.nmos1.Vs, expected[:, 2], atol=1e-10)
+    np.testing.assert_allclose(diff_amp.R1.Vl, expected[:, 0], atol=1e-10)
+    assert np.shape(diff_amp.wire3.current) == (points,)
+    assert np.shape(diff_amp.nmos1.region) == (points,)
+
+
+def test_set_voltages_writes_wire_columns(diff_amp):
+    circuit = Circuit(diff_amp.wires)
+    v = np.arange(9, dtype=float).reshape(3, 3)
+    circuit.set_voltages(v)
+    np.testing.assert_array_equal(diff_amp.R1.Vl, v[:, 0])
+    np.testing.assert_array_equal(diff_amp.R2.Vl, v[:, 1])
+    np.testing.assert_array_equal(diff_amp.nmos3.Vd, v[:, 2])
+
+
+@pytest.fixture
+def current_mirror(capsys):
+    cm = CurrentMirror(points=3)
+    capsys.readouterr()
+    return cm
+
+
+def test_diff_amp_is_one_block(diff_amp):
+    # wire1 / wire2 は nmos1 / nmos2 のソース(wire3)に依存し、wire3 は両方のドレインに依存する
+    graph = dependencies(diff_amp.wires).toarray() != 0
+    np.testing.assert_array_equal(graph, [[True, False, True],
+                                          [False, True, True],
+                                          [True, True, True]])
+    assert schedule(diff_amp.wires) == [[0, 1, 2]]
+    assert Circuit(diff_amp.wires).blocks == [[0, 1, 2]]
+
+
+def test_current_mirror_input_side_comes_first(current_mirror):
+    # wire2 (pmos2 のドレイン)はゲートの wire1 に依存するが、wire1 は wire2 に依存しない
+    wire1, wire2 = current_mirror.wire1, current_mirror.wire2
+    np.testing.assert_array_equal(dependencies([wire1, wire2]).toarray() != 0,
+                                  [[True, False], [True, True]])
+    assert schedule([wire1, wire2]) == [[0], [1]]
+    assert schedule([wire2, wire1]) == [[1], [0]]  # 逆順に渡しても wire1 が先
+
+
+def test_independent_blocks_keep_the_order_of_wires(capsys):
+    # 依存の無いブロック同士は、先頭のFreeWireが wires の前にあるものから
+    first, second = CurrentMirror(points=3), CurrentMirror(points=3)
+    capsys.readouterr()
+    wires = [first.wire2, second.wire1, first.wire1, second.wire2]
+    assert schedule(wires) == [[1], [2], [0], [3]]
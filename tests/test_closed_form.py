@@ -0,0 +1,112 @@
+from device import nMOS, pMOS, FreeWire, Resistor
+from scipy import optimize
+import numpy as np
+import pytest
+
+Vdd = 3.0
+
+
+def inverter(rng, lmd):
+    # Drain だけが繋がったFreeWire．W, L, Vth はランダム．lmd が None ならランダムに ≠ 0
+    nmos, pmos, wire = nMOS(), pMOS(), FreeWire()
+    nmos.Vs, pmos.Vs = 0.0, Vdd
+    wire.joint('Drain', nmos)
+    wire.joint('Drain', pmos)
+    for mos in (nmos, pmos):
+        mos.W, mos.L = rng.uniform(0.5, 4), rng.uniform(0.5, 4)
+        mos.Vth = rng.uniform(0.3, 1.0)
+        mos.lmd = rng.uniform(0.01, 0.2) if lmd is None else lmd
+    return wire, nmos, pmos
+
+
+def diode_load(rng):
+    # Vdd から抵抗で電流を入れるダイオード接続の nMOS (カレントミラーの入力側，lmd = 0)
+    nmos, wire, R = nMOS(lmd=0), FreeWire(), Resistor(R=rng.uniform(0.1, 10))
+    nmos.Vs, R.Vh = 0.0, Vdd
+    nmos.W, nmos.Vth = rng.uniform(0.5, 4), rng.uniform(0.3, 1.0)
+    wire.joint('Drain', nmos)
+    wire.joint('Gate', nmos)
+    wire.joint('ResistLo', R)
+    return wire, nmos, R
+
+
+def brent(wire):
+    # 現在の端子電圧での current_law の根．端点で f = 0 か符号が変わらなければ |f| の小さい端点
+    a, b = wire.generate_constraints()
+    f_a, f_b = wire.current_law(a), wire.current_law(b)
+    if f_a * f_b >= 0:
+        return a if abs(f_a) <= abs(f_b) else b
+    return optimize.brentq(wire.current_law, a, b, xtol=1e-14)
+
+
+def gates(rng, nmos, pmos):
+    # ランダムな入力と、各MOSが cutoff に入る境界(とその両側)
+    edges = [nmos.Vth, Vdd - pmos.Vth]
+    return np.concatenate([rng.uniform(0, Vdd, 100), edges,
+                           np.add(edges, 1e-12), np.subtract(edges, 1e-12)])
+
+
+@pytest.mark.parametrize('lmd', [0.0, None])
+def test_inverter_matches_brent(lmd):
+    # lmd ≠ 0 では non-linear / linear の境界で Id が不連続．根の無い点は境界が解(brent法の収束先)
+    rng = np.random.default_rng(2)
+    for _ in range(50):
+        wire, nmos, pmos = inverter(rng, lmd)
+        Vin = gates(rng, nmos, pmos)
+        nmos.Vg = pmos.Vg = Vin
+        a, b = wire.generate_constraints_batch()
+        batch = wire.closed_form(a, b)
+        assert not np.any(np.isnan(batch))
+
+        for k, vin in enumerate(Vin):
+            nmos.Vg = pmos.Vg = vin
+            reference = brent(wire)
+            assert batch[k] == pytest.approx(reference, rel=0, abs=1e-12)
+            a, b = wire.generate_constraints()
+            scalar = wire._closed_form_scalar(a, b)
+            if scalar is None:  # 不連続な境界の点だけは brent法に任せる
+                assert lmd is None
+            else:
+                assert scalar == pytest.approx(reference, rel=0, abs=1e-12)
+
+
+@pytest.mark.parametrize('lmd', [0.0, None])
+def test_inverter_matches_iteration(lmd):
+    # 閉形式と反復(analytic=False)の解が xtol の範囲で一致
+    # 端点の |f| < 1e-6 は解とみなす規則があるので、その点は KCL を満たす閉形式とずれうる
+    rng = np.random.default_rng(3)
+    for _ in range(50):
+        wire, nmos, pmos = inverter(rng, lmd)
+        nmos.Vg = pmos.Vg = gates(rng, nmos, pmos)
+        wire.optimisation_batch()
+        analytic = wire.voltage.copy()
+        wire.analytic = False
+        wire.optimisation_batch()
+        a, b = wire.generate_constraints_batch()
+        f_a, _, _ = wire.current_law_batch(a)
+        f_b, _, _ = wire.current_law_batch(b)
+        interior = (np.abs(f_a) >= 1e-6) & (np.abs(f_b) >= 1e-6)
+        np.testing.assert_allclose(analytic[interior], wire.voltage[interior], rtol=0, atol=4e-12)
+        np.testing.assert_allclose(analytic, wire.voltage, rtol=0, atol=1e-5)
+
+
+def test_diode_load_matches_brent_and_iteration():
+    rng = np.random.default_rng(4)
+    for _ in range(50):
+        wire, nmos, R = diode_load(rng)
+        # 抵抗の上端が Vth の上下どちらでも解ける(下なら電流 0 で wire = Vh)
+        Vh = np.concatenate([rng.uniform(0, Vdd, 20), [nmos.Vth, nmos.Vth + 1e-12]])
+        R.Vh = Vh
+        a, b = wire.generate_constraints_batch()
+        batch = wire.closed_form(a, b)
+        assert not np.any(np.isnan(batch))
+        wire.analytic = False
+        wire.optimisation_batch()
+        np.testing.assert_allclose(batch, wire.voltage, rtol=0, atol=1e-5)
+
+        for k, vh in enumerate(Vh):
+            R.Vh = vh
+            reference = brent(wire)
+            assert batch[k] == pytest.approx(reference, rel=0, abs=1e-12)
+            a, b = wire.generate_constraints()
+            assert wire._closed_form_scalar(a, b) == pytest.approx(reference, rel=0, abs=1e-12)
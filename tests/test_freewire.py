@@ -0,0 +1,44 @@
+from inverter import Inverter
+from diff_amp import DiffAmp
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def inverter(capsys):
+    inv = Inverter('pMOS', 'L', 1, points=10)
+    capsys.readouterr()
+    return inv
+
+
+def randomize(rng, inv):
+    for mos in (inv.nmos1, inv.pmos1):
+        mos.lmd = rng.uniform(0, 0.2)
+        mos.W, mos.L = rng.uniform(0.5, 4), rng.uniform(0.5, 4)
+        mos.Vth = rng.uniform(0.3, 1.0)
+
+
+def test_iterative_batch_converges_with_discontinuous_Id(inverter):
+    # lmd != 0 では linear / non-linear の境界で Id が不連続．反復が区間の端で周回しないこと
+    rng = np.random.default_rng(1)
+    Vin = np.linspace(0, 3, 500)
+    for _ in range(50):
+        randomize(rng, inverter)
+        inverter.nmos1.Vg = inverter.pmos1.Vg = Vin
+        inverter.wire1.analytic = False
+        iteration = inverter.wire1.optimisation_batch()
+        assert iteration < 100
+        iterative = inverter.wire1.voltage.copy()
+        # 不連続の点では f は 0 にならず符号が変わるだけなので、境界も解く閉形式と比べる
+        # (端点の |f| < 1e-6 は解とみなす規則があるので、端の近くは 1e-5 程度ずれうる)
+        inverter.wire1.analytic = True
+        inverter.wire1.optimisation_batch()
+        np.testing.assert_allclose(iterative, inverter.wire1.voltage, rtol=0, atol=1e-5)
+
+
+def test_current_through_nmos_sources(capsys):
+    # DiffAmp の wire3 は nmos1 / nmos2 のソース．貫通電流は2つの Id の和
+    da = DiffAmp(points=3, solver='relaxation')
+    capsys.readouterr()
+    da.wire3.current_law(da.wire3.voltage)
+    assert da.wire3.current == pytest.approx(da.nmos1.Id + da.nmos2.Id, rel=1e-12)
@@ -0,0 +1,96 @@
+from circuit import Circuit
+from device import nMOS, pMOS, FreeWire, Resistor
+import numpy as np
+import pytest
+
+Vdd = 3.0
+
+
+def inverter(wire, gate):
+    # wire を出力にするCMOSインバータ．gate はFreeWireか固定の入力電圧(lmd=0)
+    nmos, pmos = nMOS(lmd=0), pMOS(lmd=0)
+    nmos.Vs, pmos.Vs = 0.0, Vdd
+    wire.joint('Drain', nmos)
+    wire.joint('Drain', pmos)
+    if isinstance(gate, FreeWire):
+        gate.joint('Gate', nmos)
+        gate.joint('Gate', pmos)
+    else:
+        nmos.Vg = pmos.Vg = gate
+    return wire
+
+
+def chain(stages, Vin):
+    # インバータの縦続接続．依存グラフでは1段ずつのブロックに分かれる
+    wires = [FreeWire(unit=k) for k in range(stages)]
+    for k, wire in enumerate(wires):
+        inverter(wire, Vin if k == 0 else wires[k - 1])
+    return wires
+
+
+def looped(stages, Vin, Rf):
+    # Vin から抵抗で入るノードにインバータ列を繋ぎ、最終段を抵抗 Rf で入力ノードへ戻す
+    # 全ノードが1つの強連結成分になる(段数が偶数なら正帰還)
+    wires = [FreeWire(unit=k) for k in range(stages + 1)]
+    source, feedback = Resistor(R=1.0), Resistor(R=Rf)
+    source.Vh = Vin
+    wires[0].joint('ResistLo', source)
+    wires[-1].joint('ResistHi', feedback)
+    wires[0].joint('ResistLo', feedback)
+    for k in range(1, stages + 1):
+        inverter(wires[k], wires[k - 1])
+    return wires
+
+
+def ring(stages):
+    # 奇数段のリング．直流の解は全ノードがインバータの閾値電圧
+    wires = [FreeWire(unit=k) for k in range(stages)]
+    for k, wire in enumerate(wires):
+        inverter(wire, wires[k - 1])
+    return wires
+
+
+def homotopy(wires):
+    circuit = Circuit(wires)
+    iteration = circuit.homotopy(np.zeros(len(wires)))
+    v = np.array([wire.voltage for wire in wires])
+    assert circuit.feasible(v)
+    return circuit, iteration, v
+
+
+@pytest.mark.parametrize('stages', [100, 500])
+@pytest.mark.parametrize('Vin', [1.0, 1.2])
+def test_mid_rail_chain_from_zero(stages, Vin):
+    circuit, iteration, v = homotopy(chain(stages, Vin))
+    assert circuit.residual_norm < 1e-9
+    assert iteration < 50
+
+    # ブロックごとに解いた解と同じ
+    reference = chain(stages, Vin)
+    Circuit(reference).solve()
+    np.testing.assert_allclose(v, [wire.voltage for wire in reference], rtol=0, atol=1e-9)
+
+
+@pytest.mark.parametrize('Vin', [1.0, 1.2])
+@pytest.mark.parametrize('Rf', [1.0, 10.0])
+def test_coupled_block_from_zero(Vin, Rf):
+    wires = looped(101, Vin, Rf)
+    assert len(Circuit(wires).blocks) == 1
+    circuit, iteration, v = homotopy(wires)
+    assert circuit.residual_norm < 1e-9
+    assert iteration < 50
+
+
+def test_odd_ring_settles_at_the_switching_voltage():
+    # nMOS / pMOS の beta の比が 4 なので 2 * (V - Vth) = Vdd - Vth - V
+    _, _, v = homotopy(ring(51))
+    np.testing.assert_allclose(v, (Vdd + 0.7) / 3, rtol=0, atol=1e-9)
+
+
+def test_latch_passes_a_fold():
+    # 偶数段の正帰還．gmin stepping の道筋が折り返すので、直前の解から始め直して抜ける
+    wires = looped(100, Vdd, 1.0)
+    circuit, _, v = homotopy(wires)
+    assert circuit.residual_norm < 1e-6
+    np.testing.assert_allclose(v[::2], Vdd, atol=1e-6)
+    np.testing.assert_allclose(v[1::2], 0.0, atol=1e-6)
@@ -0,0 +1,113 @@
+from circuit import Circuit
+from current_mirror import CurrentMirror
+from device import nMOS, Resistor, FreeWire
+import numpy as np
+import pytest
+
+
+def chain(stages=5, Vdd=5.0):
+    # 抵抗負荷のソース接地を縦続接続したもの．k段目の出力が k+1段目のゲート
+    mosz = [nMOS(unit=k) for k in range(stages)]
+    resistors = [Resistor(unit=k, R=2.0) for k in range(stages)]
+    wires = [FreeWire(unit=k) for k in range(stages)]
+    mosz[0].Vg = 1.2
+    for k, (mos, R, wire) in enumerate(zip(mosz, resistors, wires)):
+        mos.Vs = 0
+        R.Vh = Vdd
+        wire.joint('Drain', mos)
+        wire.joint('ResistLo', R)
+        if k + 1 < stages:
+            wire.joint('Gate', mosz[k + 1])
+    return mosz, resistors, wires[::-1]  # 依存の逆順に渡しても schedule が並べ直す
+
+
+def voltages(wires):
+    return np.array([wire.voltage for wire in wires])
+
+
+def test_only_blocks_downstream_of_a_change_are_resolved():
+    mosz, _, wires = chain()
+    circuit = Circuit(wires)
+    circuit.solve()
+    assert len(circuit.dirty) == len(wires)
+    circuit.solve()
+    assert circuit.dirty == []
+
+    mosz[3].W = 2.0
+    circuit.solve()
+    resolved = {circuit.wires[i].unit for k in circuit.dirty for i in circuit.blocks[k]}
+    assert resolved == {'3', '4'}
+
+
+@pytest.mark.parametrize('name, value', [('W', 2.0), ('Vth', 0.6), ('L', 1.5)])
+def test_incremental_is_bit_identical_to_full_solve(name, value):
+    results = []
+    for incremental in (True, False):
+        mosz, resistors, wires = chain()
+        circuit = Circuit(wires)
+        circuit.incremental = incremental
+        circuit.solve()
+        setattr(mosz[2], name, value)
+        resistors[4].R = 3.0
+        circuit.solve()
+        results.append(voltages(wires))
+    assert np.array_equal(results[0], results[1])
+
+
+@pytest.fixture
+def solves(monkeypatch):
+    # FreeWire.optimisation を呼んだ回数を FreeWire の unit ごとに数える
+    counts = {}
+    optimisation = FreeWire.optimisation
+
+    def counted(wire, *args, **kwargs):
+        counts[wire.unit] = counts.get(wire.unit, 0) + 1
+        return optimisation(wire, *args, **kwargs)
+    monkeypatch.setattr(FreeWire, 'optimisation', counted)
+    return counts
+
+
+def test_unchanged_blocks_are_not_solved(solves):
+    mosz, _, wires = chain()
+    circuit = Circuit(wires)
+    circuit.solve()
+    assert solves == {str(k): 1 for k in range(5)}
+
+    solves.clear()
+    circuit.solve()
+    assert solves == {}
+
+    # 3段目のパラメータを変えると、3段目とその出力をゲートに受ける4段目だけを解き直す
+    mosz[3].W = 2.0
+    circuit.solve()
+    assert solves == {'3': 1, '4': 1}
+
+
+def test_current_mirror_sweep_is_bit_identical_to_full_solve(capsys, solves):
+    # ウォームスタートの初期値は解く経路を変えるので、比べるのは差分の再計算の有無だけ
+    incremental = CurrentMirror(batch=False, warm_start=False, points=20)
+    # R2 しか掃引しないので、wire1 は最初の1点だけ解き、wire2 は毎回解く
+    assert sum(solves.values()) == 20 + 1
+    full = CurrentMirror(batch=False, points=20)
+    circuit = Circuit([full.wire1, full.wire2])
+    circuit.incremental = False
+    V1, V2 = [], []
+    for R2 in full.R2_arr:
+        full.R2.R = R2
+        circuit.solve()
+        V1.append(full.wire1.voltage)
+        V2.append(full.wire2.voltage)
+    capsys.readouterr()
+    assert np.array_equal(incremental.V1_arr, V1)
+    assert np.array_equal(incremental.V2_arr, V2)
+
+
+def test_matching_after_batch_sweep(capsys):
+    # バッチ掃引の後は wire の電圧・端子に配列(0次元も)が残っている．それでもスカラーとして解けること
+    cm = CurrentMirror()
+    ratio = cm.matching(samples=200)
+    fresh = CurrentMirror(batch=False, points=2)
+    expected = fresh.matching(samples=200)
+    capsys.readouterr()
+    assert ratio.shape == (200,)
+    assert np.array_equal(ratio, expected)
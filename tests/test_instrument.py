@@ -0,0 +1,48 @@
+from circuit import Circuit
+from current_mirror import CurrentMirror
+from diff_amp import DiffAmp
+from instrument import Recorder
+from inverter import Inverter
+import json
+import numpy as np
+
+
+def test_default_batch_sweep_is_recorded(capsys):
+    with Recorder() as recorder:
+        Inverter('pMOS', 'L', 1, points=200)
+    batch = [record for record in recorder.records if record['kind'] == 'batch']
+    assert len(batch) == 1
+    assert batch[0]['points'] == 200
+    assert batch[0]['calls'] >= 1
+    assert batch[0]['width'] > 0
+    assert batch[0]['newton_iterations'] == 0  # 全点閉形式
+
+    # 閉形式を使わなければ反復回数が記録される
+    inv = Inverter('pMOS', 'L', 1, points=200)
+    inv.wire1.analytic = False
+    with Recorder() as recorder:
+        inv.solve_batch(inv.Vin_arr)
+    assert recorder.records[-1]['newton_iterations'] > 0
+    json.loads(recorder.to_json())
+
+
+def test_monte_carlo_newton_is_recorded(capsys):
+    cm = CurrentMirror(points=10)
+    with Recorder() as recorder:
+        cm.matching(samples=100)
+    compiled = [record for record in recorder.records if record['kind'] == 'compiled']
+    assert len(compiled) == 1
+    assert compiled[0]['points'] == 100
+    assert compiled[0]['newton_iterations'] > 0
+
+
+def test_scalar_and_batched_solves_are_recorded(capsys):
+    with Recorder() as recorder:
+        da = DiffAmp(points=5)
+        da.nmos1.Vg = np.linspace(1.9, 2.1, 7)
+        Circuit(da.wires).solve()
+    newton = [record for record in recorder.records if record['kind'] == 'newton']
+    assert [record['points'] for record in newton] == [1] * 5 + [7]
+    assert not any(record['kind'] == 'compiled' for record in recorder.records)
+    json.loads(recorder.to_json())
+    capsys.readouterr()
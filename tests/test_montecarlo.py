@@ -0,0 +1,55 @@
+from circuit import Circuit
+from diff_amp import DiffAmp
+from montecarlo import MonteCarlo, normal
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def diff_amp(capsys):
+    da = DiffAmp(points=3)
+    capsys.readouterr()
+    da.nmos1.Vg = da.nmos2.Vg = 2.0
+    return da
+
+
+@pytest.fixture
+def variations(diff_amp):
+    # オフセット解析と同じ組み合わせ．標本ごとの差が見えるように大きめに振る
+    variations = {mos: {'Vth': normal(0.05), 'mu': normal(0.1, relative=True)}
+                  for mos in (diff_amp.nmos1, diff_amp.nmos2)}
+    variations.update({R: {'R': normal(0.1, relative=True)}
+                       for R in (diff_amp.R1, diff_amp.R2)})
+    return variations
+
+
+def test_samples_match_scalar_solves(diff_amp, variations):
+    mc = MonteCarlo(diff_amp.wires, variations, samples=200, seed=1).run()
+    assert mc.converged.all()
+
+    circuit = Circuit(diff_amp.wires)
+    circuit.incremental = False
+    for k in (0, 57, 123, 199):
+        saved = [(device, name, getattr(device, name)) for device, name in mc.parameters]
+        for (device, name), values in mc.parameters.items():
+            setattr(device, name, values[k])
+        circuit.solve()
+        np.testing.assert_allclose(mc.voltages[k], [wire.voltage for wire in diff_amp.wires],
+                                   atol=1e-9)
+        np.testing.assert_allclose(mc.currents[k], [wire.current for wire in diff_amp.wires],
+                                   atol=1e-9)
+        for device, name, value in saved:
+            setattr(device, name, value)
+
+
+def test_same_seed_same_samples_and_nominal_restored(diff_amp, variations):
+    nominal = {(device, name): getattr(device, name)
+               for device, distributions in variations.items() for name in distributions}
+    first = MonteCarlo(diff_amp.wires, variations, samples=50, seed=3).run()
+    second = MonteCarlo(diff_amp.wires, variations, samples=50, seed=3).run()
+    np.testing.assert_array_equal(first.voltages, second.voltages)
+    assert np.std(first.voltages[:, 0]) > 1e-3  # 標本ごとに実際に違う解になっている
+
+    # 解析の後は素子パラメータが公称値に戻っている
+    assert all(getattr(device, name) == value for (device, name), value in nominal.items())
+    np.testing.assert_allclose(first.nominal, [wire.voltage for wire in diff_amp.wires])
@@ -0,0 +1,34 @@
+from functools import partial
+from inverter import Inverter, inverter_task
+from parallel import parallel_sweep, parameter_grid
+import numpy as np
+
+
+L_arr = (0.5, 1, 2.0)
+shapes = {'Vout': (1000,), 'Ileak': (1000,)}
+
+
+def test_parallel_sweep_is_bit_identical_to_serial():
+    serial = parallel_sweep(inverter_task, L_arr, shapes, processes=1)
+    pooled = parallel_sweep(inverter_task, L_arr, shapes, processes=2)
+    for name in shapes:
+        assert np.array_equal(serial[name], pooled[name])
+
+
+def test_parallel_sweep_matches_direct_solve():
+    pooled = parallel_sweep(inverter_task, L_arr, shapes, processes=2)
+    for row, L in enumerate(L_arr):
+        inv = Inverter('pMOS', 'L', L)
+        assert np.array_equal(pooled['Vout'][row], inv.Vout_arr)
+        assert np.array_equal(pooled['Ileak'][row], inv.Ileak_arr)
+
+
+def test_parameter_grid_order():
+    names, params, shape = parameter_grid(W=[1, 2], L=[0.5, 1])
+    assert names == ('W', 'L')
+    assert params == [(1, 0.5), (1, 1), (2, 0.5), (2, 1)]
+    assert shape == (2, 2)
+    task = partial(inverter_task, mos='pMOS', name=names)
+    serial = parallel_sweep(task, params, shapes, processes=1)
+    pooled = parallel_sweep(task, params, shapes, processes=2)
+    assert np.array_equal(serial['Vout'], pooled['Vout'])
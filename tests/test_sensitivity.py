@@ -0,0 +1,75 @@
+from circuit import Circuit
+from diff_amp import DiffAmp
+from device import Resistor
+from inverter import Inverter
+from sensitivity import Sensitivity
+import numpy as np
+import pytest
+
+
+def finite_difference(circuit, wires, device, name, h=1e-6):
+    # パラメータを ±h ずらして解き直した中心差分
+    nominal = getattr(device, name)
+    h = h * max(abs(nominal), 1)
+    solved = []
+    for value in (nominal + h, nominal - h):
+        setattr(device, name, value)
+        circuit.solve()
+        solved.append(np.array([wire.voltage for wire in wires]))
+    setattr(device, name, nominal)
+    circuit.solve()
+    return (solved[0] - solved[1]) / (2 * h)
+
+
+@pytest.fixture
+def diff_amp(capsys):
+    da = DiffAmp(points=3)
+    capsys.readouterr()
+    for mos in da.mosz:
+        mos.lmd = 0.05  # lmd の感度も 0 にならないように
+    return da
+
+
+@pytest.mark.parametrize('sparse', [False, True])
+def test_adjoint_matches_finite_difference(diff_amp, sparse):
+    circuit = Circuit(diff_amp.wires)
+    circuit.incremental = False
+    sens = Sensitivity(diff_amp.wires, sparse=sparse).run()
+    for device in diff_amp.mosz + [diff_amp.R1, diff_amp.R2]:
+        names = ('R',) if isinstance(device, Resistor) else Sensitivity.params[:-1]
+        for name in names:
+            expected = finite_difference(circuit, diff_amp.wires, device, name)
+            adjoint = [sens.derivative(wire, device, name) for wire in diff_amp.wires]
+            np.testing.assert_allclose(adjoint, expected, rtol=1e-6, atol=1e-9)
+
+
+def test_outputs_subset(diff_amp):
+    full = Sensitivity(diff_amp.wires).run()
+    one = Sensitivity(diff_amp.wires, outputs=[diff_amp.wire2], solve=False).run()
+    for name in Sensitivity.params:
+        np.testing.assert_allclose(one.dV[name][..., 0, :], full.dV[name][..., 1, :], atol=1e-15)
+    with pytest.raises(ValueError):
+        one.derivative(diff_amp.wire1, diff_amp.nmos1, 'W')
+
+
+def test_batch_matches_pointwise(diff_amp):
+    Vg_arr = np.linspace(1.95, 2.05, 4)
+    diff_amp.nmos1.Vg = Vg_arr
+    batch = Sensitivity(diff_amp.wires).run()
+    for k, Vg in enumerate(Vg_arr):
+        diff_amp.nmos1.Vg = Vg
+        point = Sensitivity(diff_amp.wires).run()
+        for name in Sensitivity.params:
+            np.testing.assert_allclose(batch.dV[name][k], point.dV[name], rtol=1e-9, atol=1e-12)
+
+
+def test_inverter_sweep_matches_finite_difference():
+    inv = Inverter('pMOS', 'L', 1)
+    adjoint = inv.sensitivity()['pMOS']['L']
+    h = 1e-5
+    solved = []
+    for L in (1 + h, 1 - h):
+        inv.pmos1.L = L
+        solved.append(inv.solve_batch(inv.Vin_arr)['Vout'].copy())
+    inv.pmos1.L = 1
+    np.testing.assert_allclose(adjoint, (solved[0] - solved[1]) / (2 * h), rtol=0, atol=1e-5)
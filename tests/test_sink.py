@@ -0,0 +1,23 @@
+from sink import Sink, ArraySink, NpySink, NpzSink
+import numpy as np
+import pytest
+
+
+def test_sink_is_abstract():
+    with pytest.raises(TypeError):
+        Sink()
+
+
+@pytest.mark.parametrize('make', [lambda path: ArraySink(chunk=7),
+                                  lambda path: NpySink(str(path), chunk=7),
+                                  lambda path: NpzSink(str(path), chunk=7)])
+def test_round_trip(make, tmp_path):
+    t = np.arange(20, dtype=float)
+    V = np.arange(60, dtype=float).reshape(20, 3)
+    sink = make(tmp_path).open({'t': (), 'V': (3,)})
+    for row in range(5):
+        sink.append(t=t[row], V=V[row])
+    sink.write(t=t[5:], V=V[5:])
+    sink.close()
+    np.testing.assert_array_equal(sink['t'], t)
+    np.testing.assert_array_equal(sink['V'], V)
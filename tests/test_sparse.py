@@ -0,0 +1,38 @@
+from circuit import Circuit, SPARSE_NODES
+from device import nMOS, Resistor, FreeWire
+import numpy as np
+
+
+def ring(n=400, Vdd=5.0):
+    # 各ノードに Vdd からのプルアップ抵抗とゲート電圧の違うnMOS、隣のノードへの抵抗で輪にする
+    # 全ノードが1つの強連結成分になるので、ブロックに分かれずに全体をNewton法で解く
+    wires = [FreeWire(unit=k) for k in range(n)]
+    for k, wire in enumerate(wires):
+        pull_up, link, mos = Resistor(unit=k, R=5.0), Resistor(unit=k, R=1.0 + k % 7), nMOS(unit=k)
+        pull_up.Vh = Vdd
+        mos.Vg, mos.Vs = 1.0 + 2.0 * k / n, 0.0
+        wire.joint('ResistLo', pull_up)
+        wire.joint('Drain', mos)
+        wire.joint('ResistHi', link)
+        wires[(k + 1) % n].joint('ResistLo', link)
+    return wires
+
+
+def test_sparse_matches_dense_on_a_large_ring():
+    wires = ring()
+    assert len(Circuit(wires).blocks) == 1
+    results = {}
+    for sparse in (True, False):
+        for wire in wires:
+            wire.voltage = 0
+        circuit = Circuit(wires, sparse=sparse)
+        assert circuit.compiled.sparse == sparse
+        circuit.solve()
+        results[sparse] = np.array([wire.voltage for wire in wires])
+        assert circuit.residual_norm < 1e-9
+    np.testing.assert_allclose(results[True], results[False], rtol=0, atol=1e-10)
+
+
+def test_sparse_is_chosen_automatically_for_large_circuits():
+    assert Circuit(ring(SPARSE_NODES + 1)).compiled.sparse
+    assert not Circuit(ring(8)).compiled.sparse
@@ -0,0 +1,46 @@
+from collections import OrderedDict
+from device import small_signal
+import device
+import numpy as np
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def empty_cache(monkeypatch):
+    monkeypatch.setattr(device, '_tables', OrderedDict())
+
+
+def test_table_matches_square_law():
+    table = device.mos_table(2.0, 0.7, 0.1, points=61)
+    Vgs, Vds = np.meshgrid(np.linspace(0, 5, 37), np.linspace(0, 5, 41))
+    for a, b in zip(table(Vgs, Vds), small_signal(Vgs, Vds, 2.0, 0.7, 0.1)):
+        np.testing.assert_allclose(a, b, atol=1e-9)
+
+
+def test_disk_cache_is_off_by_default(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    device.mos_table(2.0, 0.7, 0.0, points=41)
+    assert device.TABLE_DIR is None
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_table_dir_is_read_at_call_time(monkeypatch, tmp_path):
+    monkeypatch.setattr(device, 'TABLE_DIR', str(tmp_path))
+    table = device.mos_table(2.0, 0.7, 0.0, points=41)
+    assert len(list(tmp_path.glob('*.npz'))) == 1
+
+    # メモリのキャッシュが無くてもディスクから同じ表が読める
+    monkeypatch.setattr(device, '_tables', OrderedDict())
+    loaded = device.mos_table(2.0, 0.7, 0.0, points=41)
+    assert loaded is not table
+    np.testing.assert_array_equal(loaded.coefficients, table.coefficients)
+
+
+def test_caches_are_bounded(monkeypatch, tmp_path):
+    monkeypatch.setattr(device, 'TABLE_DIR', str(tmp_path))
+    monkeypatch.setattr(device, 'TABLE_CACHE_SIZE', 2)
+    monkeypatch.setattr(device, 'TABLE_DISK_SIZE', 3)
+    tables = [device.mos_table(beta, 0.7, 0.0, points=21) for beta in (1.0, 2.0, 3.0, 4.0)]
+    assert len(device._tables) == 2
+    assert len(list(tmp_path.glob('*.npz'))) == 3
+    assert device.mos_table(4.0, 0.7, 0.0, points=21) is tables[-1]
@@ -0,0 +1,36 @@
+from device import Resistor, Capacitor, FreeWire
+from transient import Transient
+import numpy as np
+import pytest
+
+
+def rc(tau=1.0):
+    R, C = Resistor(unit=1, R=tau), Capacitor(unit=1, C=1.0)
+    wire = FreeWire()
+    R.Vh, C.Vb = 0.0, 0.0
+    wire.joint('ResistLo', R)
+    wire.joint('CapA', C)
+    return R, wire
+
+
+@pytest.mark.parametrize('method, tol', [('backward-euler', 2e-2), ('trapezoidal', 2e-3)])
+def test_rc_response_to_sine(method, tol):
+    # v' = (sin t - v) / τ, v(0) = 0 の解析解と比べる
+    tau = 1.0
+    R, wire = rc(tau)
+    transient = Transient([wire], lambda t: setattr(R, 'Vh', np.sin(t)), method=method,
+                          h_max=0.1)
+    times, voltages = transient.run(10.0)
+    exact = (np.sin(times) - tau * np.cos(times) + tau * np.exp(-times / tau)) / (1 + tau**2)
+    np.testing.assert_allclose(voltages[:, 0], exact, rtol=0, atol=tol)
+    assert times[-1] == 10.0
+
+
+def test_trapezoidal_takes_fewer_steps_than_backward_euler():
+    steps = {}
+    for method in ('backward-euler', 'trapezoidal'):
+        R, wire = rc()
+        transient = Transient([wire], lambda t: setattr(R, 'Vh', np.sin(t)), method=method)
+        times, _ = transient.run(10.0)
+        steps[method] = len(times)
+    assert steps['trapezoidal'] < steps['backward-euler']
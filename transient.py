@@ -0,0 +1,135 @@
+from circuit import Circuit
+from sink import ArraySink
+import numpy as np
+
+
+class Transient(object):
+    # コンデンサを含む回路の過渡解析．陰的積分(後退Euler / 台形則)で時間を進める
+    # 各時刻でコンデンサをコンパニオンモデル(コンダクタンス geq と電流源 ihist)に置き換え、
+    # CompiledCircuit.newton でKCLを解く．初期値は前の時刻の解からの線形外挿
+    # 局所打ち切り誤差(LTE)を差分商から見積もって刻み幅を自動で調整する
+    # stimulus(t) は時刻tの入力を素子に設定する関数(例: nmos.Vg = sin(t))
+    methods = {'backward-euler': 1, 'trapezoidal': 2}  # 積分法と次数
+
+    def __init__(self, wires, stimulus=None, method='trapezoidal', reltol=1e-3, abstol=1e-6,
+                 h_min=1e-12, h_max=np.inf, xtol=1e-12, ftol=1e-12, max_iter=50):
+        if method not in self.methods:
+            raise NameError('method: Invalid name')
+        self.circuit = Circuit(wires, xtol=xtol, ftol=ftol, max_iter=max_iter)
+        self.compiled = self.circuit.compiled
+        self.stimulus = stimulus
+        self.method = method
+        self.order = self.methods[method]
+        self.reltol = reltol  # LTEの相対許容誤差
+        self.abstol = abstol  # LTEの絶対許容誤差[V]
+        self.h_min = h_min
+        self.h_max = h_max
+        self.rejected = 0  # LTEかNewtonの失敗で棄却したステップ数
+        self.iteration = 0  # Newton反復回数の合計
+
+    def apply(self, t):
+        # 時刻tの入力を素子に設定して、固定端子とパラメータを読み直す
+        if self.stimulus is not None:
+            self.stimulus(t)
+        self.compiled.update()
+
+    def capacitor_voltage(self, voltages):
+        x = self.compiled.extend(voltages)
+        return x[..., self.compiled.a] - x[..., self.compiled.b]
+
+    def companion(self, h, vc, ic):
+        # 後退Euler: Ic = C/h * (Vc - vc)
+        # 台形則    : Ic = 2C/h * (Vc - vc) - ic
+        C = self.compiled.C
+        if self.order == 1:
+            geq = C / h
+            return geq, -geq * vc
+        geq = 2 * C / h
+        return geq, -geq * vc - ic
+
+    def lte(self, times, voltages):
+        # 直近の (order+2) 点の差分商から局所打ち切り誤差を見積もる
+        # 後退Euler: h^2/2 * |x''|、台形則: h^3/12 * |x'''|
+        k = self.order + 1
+        if len(times) < k + 1:
+            return None
+        t, x = np.array(times[-k - 1:]), np.array(voltages[-k - 1:])
+        for i in range(1, k + 1):
+            x = (x[1:] - x[:-1]) / (t[i:] - t[:-i])[:, None]
+        h = t[-1] - t[-2]
+        if self.order == 1:
+            return h ** 2 * np.abs(x[0])  # x'' = 2 * 2階差分商
+        return h ** 3 / 2 * np.abs(x[0])  # x''' = 6 * 3階差分商
+
+    def operating_point(self):
+        # t=0 の直流動作点．コンデンサは開放
+        self.apply(0.0)
+        self.compiled.set_companion()
+        self.circuit.solve()
+        return np.array([wire.voltage for wire in self.circuit.wires], dtype=float)
+
+    def run(self, t_stop, h=None, sink=None):
+        # 0 から t_stop まで積分して (時刻の配列, 各FreeWireの電圧 (時刻数, ノード数)) を返す
+        # h は最初の刻み幅．省略時は t_stop / 1000
+        # 採用した時刻は sink(既定はメモリ上の ArraySink)の列 't' / 'V' に書き込む
+        self.sink = sink = ArraySink() if sink is None else sink
+        sink.open({'t': (), 'V': (self.compiled.n,)})
+        v = self.operating_point()
+        vc, ic = self.capacitor_voltage(v), np.zeros(len(self.compiled.capacitors))
+        times, voltages = [0.0], [v]  # 予測子とLTEに使う直近の数点だけ持つ
+        sink.append(t=0.0, V=v)
+        h = min(t_stop / 1000 if h is None else h, self.h_max)
+        t = 0.0
+
+        while t < t_stop:
+            t_new = t + h
+            if t_new >= t_stop:
+                t_new, h = t_stop, t_stop - t  # 最後のステップはちょうど t_stop に合わせる
+            self.apply(t_new)
+            geq, ihist = self.companion(h, vc, ic)
+            self.compiled.set_companion(geq, ihist)
+
+            # 予測子: 前の2点からの線形外挿．制約を外れたら前の時刻の解
+            guess = v
+            if len(times) >= 2:
+                guess = v + (v - voltages[-2]) * h / (t - times[-2])
+                if not np.all(self.compiled.feasible(guess)):
+                    guess = v
+            try:
+                v_new, iteration, _ = self.compiled.newton(
+                    guess, self.circuit.xtol, self.circuit.ftol, self.circuit.max_step, self.circuit.max_iter)
+            except RuntimeError:
+                self.rejected += 1
+                h /= 4
+                if h < self.h_min:
+                    raise RuntimeError('Transient: time step too small at t = {0}'.format(t))
+                continue
+            self.iteration += iteration
+
+            # LTEと許容誤差の比で、棄却 / 採用と次の刻み幅を決める
+            error = self.lte(times + [t_new], voltages + [v_new])
+            ratio = 0.0
+            if error is not None:
+                tol = self.reltol * np.maximum(np.abs(v_new), np.abs(v)) + self.abstol
+                ratio = np.max(error / tol, initial=0)
+            factor = 2.0 if ratio == 0 else min(2.0, 0.9 * ratio ** (-1 / (self.order + 1)))
+            if ratio > 1 and h > self.h_min:
+                self.rejected += 1
+                h = max(h * max(factor, 0.25), self.h_min)
+                continue
+
+            # 採用: コンデンサの電圧と電流を更新
+            self.compiled.evaluate(v_new)
+            vc, ic = self.capacitor_voltage(v_new), np.array(self.compiled.Ic, dtype=float)
+            t, v = t_new, v_new
+            times.append(t)
+            voltages.append(v)
+            del times[:-(self.order + 1)], voltages[:-(self.order + 1)]
+            sink.append(t=t, V=v)
+            h = min(h * factor, self.h_max)
+
+        self.circuit.set_voltages(v)
+        for capacitor, voltage in zip(self.compiled.capacitors, vc):
+            capacitor.Q = capacitor.C * voltage
+        sink.close()
+        return sink['t'], sink['V']